@@ -2,6 +2,7 @@ import streamlit as st
 import pandas as pd
 import json
 import os
+import threading
 import plotly.graph_objects as go
 import plotly.express as px
 from datetime import datetime
@@ -11,11 +12,19 @@ from dotenv import load_dotenv
 # Load environment variables
 load_dotenv()
 
-from utils.fetcher import fetch_multiple_stocks, fetch_stock_data, get_stock_name, get_tw_stock_candidates, get_institutional_data
-from utils.technical import calculate_indicators
-from utils.scorer import calculate_health_score
-from utils.scanner import scan_potential_stocks
-from utils.ai_writer import generate_stock_script
+from utils.fetcher import fetch_multiple_stocks, fetch_stocks_bulk, fetch_stock_data, get_stock_name, get_tw_stock_candidates, get_institutional_data
+from utils.symbols import lookup_names
+from utils import universe, pipeline, trading_calendar, store, intraday, timeframes
+from utils.timeframes import TIMEFRAMES, DEFAULT_TIMEFRAME
+from utils.cache import SymbolCache
+from utils.panel import CompactPanel
+from utils.technical import (calculate_indicators, calculate_indicators_panel, indicator_spec, changed_indicators,
+                             spec_key, sma_columns, macd_columns, bbands_columns)
+from utils.scorer import calculate_health_score_series, summarize_health_series
+from utils.scanner import scan_potential_stocks, scan_with_rule, scan_fields, DEFAULT_SCREEN
+from utils.rules import RuleSyntaxError, load_screens, save_screen
+from utils.charting import VISIBLE_RANGES, visible_slice, candlestick_trace, line_trace, downsample_bars, figure_stats
+from utils.ai_writer import stream_stock_script, generate_scripts_batch, DEFAULT_WORKERS, MAX_WORKERS
 
 # Page Config
 st.set_page_config(page_title="台股全方位戰情室", layout="wide", initial_sidebar_state="expanded")
@@ -38,6 +47,11 @@ def save_stock_list(stocks):
     with open(DATA_FILE, "w") as f:
         json.dump(stocks, f)
 
+@st.cache_resource
+def get_symbol_cache():
+    # 依 (資料種類, 股票) 分開的快取，跨 rerun 與使用者共用
+    return SymbolCache()
+
 # --- Sidebar ---
 st.sidebar.title("🛠️ 控制中心")
 stock_list = load_stock_list()
@@ -61,12 +75,27 @@ if st.sidebar.button("➖ 刪除"):
 
 # Settings
 rsi_period = st.sidebar.slider("RSI 週期", 5, 30, 14)
+indicator_params = indicator_spec(rsi=rsi_period)
+# 週線、月線由本地日 K 重新取樣，不另外向資料源請求
+timeframe = st.sidebar.selectbox("K 線週期", list(TIMEFRAMES), format_func=lambda tf: TIMEFRAMES[tf]["label"], key="timeframe")
 
 # Update Data Button
+refresh_target = st.sidebar.selectbox("更新範圍", ["全部自選股"] + stock_list, key="refresh_target")
 if st.sidebar.button("🔄 更新數據"):
-    st.cache_data.clear()
+    # 只讓指定股票的行情與法人資料失效，其他股票與名稱快取不受影響
+    targets = stock_list if refresh_target == "全部自選股" else [refresh_target]
+    # K 線本身存在本地資料庫，標記過期後由衍生的指標 (連同健康分) 一起失效
+    store.mark_stale(targets)
+    get_symbol_cache().invalidate(targets, kinds=("indicators", "flows"))
+    # 手動更新的股票改用即時資料，直到出現比現在更新的盤後快照
+    st.session_state.setdefault("live_symbols", set()).update(targets)
+    st.session_state["live_since"] = pipeline.latest_version()
     st.rerun()
 
+# 盤中即時模式
+live_mode = st.sidebar.toggle("⚡ 盤中即時模式", value=False, help="交易時段內輪詢即時報價，增量更新當日 K 棒、指標與健康分")
+live_interval = st.sidebar.slider("即時更新間隔 (秒)", 5, 60, 15) if live_mode else None
+
 st.sidebar.divider()
 st.sidebar.subheader("📈 全局分析對象")
 if stock_list:
@@ -97,16 +126,135 @@ if not gemini_api_key:
     st.sidebar.info("💡 請輸入 API Key 或在 .env 設定 GEMINI_API_KEY 以啟用功能")
 
 # --- Data Loading ---
-@st.cache_data(ttl=3600)
-def get_all_data(symbols):
-    data = fetch_multiple_stocks(symbols)
-    processed_data = {}
-    for sym, df in data.items():
-        processed_data[sym] = calculate_indicators(df)
-    return processed_data
+@st.cache_resource
+def open_snapshot(version):
+    # 盤後流程 (python -m utils.pipeline run) 寫出的快照，陣列以 mmap 開啟
+    return pipeline.load_snapshot(version)
+
+def current_snapshot(symbols=()):
+    """
+    The latest snapshot if it is newer than the last close and holds every given symbol.
+    """
+    version = pipeline.latest_version()
+    snapshot = open_snapshot(version) if version else None
+    if snapshot is None or not snapshot.is_fresh() or not snapshot.covers(symbols):
+        return None
+    return snapshot
+
+def _data_sources(symbols):
+    """
+    Split symbols into (epoch, symbols, snapshot) groups: symbols in the latest
+    snapshot are read from it, the rest are fetched live under the trading-calendar epoch.
+    """
+    snapshot = current_snapshot()
+    live = st.session_state.get("live_symbols", set())
+    if live and snapshot is not None and snapshot.version != st.session_state.get("live_since"):
+        # 手動更新之後已產生新的盤後快照，這些股票回到快照
+        live.clear()
+    in_snapshot = [s for s in symbols if snapshot is not None and s in snapshot.symbols and s not in live]
+    groups = []
+    if in_snapshot:
+        groups.append((f"snapshot-{snapshot.version}", in_snapshot, snapshot))
+    rest = [s for s in symbols if s not in in_snapshot]
+    if rest:
+        groups.append((trading_calendar.bars_epoch(), rest, None))
+    return groups
+
+def _variant(timeframe, spec):
+    # 非日線或非預設指標參數的衍生資料分開快取，例如 "1w" 或 "1d:rsi=9"
+    key = spec_key(spec) if spec else ""
+    if not key:
+        return "" if timeframe == DEFAULT_TIMEFRAME else timeframe
+    return f"{timeframe}:{key}"
+
+def with_indicator_spec(data, timeframe, spec):
+    # 預設參數的指標已隨 K 線一起算好，只重算參數不同的指標 (依股票、指標、參數與資料版本記憶)
+    changed = changed_indicators(spec) if spec else {}
+    if not changed:
+        return data
+    return {sym: calculate_indicators(df, changed, symbol=f"{sym}@{timeframe}") for sym, df in data.items()}
+
+def get_all_data(symbols, timeframe=DEFAULT_TIMEFRAME, spec=None):
+    # 每檔股票各自快取：新增一檔只會抓取、計算那一檔
+    symbol_cache = get_symbol_cache()
+    if timeframe != DEFAULT_TIMEFRAME:
+        # 其他週期需要較長的日 K，取樣結果依 (股票, 週期, 資料版本) 記憶
+        period = TIMEFRAMES[timeframe]["period"]
+        compute = lambda missing: calculate_indicators_panel(
+            timeframes.resample_many(fetch_multiple_stocks(missing, period=period), timeframe))
+        data = symbol_cache.get_many(f"indicators@{timeframe}", symbols, trading_calendar.bars_epoch(), compute)
+        return with_indicator_spec({sym: data[sym] for sym in symbols if sym in data}, timeframe, spec)
+    data = {}
+    for epoch, group, snapshot in _data_sources(symbols):
+        if snapshot is not None:
+            compute = snapshot.data_dict
+        else:
+            compute = lambda missing: calculate_indicators_panel(fetch_multiple_stocks(missing))
+        data.update(symbol_cache.get_many("indicators", group, epoch, compute))
+    return with_indicator_spec({sym: data[sym] for sym in symbols if sym in data}, timeframe, spec)
+
+def get_health_history(symbols, timeframe=DEFAULT_TIMEFRAME, spec=None):
+    # 每檔股票整段歷史的健康分數與觸發規則
+    symbol_cache = get_symbol_cache()
+    variant = _variant(timeframe, spec)
+    if variant:
+        compute = lambda missing: {sym: calculate_health_score_series(df, spec) for sym, df in get_all_data(missing, timeframe, spec).items()}
+        return symbol_cache.get_many(f"health@{variant}", symbols, trading_calendar.bars_epoch(), compute)
+    history = {}
+    for epoch, group, snapshot in _data_sources(symbols):
+        if snapshot is not None:
+            compute = lambda missing, snap=snapshot: {sym: snap.health(sym) for sym in missing}
+        else:
+            compute = lambda missing: {sym: calculate_health_score_series(df) for sym, df in get_all_data(missing).items()}
+        history.update(symbol_cache.get_many("health", group, epoch, compute))
+    return history
+
+def get_flows(symbol):
+    # 三大法人資料在證交所公布新一日報表時失效
+    return get_symbol_cache().get("flows", symbol, trading_calendar.flows_epoch(),
+                                  lambda: get_institutional_data(symbol))
+
+@st.cache_data(max_entries=8, show_spinner="📋 正在更新全市場流動性統計 (首次約需數分鐘)...")
+def get_universe_members(name, day):
+    # 統計量每個交易日收盤後重建一次；K 線資料庫只會補抓缺少的日期
+    stats = universe.load_stats()
+    if not universe.stats_fresh(stats):
+        stats, _ = universe.refresh_stats()
+    return universe.get_universe(name, stats)
 
 with st.spinner("🚀 正在獲取最新行情..."):
-    all_processed_data = get_all_data(stock_list)
+    all_processed_data = get_all_data(stock_list, timeframe, indicator_params)
+
+def render_live_panel(data_dict, interval, spec=None):
+    """
+    Intraday table refreshed inside a fragment, so each poll only reruns this block.
+    """
+    feed = st.session_state.get("intraday_feed")
+    if feed is None:
+        feed = st.session_state["intraday_feed"] = intraday.default_feed()
+    # 自選股或日 K 資料換版時重建盤中狀態
+    session_key = (tuple(data_dict), trading_calendar.bars_epoch(), spec_key(spec or {}))
+    if st.session_state.get("intraday_key") != session_key:
+        st.session_state["intraday_key"] = session_key
+        st.session_state["intraday_session"] = intraday.IntradaySession(data_dict, spec)
+
+    @st.fragment(run_every=interval)
+    def live_panel():
+        st.subheader("⚡ 盤中即時健康度")
+        if not feed.replay and not trading_calendar.in_session():
+            st.info("目前非交易時段，即時模式將於開盤後自動更新。")
+            return
+        session = st.session_state["intraday_session"]
+        session.poll(feed)
+        live_df = session.rows()
+        if live_df.empty:
+            st.write("尚未取得即時報價。")
+            return
+        live_df.insert(1, "名稱", lookup_names(live_df["代號"]).values)
+        st.dataframe(live_df.sort_values("健康分", ascending=False), use_container_width=True, hide_index=True)
+        st.caption(f"最後更新：{session.updated:%H:%M:%S}，每 {interval} 秒輪詢一次（暫時 K 棒，收盤後以正式日 K 取代）")
+
+    live_panel()
 
 # --- Main App ---
 # 改用導覽選單判斷顯示內容，徹底解決跳轉問題
@@ -114,13 +262,22 @@ if page == "health":
     if not all_processed_data:
         st.info("請在側邊欄新增股票以開始分析。")
     else:
+        if live_mode and timeframe != DEFAULT_TIMEFRAME:
+            st.info("⚡ 盤中即時模式僅適用於日線，請將 K 線週期切回日線。")
+        elif live_mode:
+            render_live_panel(all_processed_data, live_interval, indicator_params)
+            st.divider()
+
         # Calculate scores for all
+        health_history = get_health_history(list(all_processed_data), timeframe, indicator_params)
         health_results = []
         for sym, df in all_processed_data.items():
-            score, rating, reasons = calculate_health_score(df)
+            history = health_history[sym]
+            score, rating, reasons = summarize_health_series(history)
             name = get_stock_name(sym)
             last_row = df.iloc[-1]
-            bias_60 = (last_row['Close'] - last_row['SMA60']) / last_row['SMA60'] * 100
+            sma_quarter = last_row[sma_columns(indicator_params)[3]]
+            bias_60 = (last_row['Close'] - sma_quarter) / sma_quarter * 100
             health_results.append({
                 "代號": sym,
                 "名稱": name,
@@ -130,7 +287,8 @@ if page == "health":
                 "RSI": round(last_row['RSI'], 2),
                 "季線乖離%": round(bias_60, 2),
                 "建議": "續抱" if rating == "健康" else ("觀望" if rating == "中立" else "減碼/停損"),
-                "原因": ", ".join(reasons)
+                "原因": ", ".join(reasons),
+                "分數走勢": history['score'].dropna().tail(60).round(1).tolist()
             })
         
         health_df = pd.DataFrame(health_results)
@@ -165,7 +323,13 @@ if page == "health":
         
         # Table
         st.subheader("詳細評分表")
-        st.dataframe(health_df.sort_values("健康分", ascending=False), use_container_width=True)
+        st.dataframe(
+            health_df.sort_values("健康分", ascending=False),
+            use_container_width=True,
+            column_config={
+                "分數走勢": st.column_config.LineChartColumn("分數走勢 (近 60 日)", y_min=0, y_max=10)
+            }
+        )
 
         # --- Tiger's Insight (理性的冒險家觀點) ---
         st.divider()
@@ -204,33 +368,40 @@ elif page == "tech":
         selected_stock = st.session_state.selected_stock
         if selected_stock in all_processed_data:
             df = all_processed_data[selected_stock]
+            # 只把可見範圍降採樣後的點送到瀏覽器
+            range_label = st.radio("顯示範圍", list(VISIBLE_RANGES.keys()), index=len(VISIBLE_RANGES) - 1, horizontal=True)
+            visible_days = VISIBLE_RANGES[range_label]
+            chart_df = visible_slice(df, visible_days and max(visible_days // TIMEFRAMES[timeframe]["days"], 2))
             
             # Candlestick Chart
             fig = go.Figure()
             # K-line
-            fig.add_trace(go.Candlestick(
-                x=df.index, open=df['Open'], high=df['High'], low=df['Low'], close=df['Close'],
-                name="K線"
-            ))
+            fig.add_trace(candlestick_trace(chart_df, name="K線"))
             # Bollinger Bands
-            fig.add_trace(go.Scatter(x=df.index, y=df['BBU_20_2.0'], name='布林上軌', line=dict(color='rgba(173, 216, 230, 0.4)')))
-            fig.add_trace(go.Scatter(x=df.index, y=df['BBM_20_2.0'], name='布林中軌', line=dict(color='orange')))
-            fig.add_trace(go.Scatter(x=df.index, y=df['BBL_20_2.0'], name='布林下軌', line=dict(color='rgba(173, 216, 230, 0.4)'), fill='tonexty'))
+            bbm_col, bbu_col, bbl_col = bbands_columns(indicator_params)
+            fig.add_trace(line_trace(chart_df[bbu_col], name='布林上軌', line=dict(color='rgba(173, 216, 230, 0.4)')))
+            fig.add_trace(line_trace(chart_df[bbm_col], name='布林中軌', line=dict(color='orange')))
+            fig.add_trace(line_trace(chart_df[bbl_col], name='布林下軌', line=dict(color='rgba(173, 216, 230, 0.4)'), fill='tonexty'))
             
-            fig.update_layout(height=600, template="plotly_dark", title=f"{selected_stock} 技術圖表", xaxis_rangeslider_visible=False)
+            fig.update_layout(height=600, template="plotly_dark", title=f"{selected_stock} 技術圖表 ({TIMEFRAMES[timeframe]['label']})", xaxis_rangeslider_visible=False)
             st.plotly_chart(fig, use_container_width=True)
             
             # MACD Chart
+            macd_col, signal_col, hist_col = macd_columns(indicator_params)
             fig_macd = go.Figure()
-            fig_macd.add_trace(go.Bar(x=df.index, y=df['MACDh_12_26_9'], name='MACD柱子'))
-            fig_macd.add_trace(go.Scatter(x=df.index, y=df['MACD_12_26_9'], name='MACD', line=dict(color='yellow')))
-            fig_macd.add_trace(go.Scatter(x=df.index, y=df['MACDs_12_26_9'], name='Signal', line=dict(color='cyan')))
+            macd_hist = downsample_bars(chart_df[hist_col])
+            fig_macd.add_trace(go.Bar(x=macd_hist.index, y=macd_hist, name='MACD柱子'))
+            fig_macd.add_trace(line_trace(chart_df[macd_col], name='MACD', line=dict(color='yellow')))
+            fig_macd.add_trace(line_trace(chart_df[signal_col], name='Signal', line=dict(color='cyan')))
             fig_macd.update_layout(height=300, template="plotly_dark", title="MACD 指標")
             st.plotly_chart(fig_macd, use_container_width=True)
+            chart_stats = [figure_stats(f) for f in (fig, fig_macd)]
+            st.caption(f"圖表資料：{len(chart_df)} 根 K 棒，送出 {sum(c['points'] for c in chart_stats)} 點，"
+                       f"{sum(c['bytes'] for c in chart_stats) / 1024:.0f} KB，序列化 {sum(c['seconds'] for c in chart_stats) * 1000:.0f} ms")
             
             # Institutional Investors Chart (三大法人買賣超)
             st.subheader("📊 三大法人買賣超")
-            institutional_df = get_institutional_data(selected_stock)
+            institutional_df = get_flows(selected_stock)
             
             if institutional_df.empty:
                 st.warning("⚠️ 無法取得三大法人資料 (可能因證交所限制或資料暫不可用)")
@@ -282,26 +453,85 @@ elif page == "tech":
 elif page == "scanner":
     st.header("💎 潛力尋寶：尋找壓縮待變")
     
-    scan_mode = st.radio("掃描範圍", ["僅自選股", "全市場優質股 (約 160 檔)"], horizontal=True)
+    universe_labels = {spec["label"]: name for name, spec in universe.UNIVERSES.items()}
+    scan_mode = st.radio("掃描範圍", ["僅自選股", "全市場優質股 (約 160 檔)"] + list(universe_labels), horizontal=True)
     
+    scan_snapshot = None
     if scan_mode == "僅自選股":
         scanner_data = all_processed_data
     else:
-        with st.spinner("🔍 正在掃描全市場優質個股，請稍候... (約需 20-30 秒)"):
+        if scan_mode in universe_labels:
+            # 先以流動性、上市時間與股價預先篩選，只對通過的股票計算指標
+            candidates = get_universe_members(universe_labels[scan_mode], trading_calendar.last_final_close().strftime("%Y-%m-%d"))
+            st.caption(f"股票池「{scan_mode}」共 {len(candidates)} 檔")
+        else:
             candidates = get_tw_stock_candidates()
-            # Use shorter period for scanning to speed up
-            scanner_data_raw = fetch_multiple_stocks(candidates, period="6mo")
-            scanner_data = {}
-            for sym, df in scanner_data_raw.items():
-                scanner_data[sym] = calculate_indicators(df)
+        # 盤後快照只有日線
+        scan_snapshot = current_snapshot(candidates) if timeframe == DEFAULT_TIMEFRAME else None
+        if scan_snapshot is not None:
+            # 盤後快照已包含整個股票池，資料等用到時才讀 (內建條件直接讀快照的掃描結果)
+            failed_symbols = []
+            st.caption(f"使用盤後快照 {scan_snapshot.version}")
+        else:
+            with st.spinner("🔍 正在掃描全市場個股，請稍候..."):
+                # Use shorter period for scanning to speed up
+                scanner_data_raw, failed_symbols = fetch_stocks_bulk(candidates, period=TIMEFRAMES[timeframe]["scan_period"])
+                # 全市場資料改存成精簡面板，只計算掃描用到的指標
+                scanner_data = CompactPanel.from_frames(timeframes.resample_many(scanner_data_raw, timeframe), spec=indicator_params)
+        if failed_symbols:
+            st.warning(f"⚠️ {len(failed_symbols)} 檔股票抓取失敗，已略過：{', '.join(sorted(failed_symbols))}")
     
-    scanner_df = scan_potential_stocks(scanner_data)
+    # --- 自訂篩選規則 ---
+    with st.expander("🧩 自訂篩選規則"):
+        saved_screens = load_screens()
+        screen_choice = st.selectbox("已儲存的規則", ["內建條件"] + list(saved_screens.keys()))
+        rule_text = st.text_area(
+            "篩選規則",
+            value=saved_screens.get(screen_choice, DEFAULT_SCREEN),
+            key=f"rule_text_{screen_choice}",
+            help="例如：SMA20/SMA60 within 5% AND Volume < 0.7*VOL_SMA20。支援 AND / OR / NOT、括號、rank()、prev()、abs()、min()、max()"
+        )
+        use_rule = st.checkbox("使用自訂規則掃描", value=screen_choice != "內建條件")
+        col_name, col_save = st.columns([3, 1])
+        with col_name:
+            screen_name = st.text_input("規則名稱", key="screen_name")
+        with col_save:
+            st.write(" ") # 調整對齊
+            if st.button("💾 儲存規則", use_container_width=True):
+                if not screen_name:
+                    st.warning("請先輸入規則名稱")
+                else:
+                    try:
+                        save_screen(screen_name, rule_text)
+                        st.success(f"已儲存規則「{screen_name}」")
+                    except RuleSyntaxError as e:
+                        st.error(f"規則語法錯誤：{e}")
+
+    snapshot_scan = None
+    if scan_snapshot is not None and not use_rule and scan_fields(indicator_params) == scan_fields():
+        snapshot_scan = scan_snapshot.scanner(candidates)
+    if scan_snapshot is not None and snapshot_scan is None:
+        # 自訂規則或參數需要逐檔資料；切出與現場掃描相同的期間
+        scan_start = store.period_start(TIMEFRAMES[timeframe]["scan_period"])
+        snapshot_data = {sym: store.slice_period(df, scan_start) for sym, df in scan_snapshot.data_dict(candidates).items()}
+        scanner_data = with_indicator_spec(snapshot_data, timeframe, indicator_params)
+
+    if snapshot_scan is not None:
+        scanner_df = snapshot_scan
+    elif use_rule:
+        try:
+            scanner_df = scan_with_rule(scanner_data, rule_text, indicator_params)
+        except RuleSyntaxError as e:
+            st.error(f"規則語法錯誤：{e}")
+            scanner_df = pd.DataFrame()
+    else:
+        scanner_df = scan_potential_stocks(scanner_data, indicator_params)
     
     if scanner_df.empty:
         st.write("目前範圍中暫無符合「均線糾結/量低/波動小」條件的股票。")
     else:
         # Add Names
-        scanner_df['名稱'] = scanner_df['代碼'].apply(get_stock_name)
+        scanner_df['名稱'] = lookup_names(scanner_df['代碼']).values
         
         # Scatter Plot for Scanning
         fig_scan = px.scatter(
@@ -337,28 +567,79 @@ elif page == "scanner":
             st.write(" ") # 調整對齊
             generate_btn = st.button("✨ 生成解盤腳本", use_container_width=True)
             
+        # 切換選擇時中止上一檔仍在串流中的生成
+        if st.session_state.get('script_target') != selected_stock_code and 'script_cancel' in st.session_state:
+            st.session_state.pop('script_cancel').set()
+
         if generate_btn:
             if not gemini_api_key:
                 st.error("❌ 請先在側邊欄輸入 Gemini API Key！")
             else:
                 selected_row = scanner_df[scanner_df['代碼'] == selected_stock_code].iloc[0].to_dict()
-                with st.spinner(f"正在為 {selected_row['名稱']} 撰寫劇本..."):
-                    # 抓取法人資料
-                    institutional_df = get_institutional_data(selected_stock_code)
-                    script_content = generate_stock_script(
-                        gemini_api_key, 
-                        selected_row['名稱'], 
+                # 抓取法人資料
+                institutional_df = get_flows(selected_stock_code)
+                cancel_event = threading.Event()
+                st.session_state['script_cancel'] = cancel_event
+                st.session_state['script_target'] = selected_stock_code
+                script_stats = {}
+                stream_box = st.empty()
+                with stream_box.container():
+                    st.caption(f"正在為 {selected_row['名稱']} 撰寫劇本...")
+                    script_content = st.write_stream(stream_stock_script(
+                        gemini_api_key,
+                        selected_row['名稱'],
                         selected_row,
-                        institutional_df if not institutional_df.empty else None
-                    )
+                        institutional_df if not institutional_df.empty else None,
+                        cancel=cancel_event,
+                        stats=script_stats
+                    ))
+                stream_box.empty()
+                st.session_state['script_stats'] = script_stats
+                if not script_stats.get("cancelled"):
                     st.session_state['generated_script'] = script_content
-        
+                st.session_state.pop('script_cancel', None)
+
         if 'generated_script' in st.session_state:
             st.divider()
             st.info("✅ 腳本生成完畢！")
             st.code(st.session_state['generated_script'], language="markdown")
             st.caption("💡 提示：點擊右上角按鈕即可複製腳本")
 
+        if 'script_stats' in st.session_state:
+            with st.expander("🛠️ 除錯資訊"):
+                script_stats = st.session_state['script_stats']
+                ttft = script_stats.get("ttft")
+                col_ttft, col_total, col_chunks = st.columns(3)
+                col_ttft.metric("首字延遲 (TTFT)", f"{ttft * 1000:.0f} ms" if ttft is not None else "-")
+                col_total.metric("總耗時", f"{script_stats.get('total', 0) * 1000:.0f} ms")
+                col_chunks.metric("串流片段數", script_stats.get("chunks", 0))
+                st.caption(f"快取命中: {'是' if script_stats.get('cached') else '否'}"
+                           f"{'｜已中止' if script_stats.get('cancelled') else ''}")
+
+        # --- Batch Script Generation ---
+        with st.expander("📚 批次生成多檔腳本"):
+            batch_labels = st.multiselect("選擇要生成腳本的潛力股", list(script_options.keys()),
+                                          default=list(script_options.keys())[:3])
+            batch_workers = st.slider("同時生成數量", 1, MAX_WORKERS, DEFAULT_WORKERS,
+                                      help="同時送出的 API 請求上限，過高可能觸發每分鐘請求限制")
+            if st.button("✨ 批次生成", disabled=not batch_labels):
+                if not gemini_api_key:
+                    st.error("❌ 請先在側邊欄輸入 Gemini API Key！")
+                else:
+                    batch_items = {}
+                    for label in batch_labels:
+                        code = script_options[label]
+                        row = scanner_df[scanner_df['代碼'] == code].iloc[0].to_dict()
+                        flows = get_flows(code)
+                        batch_items[label] = (row['名稱'], row, flows if not flows.empty else None)
+                    with st.spinner(f"正在同時撰寫 {len(batch_items)} 份劇本..."):
+                        st.session_state['batch_scripts'] = generate_scripts_batch(
+                            gemini_api_key, batch_items, max_workers=batch_workers)
+
+            for label, script in st.session_state.get('batch_scripts', {}).items():
+                st.markdown(f"**{label}**")
+                st.code(script, language="markdown")
+
 # --- Tab 4: Strategy Backtest ---
 elif page == "backtest":
     st.header("📊 策略回測")
@@ -366,14 +647,22 @@ elif page == "backtest":
         st.info("請先新增股票。")
     elif st.session_state.selected_stock:
         selected_stock = st.session_state.selected_stock
-        if selected_stock in all_processed_data:
-            df = all_processed_data[selected_stock]
+        backtest_mode = st.radio("回測模式", ["單一個股", "自選股組合"], horizontal=True)
+        # 回測的成本與年化指標以日 K 為準，其他週期時仍使用日線資料
+        backtest_data = all_processed_data if timeframe == DEFAULT_TIMEFRAME else get_all_data(stock_list)
+        if timeframe != DEFAULT_TIMEFRAME:
+            st.caption("回測固定使用日線資料。")
+        if backtest_mode == "自選股組合" or selected_stock in backtest_data:
+            df = backtest_data.get(selected_stock)
             try:
                 import utils.backtest
                 import importlib
                 importlib.reload(utils.backtest)
-                from utils.backtest import run_taiwan_stock_backtest
-                run_taiwan_stock_backtest(df, symbol_name=get_stock_name(selected_stock))
+                from utils.backtest import run_taiwan_stock_backtest, run_portfolio_backtest
+                if backtest_mode == "自選股組合":
+                    run_portfolio_backtest(backtest_data, names={s: get_stock_name(s) for s in backtest_data})
+                else:
+                    run_taiwan_stock_backtest(df, symbol_name=get_stock_name(selected_stock), symbol=selected_stock, universe=backtest_data)
             except ImportError:
                 st.error("找不到套件 `vectorbt`。")
                 st.info("請在終端機執行 `pip install vectorbt` 完成安裝後重新整理網頁。")
@@ -0,0 +1,94 @@
+"""
+Peak memory of the per-symbol DataFrame layout versus CompactPanel.
+
+Each layout runs in its own subprocess so ru_maxrss only reflects that layout:
+
+    python benchmarks/memory_panel.py --symbols 1800 --years 10
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import synthetic  # noqa: E402
+
+
+def synthetic_frames(n_symbols, years, seed=0):
+    """
+    Raw yfinance-shaped daily bars, every symbol listed for the whole period.
+    """
+    return synthetic.market(n_symbols, years, seed=seed, listed_share=1.0)
+
+
+def _peak_rss_mb():
+    # Linux 回報 KB，macOS 回報 bytes
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+
+
+def run_layout(layout, n_symbols, years):
+    from utils.technical import calculate_indicators_panel
+    from utils.panel import CompactPanel
+    from utils.scanner import scan_potential_stocks
+
+    baseline = _peak_rss_mb()
+    frames = synthetic_frames(n_symbols, years)
+    started = time.perf_counter()
+    if layout == "frames":
+        data = calculate_indicators_panel(frames)
+        del frames
+        retained = sum(int(df.memory_usage(index=True).sum()) for df in data.values())
+    else:
+        data = CompactPanel.from_frames(frames)
+        del frames
+        retained = None
+    hits = scan_potential_stocks(data)
+    elapsed = time.perf_counter() - started
+    if retained is None:
+        retained = data.nbytes
+    return {
+        "layout": layout,
+        "symbols": n_symbols,
+        "years": years,
+        "baseline_rss_mb": round(baseline, 1),
+        "peak_rss_mb": round(_peak_rss_mb(), 1),
+        "retained_mb": round(retained / 1024 ** 2, 1),
+        "seconds": round(elapsed, 2),
+        "hits": int(len(hits)),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="比較逐檔 DataFrame 與精簡面板的記憶體用量")
+    parser.add_argument("--symbols", type=int, default=1800)
+    parser.add_argument("--years", type=float, default=10)
+    parser.add_argument("--layout", choices=["frames", "compact"])
+    parser.add_argument("--out", help="把結果寫成 JSON")
+    args = parser.parse_args(argv)
+
+    if args.layout:
+        print(json.dumps(run_layout(args.layout, args.symbols, args.years)))
+        return
+
+    results = []
+    for layout in ("frames", "compact"):
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--layout", layout,
+             "--symbols", str(args.symbols), "--years", str(args.years)],
+            check=True, capture_output=True, text=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    for r in results:
+        print(f"{r['layout']:>8}: peak RSS {r['peak_rss_mb']:>8.1f} MB (start {r['baseline_rss_mb']:.1f} MB), "
+              f"retained {r['retained_mb']:>8.1f} MB, {r['seconds']:.2f}s, {r['hits']} hits")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=1)
+
+
+if __name__ == "__main__":
+    main()
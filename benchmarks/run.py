@@ -0,0 +1,356 @@
+"""
+Offline benchmark suite for the compute hot paths, on synthetic market data.
+
+    python -m benchmarks.run baseline origin/main --out benchmarks/baselines/base.json
+    python -m benchmarks.run run --symbols 10 160 1000 2000 --years 1 5 10 --out benchmarks/results.json
+    python -m benchmarks.run compare benchmarks/baselines/base.json benchmarks/results.json --threshold 0.2
+
+`run` times every benchmark (after one warm-up call) and writes a JSON result;
+`compare` prints the change per benchmark and exits with 1 when any median got
+slower than the threshold. Network access is refused while benchmarks run:
+yfinance and FinMind are replaced by stubs serving the synthetic data.
+
+Timings are absolute seconds on the machine that produced them, so no baseline
+is checked in: `baseline` runs the same suite on another commit (the base of a
+change) in a temporary git worktree on this machine, and both files are then
+compared side by side. `compare` warns when the two files come from different
+environments.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import tempfile
+import argparse
+import platform
+import statistics
+import subprocess
+from datetime import datetime
+from contextlib import contextmanager, ExitStack
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+from benchmarks import synthetic
+
+DEFAULT_SYMBOLS = [10, 160, 1000, 2000]
+DEFAULT_YEARS = [1, 5, 10]
+DEFAULT_REPEAT = 3
+DEFAULT_THRESHOLD = 0.2
+# 法人資料整理的交易日數 (與年數無關，只依股票數執行一次)
+FLOW_DAYS = 30
+
+# 比較時忽略兩邊都低於這個秒數的項目 (計時雜訊大於實際差異)
+MIN_SECONDS = 0.005
+
+
+# --- Benchmarks: each takes the synthetic data and returns the call to time ---
+
+def _indicators(data):
+    from utils.technical import calculate_indicators
+    return lambda: [calculate_indicators(df) for df in data.values()]
+
+
+def _indicators_panel(data):
+    from utils.technical import calculate_indicators_panel
+    return lambda: calculate_indicators_panel(data)
+
+
+def _health_score(data):
+    from utils.technical import calculate_indicators_panel
+    from utils.scorer import calculate_health_score
+    processed = calculate_indicators_panel(data)
+    return lambda: [calculate_health_score(df) for df in processed.values()]
+
+
+def _scan(data):
+    from utils.technical import calculate_indicators_panel
+    from utils.scanner import scan_potential_stocks
+    processed = calculate_indicators_panel(data)
+    return lambda: scan_potential_stocks(processed)
+
+
+def _scan_compact(data):
+    from utils.panel import CompactPanel
+    from utils.scanner import scan_potential_stocks
+    return lambda: scan_potential_stocks(CompactPanel.from_frames(data))
+
+
+def _institutional_reshape(data):
+    from utils.institutional import reshape_institutional
+    rows = synthetic.institutional_rows(list(data), days=FLOW_DAYS)
+    return lambda: reshape_institutional(rows)
+
+
+def _institutional_fetch(data):
+    from utils import fetcher
+    # 上櫃代號直接走 FinMind (已換成樁)，不碰本地 T86 資料庫
+    symbol = next(iter(data)).split(".")[0] + ".TWO"
+    return lambda: fetcher.get_institutional_data(symbol)
+
+
+def _backtest(data):
+    from utils.backtest import compute_backtest
+    symbol, df = next(iter(data.items()))
+    return lambda: compute_backtest(df, symbol)
+
+
+def _walk_forward(data):
+    from utils.optimizer import run_walk_forward
+    closes = {symbol: df['Close'] for symbol, df in data.items()}
+    return lambda: run_walk_forward(closes, max_workers=1)
+
+
+# 名稱 -> (規模, 建立函式)；"universe" 依股票數 × 年數執行，"symbol" 只用單一股票依年數執行，
+# "flows" 依股票數執行一次 (資料長度固定為 FLOW_DAYS，與年數無關)
+BENCHMARKS = {
+    "indicators": ("universe", _indicators),
+    "indicators_panel": ("universe", _indicators_panel),
+    "health_score": ("universe", _health_score),
+    "scan": ("universe", _scan),
+    "scan_compact": ("universe", _scan_compact),
+    "institutional_reshape": ("flows", _institutional_reshape),
+    "institutional_fetch": ("symbol", _institutional_fetch),
+    "backtest": ("symbol", _backtest),
+    "walk_forward": ("symbol", _walk_forward),
+}
+
+
+# --- Offline providers ---
+
+class StubTicker:
+    def __init__(self, symbol, market):
+        self.symbol = symbol
+        self._market = market
+
+    def history(self, period="1y", **kwargs):
+        return self._market.get(self.symbol, pd.DataFrame()).copy()
+
+
+class StubDataLoader:
+    def taiwan_stock_institutional_investors(self, stock_id, start_date, end_date, **kwargs):
+        return synthetic.institutional_rows([stock_id], days=40)
+
+
+def _refuse(*args, **kwargs):
+    raise ConnectionError("benchmarks run offline")
+
+
+@contextmanager
+def offline(market):
+    """
+    Serve yfinance / FinMind from synthetic data and refuse every socket connection.
+    """
+    with ExitStack() as stack:
+        stack.enter_context(mock.patch("yfinance.Ticker", lambda symbol, *a, **k: StubTicker(symbol, market)))
+        stack.enter_context(mock.patch("yfinance.download", _refuse))
+        stack.enter_context(mock.patch("FinMind.data.DataLoader", StubDataLoader))
+        stack.enter_context(mock.patch.object(socket.socket, "connect", _refuse))
+        stack.enter_context(mock.patch.object(socket.socket, "connect_ex", _refuse))
+        yield
+
+
+# --- Run ---
+
+def time_call(fn, repeat):
+    fn()  # 暖身 (numba 編譯、延遲匯入)
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - started)
+    return times
+
+
+def _longest(data):
+    symbol = max(data, key=lambda s: len(data[s]))
+    return {symbol: data[symbol]}
+
+
+def _meta(args):
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    import vectorbt
+    return {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "vectorbt": vectorbt.__version__,
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "repeat": args.repeat,
+        "seed": args.seed,
+    }
+
+
+def run(args):
+    names = args.only or list(BENCHMARKS)
+    results = {}
+    for i, years in enumerate(args.years):
+        # 最大的股票池只產生一次，較小的規模取前 N 檔 (同一個 seed 下內容相同)
+        universe = synthetic.market(max(args.symbols), years, seed=args.seed)
+        with offline(universe):
+            for name in names:
+                scale, build = BENCHMARKS[name]
+                if scale == "flows" and i > 0:
+                    continue
+                sizes = [1] if scale == "symbol" else args.symbols
+                for n in sizes:
+                    data = _longest(universe) if scale == "symbol" else dict(list(universe.items())[:n])
+                    fn = build(data)
+                    times = time_call(fn, args.repeat)
+                    key = f"{name}[{n}x{FLOW_DAYS}d]" if scale == "flows" else f"{name}[{n}x{years:g}y]"
+                    results[key] = {
+                        "benchmark": name,
+                        "symbols": n,
+                        "years": None if scale == "flows" else years,
+                        "bars": int(sum(len(df) for df in data.values())),
+                        "min": min(times),
+                        "median": statistics.median(times),
+                        "times": times,
+                    }
+                    print(f"{key:<36} median {results[key]['median'] * 1000:>10.1f} ms   min {min(times) * 1000:>10.1f} ms",
+                          flush=True)
+                    del data, fn
+        del universe
+    output = {"meta": _meta(args), "results": results}
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(output, f, indent=1)
+    return output
+
+
+def baseline(args):
+    """
+    Run the suite on another commit in a temporary git worktree, with the same
+    options, so the baseline comes from this machine. Returns the exit code.
+    """
+    command = [sys.executable, "-m", "benchmarks.run", "run", "--out", os.path.abspath(args.out),
+               "--repeat", str(args.repeat), "--seed", str(args.seed),
+               "--symbols", *map(str, args.symbols), "--years", *(f"{y:g}" for y in args.years)]
+    if args.only:
+        command += ["--only", *args.only]
+    with tempfile.TemporaryDirectory() as tmp:
+        worktree = os.path.join(tmp, "base")
+        subprocess.run(["git", "worktree", "add", "--detach", worktree, args.ref], check=True)
+        try:
+            return subprocess.run(command, cwd=worktree).returncode
+        finally:
+            subprocess.run(["git", "worktree", "remove", "--force", worktree], check=False)
+
+
+# --- Compare ---
+
+# 影響絕對耗時的環境欄位，不同時比較結果僅供參考
+ENV_FIELDS = ("platform", "machine", "python", "numpy", "pandas", "vectorbt")
+
+
+def environment_diff(base, new):
+    """
+    The meta fields in ENV_FIELDS that differ between two result files, as {field: (base, new)}.
+    """
+    base_meta, new_meta = base.get("meta", {}), new.get("meta", {})
+    return {field: (base_meta.get(field), new_meta.get(field))
+            for field in ENV_FIELDS if base_meta.get(field) != new_meta.get(field)}
+
+
+def compare_results(base, new, threshold=DEFAULT_THRESHOLD, stat="median", min_seconds=MIN_SECONDS):
+    """
+    Rows of (key, base seconds, new seconds, relative change, status); status is
+    "regression" / "faster" beyond the threshold, "ok", "new" or "missing".
+    """
+    base, new = base["results"], new["results"]
+    rows = []
+    for key in sorted(set(base) | set(new)):
+        if key not in new:
+            rows.append((key, base[key][stat], None, None, "missing"))
+            continue
+        if key not in base:
+            rows.append((key, None, new[key][stat], None, "new"))
+            continue
+        before, after = base[key][stat], new[key][stat]
+        change = after / before - 1 if before > 0 else 0.0
+        if max(before, after) < min_seconds:
+            status = "ok"
+        elif change > threshold:
+            status = "regression"
+        elif change < -threshold:
+            status = "faster"
+        else:
+            status = "ok"
+        rows.append((key, before, after, change, status))
+    return rows
+
+
+def compare(args):
+    with open(args.base, encoding="utf-8") as f:
+        base = json.load(f)
+    with open(args.new, encoding="utf-8") as f:
+        new = json.load(f)
+    rows = compare_results(base, new, args.threshold, args.stat, args.min_seconds)
+
+    diff = environment_diff(base, new)
+    if diff:
+        print("⚠️ 兩份結果來自不同環境，絕對耗時無法直接比較；請在同一台機器上重新產生基準：")
+        for field, (before, after) in diff.items():
+            print(f"   {field}: {before} -> {after}")
+        print()
+    def ms(value):
+        return f"{value * 1000:>10.1f}" if value is not None else f"{'-':>10}"
+
+    print(f"{'benchmark':<36} {'base ms':>10} {'new ms':>10} {'change':>8}  status")
+    for key, before, after, change, status in rows:
+        pct = f"{change * 100:>+7.1f}%" if change is not None else f"{'':>8}"
+        print(f"{key:<36} {ms(before)} {ms(after)} {pct}  {status}")
+    regressions = [row for row in rows if row[4] == "regression"]
+    if regressions:
+        print(f"\n{len(regressions)} 項效能退步超過 {args.threshold * 100:.0f}%")
+        return 1
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="以合成行情資料離線量測運算熱點的效能")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    def add_run_options(p):
+        p.add_argument("--symbols", type=int, nargs="+", default=DEFAULT_SYMBOLS)
+        p.add_argument("--years", type=float, nargs="+", default=DEFAULT_YEARS)
+        p.add_argument("--only", nargs="+", choices=list(BENCHMARKS), help="只執行指定的項目")
+        p.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+        p.add_argument("--seed", type=int, default=0)
+
+    p_run = sub.add_parser("run", help="執行基準測試並輸出 JSON")
+    add_run_options(p_run)
+    p_run.add_argument("--out", help="把結果寫成 JSON")
+
+    p_base = sub.add_parser("baseline", help="在暫時的 git worktree 以指定 commit 執行相同的基準測試")
+    p_base.add_argument("ref", help="基準 commit，例如 origin/main")
+    add_run_options(p_base)
+    p_base.add_argument("--out", required=True, help="把基準結果寫成 JSON")
+
+    p_cmp = sub.add_parser("compare", help="比較兩份結果，退步超過門檻時回傳 1")
+    p_cmp.add_argument("base")
+    p_cmp.add_argument("new")
+    p_cmp.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="相對變化門檻 (0.2 = 20%%)")
+    p_cmp.add_argument("--stat", choices=["median", "min"], default="median")
+    p_cmp.add_argument("--min-seconds", type=float, default=MIN_SECONDS)
+
+    args = parser.parse_args(argv)
+    if args.command == "run":
+        run(args)
+        return 0
+    if args.command == "baseline":
+        return baseline(args)
+    return compare(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,109 @@
+"""
+Synthetic Taiwan market data for benchmarks: daily OHLCV shaped like yfinance
+output and FinMind-style institutional rows, on the real trading calendar.
+Everything is generated from a seed, so runs are reproducible and offline.
+"""
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from utils import trading_calendar
+
+END_DATE = "2026-10-16"
+INVESTOR_NAMES = ["Foreign_Investor", "Investment_Trust", "Dealer_self", "Dealer_Hedging", "Foreign_Dealer_Self"]
+
+# 台股升降單位 (股價區間上限, 跳動單位)
+TICK_SIZES = [(10, 0.01), (50, 0.05), (100, 0.1), (500, 0.5), (1000, 1.0), (np.inf, 5.0)]
+
+
+def symbols(n):
+    return [f"{1101 + i}.TW" for i in range(n)]
+
+
+def trading_index(years, end=END_DATE):
+    """
+    The trading days of the last `years` years on the Taiwan calendar, as yfinance's tz-aware index.
+    """
+    end = pd.Timestamp(end)
+    start = end - pd.DateOffset(days=int(round(years * 365.25)))
+    # 合成資料不需要真實休市日，沒有休市表的年份照平日計算，不必每次提醒
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        days = trading_calendar.trading_days(start, end)
+    return pd.DatetimeIndex(days).tz_localize(trading_calendar.TZ).rename("Date")
+
+
+def _round_to_tick(price):
+    out = np.empty_like(price)
+    lower = 0.0
+    for upper, tick in TICK_SIZES:
+        band = (price >= lower) & (price < upper)
+        out[band] = np.round(price[band] / tick) * tick
+        lower = upper
+    return np.maximum(out, 0.01)
+
+
+def ohlcv(index, rng, start_price=None):
+    """
+    One symbol's bars: GARCH-like volatility clustering, ±10% daily limits,
+    prices on the exchange tick grid and volume rising with absolute returns.
+    """
+    n = len(index)
+    start_price = start_price or float(np.exp(rng.uniform(np.log(8), np.log(800))))
+    shocks = rng.standard_normal(n)
+    var = np.empty(n)
+    var[0] = 0.02 ** 2
+    for t in range(1, n):
+        var[t] = 0.00001 + 0.08 * (shocks[t - 1] ** 2) * var[t - 1] + 0.9 * var[t - 1]
+    returns = np.clip(shocks * np.sqrt(var) + 0.0002, -0.1, 0.1)
+    close = _round_to_tick(start_price * np.exp(np.cumsum(returns)))
+    prev = np.concatenate([[close[0]], close[:-1]])
+    open_ = _round_to_tick(np.clip(prev * (1 + rng.normal(0, 0.004, n)), prev * 0.9, prev * 1.1))
+    spread = np.abs(rng.normal(0, 0.6, n)) * np.sqrt(var) * close
+    high = _round_to_tick(np.minimum(np.maximum(open_, close) + spread, prev * 1.1))
+    low = _round_to_tick(np.maximum(np.minimum(open_, close) - spread, prev * 0.9))
+    high, low = np.maximum(high, np.maximum(open_, close)), np.minimum(low, np.minimum(open_, close))
+    base_lots = np.exp(rng.uniform(np.log(200), np.log(30_000)))
+    lots = base_lots * np.exp(rng.normal(0, 0.4, n)) * (1 + 15 * np.abs(returns))
+    return pd.DataFrame({
+        "Open": open_,
+        "High": high,
+        "Low": low,
+        "Close": close,
+        "Volume": np.round(lots) * 1000.0,  # 張轉股
+        "Dividends": 0.0,
+        "Stock Splits": 0.0,
+    }, index=index)
+
+
+def market(n_symbols, years, seed=0, listed_share=0.9):
+    """
+    {symbol: bars} for a universe; about (1 - listed_share) of the symbols were
+    listed partway through the period and have shorter histories.
+    """
+    rng = np.random.default_rng(seed)
+    index = trading_index(years)
+    data = {}
+    for sym in symbols(n_symbols):
+        start = 0 if rng.random() < listed_share else int(rng.integers(1, max(2, len(index) - 60)))
+        data[sym] = ohlcv(index[start:], rng)
+    return data
+
+
+def institutional_rows(symbol_list, days=60, seed=0):
+    """
+    FinMind TaiwanStockInstitutionalInvestorsBuySell-shaped rows
+    (date, stock_id, buy, sell, name) for the last `days` trading days.
+    """
+    rng = np.random.default_rng(seed)
+    dates = trading_index(days / 240 + 0.1)[-days:].strftime("%Y-%m-%d")
+    codes = [sym.split(".")[0] for sym in symbol_list]
+    n = len(dates) * len(codes) * len(INVESTOR_NAMES)
+    return pd.DataFrame({
+        "date": np.repeat(dates, len(codes) * len(INVESTOR_NAMES)),
+        "stock_id": np.tile(np.repeat(codes, len(INVESTOR_NAMES)), len(dates)),
+        "buy": rng.integers(0, 5_000_000, n),
+        "sell": rng.integers(0, 5_000_000, n),
+        "name": np.tile(INVESTOR_NAMES, len(dates) * len(codes)),
+    })
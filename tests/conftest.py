@@ -0,0 +1,14 @@
+import numpy as np
+import pytest
+
+from benchmarks import synthetic
+
+
+@pytest.fixture
+def bars():
+    """
+    Two years of one symbol's daily OHLCV on the Taiwan calendar (reproducible, offline).
+    """
+    index = synthetic.trading_index(2)
+    return synthetic.ohlcv(index, np.random.default_rng(0), start_price=100.0)[
+        ["Open", "High", "Low", "Close", "Volume"]]
@@ -0,0 +1,139 @@
+import time
+import threading
+
+import pandas as pd
+import pytest
+
+from utils import ai_writer
+
+API_KEY = "test-key"
+
+
+def stock(code, squeeze=1.5):
+    return {"代碼": code, "均線糾結%": squeeze, "量能比": 0.6, "原始波動度": 2.1, "理由": "均線糾結"}
+
+
+def expected_script(client, name, data, institutional_data=None):
+    analysis = ai_writer.summarize_institutional(institutional_data)
+    return client._reply(ai_writer.build_prompt(name, data, analysis))
+
+
+@pytest.fixture(autouse=True)
+def script_cache(tmp_path, monkeypatch):
+    # 腳本快取寫到暫存目錄，不碰 data/ai_scripts
+    monkeypatch.setattr(ai_writer, "CACHE_DIR", str(tmp_path / "ai_scripts"))
+    return tmp_path / "ai_scripts"
+
+
+def test_batch_generates_every_item_concurrently():
+    client = ai_writer.FakeGeminiClient(delay=0.2)
+    items = {f"{1101 + i}.TW": (f"股票{i}", stock(f"{1101 + i}.TW", i), None) for i in range(8)}
+    started = time.perf_counter()
+    scripts = ai_writer.generate_scripts_batch(API_KEY, items, max_workers=4, client=client)
+    elapsed = time.perf_counter() - started
+
+    assert list(scripts) == list(items)
+    for key, (name, data, flows) in items.items():
+        assert scripts[key] == expected_script(client, name, data, flows)
+    assert client.calls == 8
+    # 4 個並行請求約需兩輪 (0.4 秒)；逐一送出需要 1.6 秒
+    assert elapsed < 1.2
+
+
+def test_batch_uses_disk_cache(script_cache):
+    client = ai_writer.FakeGeminiClient(delay=0)
+    items = {"2330.TW": ("台積電", stock("2330.TW"), None), "2317.TW": ("鴻海", stock("2317.TW"), None)}
+    first = ai_writer.generate_scripts_batch(API_KEY, items, client=client)
+    second = ai_writer.generate_scripts_batch(API_KEY, items, client=client)
+    assert first == second
+    assert client.calls == 2
+    assert len(list(script_cache.glob("*.json"))) == 2
+
+    # 提示詞輸入改變 (例如法人資料) 就是新的快取鍵
+    flows = pd.DataFrame({"投信買賣超": [10, 20, 30, 40], "外資買賣超": [1, 2, 3, 4]})
+    ai_writer.generate_scripts_batch(API_KEY, {"2330.TW": ("台積電", stock("2330.TW"), flows)}, client=client)
+    assert client.calls == 3
+
+
+def test_batch_without_api_key():
+    client = ai_writer.FakeGeminiClient(delay=0)
+    scripts = ai_writer.generate_scripts_batch("", {"2330.TW": ("台積電", stock("2330.TW"), None)}, client=client)
+    assert scripts["2330.TW"].startswith("⚠️")
+    assert client.calls == 0
+
+
+def test_batch_reports_errors_without_caching(script_cache):
+    class FailingClient(ai_writer.FakeGeminiClient):
+        def generate_content(self, model, contents):
+            raise RuntimeError("quota exceeded")
+
+    scripts = ai_writer.generate_scripts_batch(API_KEY, {"2330.TW": ("台積電", stock("2330.TW"), None)},
+                                               client=FailingClient(delay=0))
+    assert scripts["2330.TW"].startswith("❌")
+    assert not script_cache.exists() or not list(script_cache.glob("*.json"))
+
+
+def test_fake_client_from_env(monkeypatch):
+    monkeypatch.setenv(ai_writer.FAKE_ENV, "1")
+    assert isinstance(ai_writer.make_client(API_KEY), ai_writer.FakeGeminiClient)
+
+
+def test_stream_yields_the_full_script_and_caches_it():
+    client = ai_writer.FakeGeminiClient(delay=0.01)
+    data = stock("2330.TW")
+    stats = {}
+    chunks = list(ai_writer.stream_stock_script(API_KEY, "台積電", data, client=client, stats=stats))
+
+    assert "".join(chunks) == expected_script(client, "台積電", data)
+    assert len(chunks) > 1
+    assert stats["chunks"] == len(chunks)
+    assert not stats["cached"] and not stats["cancelled"]
+    assert 0 < stats["ttft"] <= stats["total"]
+
+    # 第二次直接讀快取，一次給出整份腳本
+    cached_stats = {}
+    assert list(ai_writer.stream_stock_script(API_KEY, "台積電", data, client=client, stats=cached_stats)) == ["".join(chunks)]
+    assert cached_stats["cached"]
+    assert client.calls == 1
+
+
+def test_stream_cancel_event_stops_without_caching():
+    client = ai_writer.FakeGeminiClient(delay=0.01)
+    data = stock("2330.TW")
+    cancel = threading.Event()
+    stats = {}
+    chunks = []
+    for chunk in ai_writer.stream_stock_script(API_KEY, "台積電", data, client=client, cancel=cancel, stats=stats):
+        chunks.append(chunk)
+        cancel.set()
+
+    assert len(chunks) == 1
+    assert stats["cancelled"]
+    key = ai_writer.cache_key("台積電", data, ai_writer.summarize_institutional(None))
+    assert ai_writer.load_cached_script(key) is None
+
+
+def test_stream_closed_by_rerun_is_cancelled():
+    client = ai_writer.FakeGeminiClient(delay=0.01)
+    data = stock("2330.TW")
+    stats = {}
+    stream = ai_writer.stream_stock_script(API_KEY, "台積電", data, client=client, stats=stats)
+    next(stream)
+    # Streamlit 重跑頁面時會關閉產生器
+    stream.close()
+
+    assert stats["cancelled"]
+    assert stats["total"] is not None
+    key = ai_writer.cache_key("台積電", data, ai_writer.summarize_institutional(None))
+    assert ai_writer.load_cached_script(key) is None
+
+
+def test_stream_reports_errors():
+    class FailingClient(ai_writer.FakeGeminiClient):
+        def generate_content_stream(self, model, contents, chunk_size=6):
+            yield self._Response("部分")
+            raise RuntimeError("connection reset")
+
+    chunks = list(ai_writer.stream_stock_script(API_KEY, "台積電", stock("2330.TW"), client=FailingClient(delay=0)))
+    assert chunks[0] == "部分"
+    assert chunks[-1].startswith("❌")
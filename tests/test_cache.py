@@ -0,0 +1,48 @@
+from utils.cache import SymbolCache
+
+
+def test_get_caches_per_slot():
+    cache = SymbolCache()
+    calls = []
+    compute = lambda: calls.append(1) or len(calls)
+    assert cache.get("flows", "2330.TW", "e1", compute) == 1
+    assert cache.get("flows", "2330.TW", "e1", compute) == 1
+    # 換 epoch 或手動失效才重算
+    assert cache.get("flows", "2330.TW", "e2", compute) == 2
+    cache.invalidate(["2330.TW"], kinds=("flows",))
+    assert cache.get("flows", "2330.TW", "e2", compute) == 3
+
+
+def test_invalidate_during_compute_drops_the_result():
+    cache = SymbolCache()
+
+    def stale():
+        # 計算途中使用者按下更新：這次算出的值不能當成新資料存起來
+        cache.invalidate(["2330.TW"], kinds=("indicators",))
+        return "stale"
+
+    assert cache.get("indicators", "2330.TW", "e1", stale) == "stale"
+    assert cache.get("indicators", "2330.TW", "e1", lambda: "fresh") == "fresh"
+    assert cache.get("indicators", "2330.TW", "e1", lambda: "again") == "fresh"
+
+
+def test_invalidate_all_during_get_many_drops_in_flight_slots():
+    cache = SymbolCache()
+    cache.get_many("indicators", ["2317.TW"], "e1", lambda missing: {sym: "old" for sym in missing})
+
+    def compute(missing):
+        cache.invalidate()
+        return {sym: "stale" for sym in missing}
+
+    assert cache.get_many("indicators", ["2330.TW", "2317.TW"], "e1", compute) == {"2330.TW": "stale", "2317.TW": "old"}
+    fresh = cache.get_many("indicators", ["2330.TW", "2317.TW"], "e1", lambda missing: {sym: "fresh" for sym in missing})
+    assert fresh == {"2330.TW": "fresh", "2317.TW": "fresh"}
+    assert cache.stats()["entries"] == {"indicators": 2}
+
+
+def test_invalidate_cascades_to_dependents_and_timeframes():
+    cache = SymbolCache()
+    for kind in ("indicators", "indicators@1w", "health", "flows"):
+        cache.get(kind, "2330.TW", "e1", lambda: kind)
+    cache.invalidate(["2330.TW"], kinds=("indicators",))
+    assert cache.stats()["entries"] == {"flows": 1}
@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from utils.incremental import IncrementalIndicators, append_bar
+from utils.technical import calculate_indicators, indicator_columns, indicator_spec
+
+SPECS = [
+    None,
+    indicator_spec(rsi=9),
+    indicator_spec(sma=(3, 8, 30, 90), rsi=9, macd=(8, 21, 5), bbands=(15, 2.5), vol_sma=(3, 10), std=30),
+]
+
+
+def assert_matches(frame, expected, spec):
+    columns = indicator_columns(spec)
+    assert np.allclose(frame[columns].to_numpy(dtype=float), expected[columns].to_numpy(dtype=float),
+                       equal_nan=True, rtol=1e-9, atol=1e-8)
+
+
+@pytest.mark.parametrize("spec", SPECS)
+def test_append_matches_batch(bars, spec):
+    history, new = bars.iloc[:-20], bars.iloc[-20:]
+    state = IncrementalIndicators.from_frame(history, spec)
+    frame = calculate_indicators(history, spec)
+    for timestamp, bar in new.iterrows():
+        frame = append_bar(frame, timestamp, dict(bar), state)
+    assert len(frame) == len(bars)
+    assert_matches(frame, calculate_indicators(bars, spec), spec)
+
+
+@pytest.mark.parametrize("spec", SPECS)
+def test_replace_last_matches_batch(bars, spec):
+    state = IncrementalIndicators.from_frame(bars.iloc[:-1], spec)
+    frame = calculate_indicators(bars.iloc[:-1], spec)
+    timestamp, bar = bars.index[-1], dict(bars.iloc[-1])
+    # 盤中暫時 K 棒被多次修正，最後一次才是收盤值
+    for factor in (0.97, 1.04, 1.01):
+        frame = append_bar(frame, timestamp, {**bar, "Close": bar["Close"] * factor}, state)
+    frame = append_bar(frame, timestamp, bar, state)
+    assert len(frame) == len(bars)
+    assert_matches(frame, calculate_indicators(bars, spec), spec)
+
+
+def test_revision_writes_in_place(bars):
+    state = IncrementalIndicators.from_frame(bars.iloc[:-1])
+    frame = append_bar(calculate_indicators(bars.iloc[:-1]), bars.index[-1], dict(bars.iloc[-1]), state)
+    revised = append_bar(frame, bars.index[-1], {**bars.iloc[-1], "Close": 1.0}, state)
+    assert revised is frame
+    assert frame["Close"].iloc[-1] == 1.0
+
+
+def test_replace_last_needs_append(bars):
+    with pytest.raises(ValueError):
+        IncrementalIndicators().replace_last(dict(bars.iloc[-1]))
@@ -0,0 +1,106 @@
+import os
+import json
+
+import pytest
+import requests
+
+from utils import institutional, replay
+
+FIXTURE_DIR = os.path.join(os.path.dirname(__file__), "fixtures", "twse")
+
+
+def load_fixture(day):
+    with open(os.path.join(FIXTURE_DIR, f"T86_{day}.json"), encoding="utf-8") as f:
+        return json.load(f)
+
+
+@pytest.fixture
+def flow_store(tmp_path, monkeypatch):
+    # 每個測試使用獨立的 T86 資料庫，並清空記憶體中的快取
+    flow_dir = tmp_path / "institutional"
+    monkeypatch.setattr(institutional, "FLOW_DIR", str(flow_dir))
+    monkeypatch.setattr(institutional, "MANIFEST_FILE", str(flow_dir / "manifest.json"))
+    monkeypatch.setattr(institutional, "_frame_cache", {})
+    monkeypatch.setattr(institutional, "_flows_memo", {})
+    return flow_dir
+
+
+@pytest.fixture
+def replay_server():
+    server, base_url = replay.start_server(FIXTURE_DIR)
+    yield base_url
+    server.shutdown()
+
+
+def test_parse_t86_lots():
+    df = institutional.parse_t86(load_fixture("20250313")).set_index("stock_id")
+    assert list(df.index) == ["2330", "2317", "0050"]
+    assert df.loc["2330", "foreign"] == 12345
+    assert df.loc["2330", "trust"] == -2000
+    assert df.loc["2317", "dealer"] == -20
+
+
+def test_parse_t86_maps_columns_by_header():
+    payload = load_fixture("20250313")
+    # 表頭順序改變時依欄位名稱對應，而不是固定位置
+    order = [0, 1, 10, 4, 14] + [i for i in range(len(payload["fields"])) if i not in (0, 1, 10, 4, 14)]
+    payload["fields"] = [payload["fields"][i] for i in order]
+    payload["data"] = [[row[i] for i in order] for row in payload["data"]]
+    df = institutional.parse_t86(payload).set_index("stock_id")
+    assert df.loc["2330", "foreign"] == 12345
+    assert df.loc["2330", "trust"] == -2000
+
+
+def test_parse_t86_no_data():
+    assert institutional.parse_t86(replay.NO_DATA) is None
+    assert institutional.parse_t86({}) is None
+
+
+def test_backfill_from_replay_server(flow_store, replay_server):
+    results = institutional.backfill(days=3, end="2025-03-14", base_url=replay_server, interval=0)
+    # 沒有錄製檔的交易日，回放伺服器回應查無資料，視為休市
+    assert results == {"20250314": "ok", "20250313": "ok", "20250312": "closed", "20250311": "closed"}
+    assert institutional.covers(3, end="2025-03-14")
+
+    flows = institutional.get_stock_flows("2330.TW")
+    assert list(flows.columns) == ["日期", "外資買賣超", "投信買賣超", "自營商買賣超"]
+    assert flows["外資買賣超"].tolist() == [12345, -3000]
+    assert flows["投信買賣超"].tolist() == [-2000, 1500]
+
+    # 已處理過的日期不會再請求
+    assert institutional.backfill(days=3, end="2025-03-14", base_url=replay_server, interval=0) == {}
+
+
+def test_backfill_records_fixtures(flow_store, replay_server, tmp_path):
+    record_dir = tmp_path / "recorded"
+    institutional.backfill(days=1, end="2025-03-14", base_url=replay_server, record_dir=str(record_dir), interval=0)
+    assert json.loads((record_dir / "T86_20250314.json").read_text(encoding="utf-8")) == load_fixture("20250314")
+
+
+class _SSLFailingSession:
+    def __init__(self):
+        self.verify = []
+
+    def get(self, url, verify=True, **kwargs):
+        self.verify.append(verify)
+        raise requests.exceptions.SSLError("certificate verify failed")
+
+
+def test_fetch_t86_does_not_downgrade_tls(monkeypatch):
+    monkeypatch.setattr(institutional, "TWSE_INSECURE_SSL", False)
+    monkeypatch.setattr(institutional, "TWSE_CA_BUNDLE", None)
+    session = _SSLFailingSession()
+    with pytest.raises(requests.exceptions.SSLError):
+        institutional.fetch_t86("20250314", session=session)
+    assert session.verify == [True]
+
+
+def test_fetch_t86_tls_opt_in(monkeypatch):
+    session = _SSLFailingSession()
+    monkeypatch.setattr(institutional, "TWSE_CA_BUNDLE", "/etc/ssl/twse.pem")
+    with pytest.raises(requests.exceptions.SSLError):
+        institutional.fetch_t86("20250314", session=session)
+    monkeypatch.setattr(institutional, "TWSE_INSECURE_SSL", True)
+    with pytest.raises(requests.exceptions.SSLError):
+        institutional.fetch_t86("20250314", session=session)
+    assert session.verify == ["/etc/ssl/twse.pem", False]
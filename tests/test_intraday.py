@@ -0,0 +1,90 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils import intraday
+from utils.technical import calculate_indicators, indicator_columns, indicator_spec
+
+# 盤中時間 (台北)，在合成資料最後一根 K 棒的下一個交易日
+NOW = pd.Timestamp("2026-10-19 10:30", tz="Asia/Taipei")
+
+
+def quote(close, volume, time):
+    return {"Open": close, "High": close * 1.01, "Low": close * 0.99, "Close": close, "Volume": volume, "time": time}
+
+
+@pytest.fixture
+def recording(tmp_path, bars):
+    # 兩檔股票、三次輪詢：價格與累計成交量逐次更新
+    last = bars["Close"].iloc[-1]
+    frames = [{"t": f"10:0{i}", "quotes": {
+        "2330.TW": quote(last * (1 + 0.01 * i), 1_000_000 * (i + 1), f"10:0{i}"),
+        "2317.TW": quote(last * (1 - 0.01 * i), 500_000 * (i + 1), f"10:0{i}"),
+    }} for i in range(3)]
+    path = tmp_path / "ticks.jsonl"
+    path.write_text("\n".join(json.dumps(frame) for frame in frames), encoding="utf-8")
+    return path, frames
+
+
+@pytest.mark.parametrize("spec", [None, indicator_spec(rsi=9, sma=(5, 10, 30, 90))])
+def test_session_matches_batch_indicators(bars, recording, spec):
+    path, frames = recording
+    daily = {sym: calculate_indicators(bars, spec) for sym in ("2330.TW", "2317.TW")}
+    session = intraday.IntradaySession(daily, spec)
+    feed = intraday.ReplayQuoteFeed(path)
+    for _ in frames:
+        assert sorted(session.poll(feed, now=NOW)) == ["2317.TW", "2330.TW"]
+
+    columns = indicator_columns(spec)
+    for sym, df in session.frames.items():
+        # 同一天的多次輪詢只會覆寫當日的暫時 K 棒
+        assert len(df) == len(bars) + 1
+        assert df.index[-1] == NOW.normalize()
+        assert df["Close"].iloc[-1] == pytest.approx(frames[-1]["quotes"][sym]["Close"])
+        expected = calculate_indicators(df[["Open", "High", "Low", "Close", "Volume"]], spec)
+        assert np.allclose(df[columns].to_numpy(dtype=float), expected[columns].to_numpy(dtype=float),
+                           equal_nan=True, rtol=1e-9, atol=1e-8)
+
+
+def test_session_leaves_input_frames_untouched(bars, recording):
+    path, _ = recording
+    daily = {"2330.TW": calculate_indicators(bars)}
+    before = daily["2330.TW"].copy()
+    session = intraday.IntradaySession(daily)
+    session.poll(intraday.ReplayQuoteFeed(path), now=NOW)
+    session.poll(intraday.ReplayQuoteFeed(path), now=NOW)
+    pd.testing.assert_frame_equal(daily["2330.TW"], before)
+
+
+def test_session_rows(bars, recording):
+    path, frames = recording
+    session = intraday.IntradaySession({"2330.TW": calculate_indicators(bars)})
+    feed = intraday.ReplayQuoteFeed(path)
+    for _ in frames:
+        session.poll(feed, now=NOW)
+    rows = session.rows()
+    assert list(rows["代號"]) == ["2330.TW"]
+    assert rows["成交價"].iloc[0] == pytest.approx(frames[-1]["quotes"]["2330.TW"]["Close"])
+    assert rows["報價時間"].iloc[0] == "10:02"
+
+
+def test_replay_feed_repeats_last_frame(recording):
+    path, frames = recording
+    feed = intraday.ReplayQuoteFeed(path)
+    polls = [feed.poll(["2330.TW"]) for _ in range(len(frames) + 2)]
+    assert all(list(poll) == ["2330.TW"] for poll in polls)
+    assert polls[-1] == polls[len(frames) - 1]
+
+
+def test_parse_realtime_mid_price():
+    quote = intraday.parse_realtime({
+        "success": True,
+        "info": {"time": "10:00:00"},
+        "realtime": {"latest_trade_price": "-", "best_bid_price": ["100", "99.5"], "best_ask_price": ["101"],
+                     "accumulate_trade_volume": "1234", "open": "99", "high": "-", "low": "98"},
+    })
+    assert quote["Close"] == 100.5
+    assert quote["High"] == 100.5
+    assert quote["Volume"] == 1_234_000
@@ -0,0 +1,27 @@
+import pandas as pd
+
+from utils import universe
+
+
+def stats_at(updated):
+    return pd.DataFrame({"avg_value": [1e9], "updated": [updated]}, index=pd.Index(["2330.TW"], name="symbol"))
+
+
+def test_stats_built_before_the_close_go_stale():
+    # 2025-03-14 (週五) 盤中建立的統計量，當天收盤定稿 (14:30) 後就不再是最新
+    stats = stats_at("2025-03-14T10:00:00+08:00")
+    assert universe.stats_fresh(stats, now=pd.Timestamp("2025-03-14 13:00", tz="Asia/Taipei"))
+    assert not universe.stats_fresh(stats, now=pd.Timestamp("2025-03-14 15:00", tz="Asia/Taipei"))
+
+
+def test_stats_built_after_the_close_stay_fresh_over_the_weekend():
+    stats = stats_at("2025-03-14T15:00:00+08:00")
+    assert universe.stats_fresh(stats, now=pd.Timestamp("2025-03-16 20:00", tz="Asia/Taipei"))
+    assert not universe.stats_fresh(stats, now=pd.Timestamp("2025-03-17 15:00", tz="Asia/Taipei"))
+
+
+def test_missing_or_date_only_stats_are_stale():
+    assert not universe.stats_fresh(None)
+    assert not universe.stats_fresh(stats_at("2025-03-14").iloc[:0])
+    # 舊版只記錄日期，視為當天 00:00 建立
+    assert not universe.stats_fresh(stats_at("2025-03-14"), now=pd.Timestamp("2025-03-14 15:00", tz="Asia/Taipei"))
@@ -1,6 +1,183 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 from google import genai
 
-def generate_stock_script(api_key, stock_name, stock_data, institutional_data=None):
+# 根據主人偏好使用 gemini-2.5-flash
+MODEL = 'gemini-2.5-flash'
+
+# 生成結果依提示詞輸入的雜湊存檔，資料沒變就不必再呼叫一次 API
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CACHE_DIR = os.path.join(BASE_DIR, "data", "ai_scripts")
+
+# 批次生成的預設並行數與上限 (避免超過 API 的每分鐘請求限制)
+DEFAULT_WORKERS = 4
+MAX_WORKERS = 8
+
+# 設定 GEMINI_FAKE=1 時改用本地假客戶端，不需網路即可測試；GEMINI_FAKE_DELAY 模擬回應秒數
+FAKE_ENV = "GEMINI_FAKE"
+FAKE_DELAY_ENV = "GEMINI_FAKE_DELAY"
+
+# 提示詞用到的技術面欄位
+PROMPT_FIELDS = ('代碼', '均線糾結%', '量能比', '原始波動度', '理由')
+
+
+class FakeGeminiClient:
+    """
+    Offline stand-in for genai.Client: client.models.generate_content returns an
+    object with .text built from the prompt, after an optional delay.
+    """
+
+    class _Response:
+        def __init__(self, text):
+            self.text = text
+
+    def __init__(self, delay=None):
+        self.delay = float(os.environ.get(FAKE_DELAY_ENV, 0.5)) if delay is None else delay
+        self.calls = 0
+        self._lock = threading.Lock()
+        self.models = self
+
+    def _reply(self, contents):
+        digest = hashlib.sha256(contents.encode("utf-8")).hexdigest()[:8]
+        return f"【測試腳本 {digest}】你看這走勢，就像我在宜蘭溯溪時遇到的深潭，水流變緩，是在蓄力。"
+
+    def generate_content(self, model, contents):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.delay)
+        return self._Response(self._reply(contents))
+
+    def generate_content_stream(self, model, contents, chunk_size=6):
+        with self._lock:
+            self.calls += 1
+        text = self._reply(contents)
+        time.sleep(self.delay)
+        for i in range(0, len(text), chunk_size):
+            yield self._Response(text[i:i + chunk_size])
+            time.sleep(self.delay / 10)
+
+
+def make_client(api_key):
+    if os.environ.get(FAKE_ENV):
+        return FakeGeminiClient()
+    return genai.Client(api_key=api_key)
+
+
+def summarize_institutional(institutional_data):
+    """
+    法人動態摘要 (投信連續買超天數與外資累計買賣超)，併入提示詞
+    """
+    institutional_analysis = ""
+    if institutional_data is not None and not institutional_data.empty:
+        # 檢查投信連續買超天數
+        invest_trust_data = institutional_data['投信買賣超'].values
+        consecutive_buy = 0
+        for value in reversed(invest_trust_data):
+            if value > 0:
+                consecutive_buy += 1
+            else:
+                break
+
+        if consecutive_buy > 3:
+            institutional_analysis = f"\n⚠️ 重點：投信已連續買超 {consecutive_buy} 天！大哥(投信)已經進場卡位了！"
+        elif consecutive_buy > 0:
+            institutional_analysis = f"\n📊 法人動態：投信連續買超 {consecutive_buy} 天"
+
+        # 計算外資總買賣超
+        foreign_total = institutional_data['外資買賣超'].sum()
+        institutional_analysis += f"\n外資累計買賣超: {foreign_total:.0f} 張"
+    return institutional_analysis
+
+
+def build_prompt(stock_name, stock_data, institutional_analysis=""):
+    """
+    The full prompt (persona plus stock data) for one script.
+    """
+    system_prompt = (
+        "你是一位住在宜蘭、53 歲的『理性冒險家』。你熱愛溯溪、登山，並將這種冒險精神融入股市分析。"
+        "你的講話風格精準、務實、帶點野性，但非常有長者的沉穩感。你像是一位在溪邊烤肉時，順便跟後輩分享投資心得的老大哥。"
+        "你不說空話，追求效率，說話溫暖但充滿邏輯。你的目標是產出約 30 秒（約 140 字）的短影音解盤腳本。"
+    )
+    user_prompt = f"""
+    請根據以下股票數據，為「{stock_name} ({stock_data.get('代碼', '')})」撰寫一份 30 秒的短影音解盤腳本。
+    
+    股票數據：
+    - 均線糾結度：{stock_data.get('均線糾結%', '未知')}%
+    - 量能比 (今日/20日均)：{stock_data.get('量能比', '未知')}
+    - 波動度：{stock_data.get('原始波動度', '未知')}
+    - 潛力理由：{stock_data.get('理由', '技術面整理盤整中')}
+    {institutional_analysis}
+    
+    腳本結構（請嚴格執行）：
+    1. 【Hook (0-5秒)】：用一句反直覺、有梗的話開場，讓人停下來。
+    2. 【數據證據 (5-15秒)】：用譬喻解釋技術面數據，不要用教科書句型。
+    3. 【情境預判 (15-25秒)】：描述接下來可能的噴發劇本，搭配反問句增加對話感。
+       {f"特別注意：若投信連續買超 > 3 天，務必在此段強調「大哥(投信)已經進場卡位了！」" if "大哥(投信)" in institutional_analysis else ""}
+    4. 【結尾 CTA (25-30秒)】：給出一句有記憶點的具體行動建議。
+    
+    風格指導原則：
+    - 宜蘭溫度：對話使用繁體中文，保持像老朋友聊天般的自然語氣。
+    - 拒絕說教：改用「你看這走勢...」、「就像我在宜蘭登山時...」。
+    - 善用冒險譬喻：
+      · 均線糾結 → 「像是在山區紮營後的裝備整理」「暴風雨前的寧靜」
+      · 量縮 → 「像是在溯溪時遇到的深潭」「水流變緩，是在蓄力」
+      · 突破 → 「像是攻頂前的最後衝刺」「翻過這座山就是平原」
+      · 投信買超 → 「大哥(投信)已經進場紮營了」「有經驗的嚮導帶路」
+    - 沉穩幽默：適度使用「這有點東西喔」「這數據，我看很有戲」「跟我當年...有點像」等語氣。
+    
+    要求：
+    - 繁體中文。
+    - 總字數必須在 130 字至 150 字之間。
+    - 直接輸出腳本正文，不要有標題、段落標記或其他說明文字。
+    """
+    
+    # 合併提示詞
+    return f"{system_prompt}\n\n{user_prompt}"
+
+
+def cache_key(stock_name, stock_data, institutional_analysis="", model=MODEL):
+    """
+    Hash of everything that shapes the prompt: stock data, institutional summary and model.
+    """
+    payload = {
+        "name": stock_name,
+        "data": {field: str(stock_data.get(field)) for field in PROMPT_FIELDS},
+        "institutional": institutional_analysis,
+        "model": model,
+    }
+    return hashlib.sha256(json.dumps(payload, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _cache_path(key):
+    return os.path.join(CACHE_DIR, f"{key}.json")
+
+
+def load_cached_script(key):
+    path = _cache_path(key)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)["text"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def save_cached_script(key, text, model=MODEL):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp_file = _cache_path(key) + f".{threading.get_ident()}.tmp"
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump({"text": text, "model": model, "created": time.strftime("%Y-%m-%dT%H:%M:%S")},
+                  f, ensure_ascii=False)
+    os.replace(tmp_file, _cache_path(key))
+
+
+def generate_stock_script(api_key, stock_name, stock_data, institutional_data=None, client=None, use_cache=True):
     """
     根據股票數據及法人數據生成 AI 短影音腳本
     
@@ -9,82 +186,108 @@ def generate_stock_script(api_key, stock_name, stock_data, institutional_data=No
         stock_name: 股票名稱
         stock_data: 股票技術面數據
         institutional_data: 三大法人買賣超資料 (DataFrame, optional)
+        client: 共用的 Gemini 客戶端 (optional，批次生成時傳入)
+        use_cache: 是否使用磁碟快取
     """
     if not api_key:
         return "⚠️ 請提供 Gemini API Key 以使用此功能。"
     
     try:
-        client = genai.Client(api_key=api_key)
-        
-        # 分析法人數據
-        institutional_analysis = ""
-        if institutional_data is not None and not institutional_data.empty:
-            # 檢查投信連續買超天數
-            invest_trust_data = institutional_data['投信買賣超'].values
-            consecutive_buy = 0
-            for value in reversed(invest_trust_data):
-                if value > 0:
-                    consecutive_buy += 1
-                else:
-                    break
-            
-            if consecutive_buy > 3:
-                institutional_analysis = f"\n⚠️ 重點：投信已連續買超 {consecutive_buy} 天！大哥(投信)已經進場卡位了！"
-            elif consecutive_buy > 0:
-                institutional_analysis = f"\n📊 法人動態：投信連續買超 {consecutive_buy} 天"
-            
-            # 計算外資總買賣超
-            foreign_total = institutional_data['外資買賣超'].sum()
-            institutional_analysis += f"\n外資累計買賣超: {foreign_total:.0f} 張"
-        
-        system_prompt = (
-            "你是一位住在宜蘭、53 歲的『理性冒險家』。你熱愛溯溪、登山，並將這種冒險精神融入股市分析。"
-            "你的講話風格精準、務實、帶點野性，但非常有長者的沉穩感。你像是一位在溪邊烤肉時，順便跟後輩分享投資心得的老大哥。"
-            "你不說空話，追求效率，說話溫暖但充滿邏輯。你的目標是產出約 30 秒（約 140 字）的短影音解盤腳本。"
-        )
-        
-        user_prompt = f"""
-        請根據以下股票數據，為「{stock_name} ({stock_data.get('代碼', '')})」撰寫一份 30 秒的短影音解盤腳本。
-        
-        股票數據：
-        - 均線糾結度：{stock_data.get('均線糾結%', '未知')}%
-        - 量能比 (今日/20日均)：{stock_data.get('量能比', '未知')}
-        - 波動度：{stock_data.get('原始波動度', '未知')}
-        - 潛力理由：{stock_data.get('理由', '技術面整理盤整中')}
-        {institutional_analysis}
-        
-        腳本結構（請嚴格執行）：
-        1. 【Hook (0-5秒)】：用一句反直覺、有梗的話開場，讓人停下來。
-        2. 【數據證據 (5-15秒)】：用譬喻解釋技術面數據，不要用教科書句型。
-        3. 【情境預判 (15-25秒)】：描述接下來可能的噴發劇本，搭配反問句增加對話感。
-           {f"特別注意：若投信連續買超 > 3 天，務必在此段強調「大哥(投信)已經進場卡位了！」" if "大哥(投信)" in institutional_analysis else ""}
-        4. 【結尾 CTA (25-30秒)】：給出一句有記憶點的具體行動建議。
-        
-        風格指導原則：
-        - 宜蘭溫度：對話使用繁體中文，保持像老朋友聊天般的自然語氣。
-        - 拒絕說教：改用「你看這走勢...」、「就像我在宜蘭登山時...」。
-        - 善用冒險譬喻：
-          · 均線糾結 → 「像是在山區紮營後的裝備整理」「暴風雨前的寧靜」
-          · 量縮 → 「像是在溯溪時遇到的深潭」「水流變緩，是在蓄力」
-          · 突破 → 「像是攻頂前的最後衝刺」「翻過這座山就是平原」
-          · 投信買超 → 「大哥(投信)已經進場紮營了」「有經驗的嚮導帶路」
-        - 沉穩幽默：適度使用「這有點東西喔」「這數據，我看很有戲」「跟我當年...有點像」等語氣。
-        
-        要求：
-        - 繁體中文。
-        - 總字數必須在 130 字至 150 字之間。
-        - 直接輸出腳本正文，不要有標題、段落標記或其他說明文字。
-        """
-        
-        # 合併提示詞
-        full_prompt = f"{system_prompt}\n\n{user_prompt}"
-        
-        # 根據主人偏好使用 gemini-2.5-flash
+        institutional_analysis = summarize_institutional(institutional_data)
+        key = cache_key(stock_name, stock_data, institutional_analysis)
+        if use_cache:
+            cached = load_cached_script(key)
+            if cached is not None:
+                return cached
+
+        client = client or make_client(api_key)
         response = client.models.generate_content(
-            model='gemini-2.5-flash',
-            contents=full_prompt
+            model=MODEL,
+            contents=build_prompt(stock_name, stock_data, institutional_analysis)
         )
+        # 只快取成功的結果，錯誤訊息下次仍會重試
+        save_cached_script(key, response.text)
         return response.text
         
     except Exception as e:
         return f"❌ 生成腳本時發生錯誤: {str(e)}"
+
+
+def generate_scripts_batch(api_key, items, max_workers=DEFAULT_WORKERS, client=None):
+    """
+    Generate scripts for many stocks concurrently, at most `max_workers` requests
+    in flight. `items` maps a key to (stock_name, stock_data, institutional_data);
+    returns {key: script} in the same order. Cached scripts cost no request.
+    """
+    if not api_key:
+        return {key: "⚠️ 請提供 Gemini API Key 以使用此功能。" for key in items}
+    try:
+        client = client or make_client(api_key)
+    except Exception as e:
+        return {key: f"❌ 生成腳本時發生錯誤: {str(e)}" for key in items}
+    workers = max(1, min(int(max_workers), MAX_WORKERS, len(items) or 1))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {key: executor.submit(generate_stock_script, api_key, name, data, flows, client)
+                   for key, (name, data, flows) in items.items()}
+        return {key: future.result() for key, future in futures.items()}
+
+
+def stream_stock_script(api_key, stock_name, stock_data, institutional_data=None, client=None,
+                        cancel=None, stats=None):
+    """
+    Streaming variant of generate_stock_script: yields text chunks as the model
+    produces them. Stops early once `cancel` (a threading.Event) is set; only a
+    completed script is written to the cache. `stats` (a dict) receives
+    time-to-first-token, total time, chunk count and whether the cache was hit.
+    """
+    stats = stats if stats is not None else {}
+    stats.update({"cached": False, "cancelled": False, "ttft": None, "total": None, "chunks": 0})
+    if not api_key:
+        yield "⚠️ 請提供 Gemini API Key 以使用此功能。"
+        return
+
+    started = time.perf_counter()
+    response = None
+    completed = False
+    try:
+        institutional_analysis = summarize_institutional(institutional_data)
+        key = cache_key(stock_name, stock_data, institutional_analysis)
+        cached = load_cached_script(key)
+        if cached is not None:
+            stats.update({"cached": True, "ttft": time.perf_counter() - started, "chunks": 1})
+            completed = True
+            yield cached
+            return
+
+        client = client or make_client(api_key)
+        response = client.models.generate_content_stream(
+            model=MODEL,
+            contents=build_prompt(stock_name, stock_data, institutional_analysis)
+        )
+        parts = []
+        for chunk in response:
+            if cancel is not None and cancel.is_set():
+                stats["cancelled"] = True
+                return
+            text = chunk.text or ""
+            if not text:
+                continue
+            if stats["ttft"] is None:
+                stats["ttft"] = time.perf_counter() - started
+            stats["chunks"] += 1
+            parts.append(text)
+            yield text
+        completed = True
+        if parts:
+            save_cached_script(key, "".join(parts))
+
+    except GeneratorExit:
+        # 頁面重跑 (例如使用者切換選擇) 時 Streamlit 會關閉產生器
+        stats["cancelled"] = True
+        raise
+    except Exception as e:
+        yield f"❌ 生成腳本時發生錯誤: {str(e)}"
+    finally:
+        if not completed and hasattr(response, "close"):
+            response.close()
+        stats["total"] = time.perf_counter() - started
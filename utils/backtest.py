@@ -1,61 +1,163 @@
 import vectorbt as vbt
+import numpy as np
 import pandas as pd
 import streamlit as st
+from dataclasses import dataclass, field
+
+from utils.optimizer import run_walk_forward
+from utils.store import data_version
+
+# 右側交易策略參數：收盤站上快慢均線進場、跌破慢線出場
+DEFAULT_STRATEGY = {"fast": 5, "slow": 10}
+
+# 台股交易成本 (假設券商打 28 折)
+# 手續費: 0.1425% * 0.28 = 0.000399
+# 證交稅: 0.003
+TW_COST_MODEL = {
+    "fees": 0.000399,
+    "tax": 0.003, # 證交稅只在賣出時收取
+    "slippage": 0.001, # 考慮滑價 0.1%
+    "init_cash": 1000000, # 初始百萬資金
+}
+
+# 組合回測的資金分配方式
+ALLOCATION_RULES = {
+    "equal": "等權重 (每個部位一格)",
+    "volatility": "波動度反比 (低波動配置較多)",
+}
+
+@dataclass
+class BacktestResult:
+    """
+    Everything the backtest page renders, computed once and free of Streamlit calls.
+    Plain pandas objects only, so it pickles into st.cache_data.
+    """
+    symbol_name: str
+    strategy: dict
+    cost_model: dict
+    close: pd.Series
+    ma_fast: pd.Series
+    ma_slow: pd.Series
+    entries: pd.Series
+    exits: pd.Series
+    equity: pd.Series
+    cumulative_returns: pd.Series
+    drawdown: pd.Series
+    trades: pd.DataFrame
+    stats: pd.Series
+    metrics: dict = field(default_factory=dict)
+
+def _order_fees(sell_mask, cost_model):
+    """
+    Per-bar fee rates: commission on every order, plus the transaction tax on sells.
+    """
+    sell_mask = sell_mask.fillna(False).astype(bool)
+    return sell_mask * cost_model["tax"] + cost_model["fees"]
+
+def _summarize_portfolio(pf):
+    stats = pf.stats()
+    trade_count = pf.trades.count()
+    win_rate = pf.trades.win_rate() * 100 if trade_count > 0 else 0.0
+    pf_factor = pf.trades.profit_factor() if trade_count > 0 else 0.0
+    metrics = {
+        "total_return": pf.total_return() * 100,
+        "max_drawdown": stats['Max Drawdown [%]'] if 'Max Drawdown [%]' in stats.index else 0.0,
+        "win_rate": 0.0 if np.isnan(win_rate) else win_rate,
+        "profit_factor": 0.0 if np.isnan(pf_factor) else pf_factor,
+        "trade_count": int(trade_count),
+    }
+    try:
+        trades = pf.trades.records_readable
+    except Exception:
+        trades = pd.DataFrame(pf.trades.records)
+    return stats, metrics, trades
+
+def compute_backtest(df, symbol_name="個股", strategy=None, cost_model=None):
+    """
+    Run the right-side strategy on one symbol and collect the results.
+    """
+    strategy = {**DEFAULT_STRATEGY, **(strategy or {})}
+    cost_model = {**TW_COST_MODEL, **(cost_model or {})}
 
-def run_taiwan_stock_backtest(df, symbol_name="個股"):
     # 1. 定義策略邏輯 (以你的右側交易為例：收盤 > 5MA & 10MA)
     close = df['Close']
-    ma5 = vbt.MA.run(close, 5).ma
-    ma10 = vbt.MA.run(close, 10).ma
-    
-    # 進場：站上雙均線；出場：跌破 10MA
-    entries = (close > ma5) & (close > ma10)
-    exits = close < ma10
+    ma_fast = vbt.MA.run(close, strategy["fast"]).ma
+    ma_slow = vbt.MA.run(close, strategy["slow"]).ma
 
-    # 2. 設置台股交易成本 (假設券商打 28 折)
-    # 手續費: 0.1425% * 0.28 = 0.000399
-    # 證交稅: 0.003
-    fees = 0.000399 
-    slippage = 0.001 # 考慮滑價 0.1%
+    # 進場：站上雙均線；出場：跌破 10MA
+    entries = (close > ma_fast) & (close > ma_slow)
+    exits = close < ma_slow
 
-    # 3. 執行回測
+    # 2. 執行回測 (單檔回測沿用原本只計手續費的成本設定；證交稅只用於組合回測)
     pf = vbt.Portfolio.from_signals(
-        close, 
-        entries, 
-        exits, 
-        init_cash=1000000, # 初始百萬資金
-        fees=fees,
-        slippage=slippage,
+        close,
+        entries,
+        exits,
+        init_cash=cost_model["init_cash"],
+        fees=cost_model["fees"],
+        slippage=cost_model["slippage"],
         freq='1D'
     )
 
-    # 4. Streamlit 介面呈現
-    display_integrated_backtest_ui(pf, df, symbol_name)
-    
-    return pf
+    # 3. 整理結果 (stats 只計算一次)
+    stats, metrics, trades = _summarize_portfolio(pf)
+    equity = pf.value()
+    running_max = equity.cummax()
+
+    return BacktestResult(
+        symbol_name=symbol_name,
+        strategy=strategy,
+        cost_model=cost_model,
+        close=close,
+        ma_fast=ma_fast,
+        ma_slow=ma_slow,
+        entries=entries,
+        exits=exits,
+        equity=equity,
+        cumulative_returns=(equity / equity.iloc[0] - 1) * 100,
+        drawdown=(equity - running_max) / running_max * 100,
+        trades=trades,
+        stats=stats,
+        metrics=metrics,
+    )
+
+@st.cache_data(show_spinner=False)
+def cached_backtest(symbol, version, strategy_items, cost_items, symbol_name, _df):
+    """
+    compute_backtest cached by (symbol, data version, strategy params, cost model).
+    The frame itself is not hashed; `version` stands in for its content.
+    """
+    return compute_backtest(_df, symbol_name, dict(strategy_items), dict(cost_items))
 
-def display_integrated_backtest_ui(pf, df, symbol_name):
-    import numpy as np
+def run_taiwan_stock_backtest(df, symbol_name="個股", symbol=None, strategy=None, cost_model=None, universe=None):
+    strategy = {**DEFAULT_STRATEGY, **(strategy or {})}
+    cost_model = {**TW_COST_MODEL, **(cost_model or {})}
+    result = cached_backtest(
+        symbol or symbol_name, data_version(df),
+        tuple(sorted(strategy.items())), tuple(sorted(cost_model.items())),
+        symbol_name, df
+    )
+
+    # Streamlit 介面只負責呈現
+    display_integrated_backtest_ui(result, df, symbol_name, symbol=symbol, universe=universe)
+
+    return result
+
+def display_integrated_backtest_ui(result, df, symbol_name, symbol=None, universe=None):
     import plotly.graph_objects as go
     from plotly.subplots import make_subplots
+    from utils.charting import candlestick_trace, line_trace
 
     st.subheader(f"📊 {symbol_name} 策略深度分析")
 
     # --- 第一層：核心指標 (Metrics) ---
     m1, m2, m3, m4 = st.columns(4)
 
-    total_ret = pf.total_return() * 100
-    mdd = pf.stats()['Max Drawdown [%]'] if 'Max Drawdown [%]' in pf.stats().index else 0.0
-    win_rate = pf.trades.win_rate() * 100 if pf.trades.count() > 0 else 0.0
-    pf_factor = pf.trades.profit_factor() if pf.trades.count() > 0 else 0.0
-
-    win_rate = 0.0 if np.isnan(win_rate) else win_rate
-    pf_factor = 0.0 if np.isnan(pf_factor) else pf_factor
-
-    m1.metric("累積報酬率", f"{total_ret:.2f}%")
-    m2.metric("勝率 (Win Rate)", f"{win_rate:.2f}%")
-    m3.metric("最大回撤 (MDD)", f"{mdd:.2f}%")
-    m4.metric("獲利因子 (PF)", f"{pf_factor:.2f}")
+    metrics = result.metrics
+    m1.metric("累積報酬率", f"{metrics['total_return']:.2f}%")
+    m2.metric("勝率 (Win Rate)", f"{metrics['win_rate']:.2f}%")
+    m3.metric("最大回撤 (MDD)", f"{metrics['max_drawdown']:.2f}%")
+    m4.metric("獲利因子 (PF)", f"{metrics['profit_factor']:.2f}")
 
     # --- AI 評論區 (Benchmark Comparison) ---
     st.divider()
@@ -69,17 +171,15 @@ def display_integrated_backtest_ui(pf, df, symbol_name):
     """)
     st.divider()
 
-    # --- 計算繪圖用資料 ---
-    equity = pf.value()
-    cumulative_returns = (equity / equity.iloc[0] - 1) * 100
-    running_max = equity.cummax()
-    drawdown = (equity - running_max) / running_max * 100
-
-    close = df['Close']
-    ma5 = vbt.MA.run(close, 5).ma
-    ma10 = vbt.MA.run(close, 10).ma
-    entries_sig = (close > ma5) & (close > ma10)
-    exits_sig = close < ma10
+    # --- 繪圖用資料 (直接取自回測結果，不重算) ---
+    cumulative_returns = result.cumulative_returns
+    drawdown = result.drawdown
+    ma5 = result.ma_fast
+    ma10 = result.ma_slow
+    entries_sig = result.entries
+    exits_sig = result.exits
+    fast_label = f"{result.strategy['fast']}MA"
+    slow_label = f"{result.strategy['slow']}MA"
 
     # --- 第二層：分頁整合 (Tabs) ---
     tab_charts, tab_signals, tab_data, tab_opt = st.tabs(["📈 績效曲線", "📍 進出場點", "📄 交易明細", "🔥 參數尋優"])
@@ -88,13 +188,13 @@ def display_integrated_backtest_ui(pf, df, symbol_name):
         fig_perf = make_subplots(rows=2, cols=1, shared_xaxes=True,
                                  row_heights=[0.65, 0.35], vertical_spacing=0.06,
                                  subplot_titles=("累積報酬率 (%)", "水下圖 Drawdown (%)"))
-        fig_perf.add_trace(go.Scatter(
-            x=cumulative_returns.index, y=cumulative_returns,
+        fig_perf.add_trace(line_trace(
+            cumulative_returns,
             name="累積報酬", fill='tozeroy',
             line=dict(color='#00d4aa', width=2)
         ), row=1, col=1)
-        fig_perf.add_trace(go.Scatter(
-            x=drawdown.index, y=drawdown,
+        fig_perf.add_trace(line_trace(
+            drawdown,
             name="回撤", fill='tozeroy',
             line=dict(color='#ff4b4b', width=1.5)
         ), row=2, col=1)
@@ -104,16 +204,14 @@ def display_integrated_backtest_ui(pf, df, symbol_name):
 
     with tab_signals:
         fig_signals = go.Figure()
-        fig_signals.add_trace(go.Candlestick(
-            x=df.index, open=df['Open'], high=df['High'],
-            low=df['Low'], close=df['Close'], name="K線"
-        ))
-        fig_signals.add_trace(go.Scatter(
-            x=df.index, y=ma5, name="5MA",
+        # K 棒與均線先降採樣，進出場標記數量少，維持原始點位
+        fig_signals.add_trace(candlestick_trace(df, name="K線"))
+        fig_signals.add_trace(line_trace(
+            ma5, name=fast_label,
             line=dict(color='yellow', width=1)
         ))
-        fig_signals.add_trace(go.Scatter(
-            x=df.index, y=ma10, name="10MA",
+        fig_signals.add_trace(line_trace(
+            ma10, name=slow_label,
             line=dict(color='cyan', width=1)
         ))
         # 標注進場點
@@ -139,7 +237,7 @@ def display_integrated_backtest_ui(pf, df, symbol_name):
         st.subheader("策略統計摘要")
         
         # 取得 stats 並將小數點統一處理 (例如 2 位數)
-        stats_df = pd.DataFrame(pf.stats())
+        stats_df = pd.DataFrame(result.stats)
         stats_df.columns = ["數值"]
         
         # 針對浮點數欄位做四捨五入格式化
@@ -148,70 +246,91 @@ def display_integrated_backtest_ui(pf, df, symbol_name):
                 return round(x, 2)
             return x
             
-        stats_df["數值"] = stats_df["數值"].apply(format_value)
+        # 混合型別 (日期、期間、數字) 統一轉成文字顯示
+        stats_df["數值"] = stats_df["數值"].apply(format_value).astype(str)
         st.dataframe(stats_df, use_container_width=True)
 
         st.subheader("每筆交易明細")
-        try:
-            st.dataframe(pf.trades.records_readable, use_container_width=True)
-        except Exception:
-            st.dataframe(pd.DataFrame(pf.trades.records), use_container_width=True)
+        st.dataframe(result.trades, use_container_width=True)
 
     with tab_opt:
-        run_parameter_optimization(df)
+        run_parameter_optimization(df, symbol=symbol or symbol_name, universe=universe)
 
-def run_parameter_optimization(df):
-    import numpy as np
-    import vectorbt as vbt
-    import plotly.graph_objects as go
-    import streamlit as st
-    import pandas as pd
-    
-    st.subheader("🔥 均線參數熱力圖 (參數尋優)")
-    
-    close = df['Close']
-    
-    # 1. 定義要測試的參數範圍
-    fast_ma_range = np.arange(3, 16)  # 快線：3 到 15 天
-    slow_ma_range = np.arange(10, 31) # 慢線：10 到 30 天
-    
-    # VectorBT MA range requires grid flattening to test all combinations properly
-    # (修正原本無法直接傳入 list_of_ranges 的問題)
-    fast_grid, slow_grid = np.meshgrid(fast_ma_range, slow_ma_range)
-    fast_windows = fast_grid.flatten()
-    slow_windows = slow_grid.flatten()
-
-    # 2. 向量化計算所有組合的均線
-    fast_mas = vbt.MA.run(close, window=fast_windows)
-    slow_mas = vbt.MA.run(close, window=slow_windows)
-    
-    # 3. 定義進出場邏輯 (多頭排列)
-    entries = fast_mas.ma_crossed_above(slow_mas.ma)
-    exits = fast_mas.ma_crossed_below(slow_mas.ma)
-    
-    # 4. 執行批量回測 (考慮台股成本)
-    portfolio = vbt.Portfolio.from_signals(
-        close, entries, exits, 
-        fees=0.0004, 
-        freq='1D'
+@st.cache_data(show_spinner="🔥 正在執行 Walk-Forward 參數尋優...")
+def cached_walk_forward(symbols, versions, params_items, _closes):
+    """
+    run_walk_forward cached by (symbols, data versions, optimizer params).
+    """
+    return run_walk_forward(
+        _closes, **dict(params_items),
+        fees=TW_COST_MODEL["fees"], slippage=TW_COST_MODEL["slippage"]
     )
+
+def run_parameter_optimization(df, symbol="個股", universe=None):
+    import plotly.graph_objects as go
     
-    # 5. 提取總報酬率矩陣並轉化為 Heatmap 資料
-    # flatten() 返回的一維結果我們需要重塑回 (len(slow_ma_range), len(fast_ma_range))
-    total_returns = portfolio.total_return().values.reshape(len(slow_ma_range), len(fast_ma_range))
-    
-    # 6. 使用 Plotly 繪製熱力圖
+    st.subheader("🔥 均線參數熱力圖 (Walk-Forward 參數尋優)")
+    st.caption("在滾動的訓練期挑出報酬最高的快慢線組合，再到緊接其後、未參與挑選的測試期驗證，避免「用同一段資料挑參數又打分數」的前視偏誤。")
+
+    with st.form("walk_forward_form"):
+        c1, c2, c3 = st.columns(3)
+        train_bars = c1.number_input("訓練期 (K 棒數)", min_value=40, max_value=1000, value=120, step=10)
+        test_bars = c2.number_input("測試期 (K 棒數)", min_value=5, max_value=250, value=20, step=5)
+        step = c3.number_input("視窗移動 (K 棒數)", min_value=5, max_value=250, value=20, step=5)
+        c4, c5 = st.columns(2)
+        fast_min, fast_max = c4.slider("快線範圍 (天)", 2, 30, (3, 15))
+        slow_min, slow_max = c5.slider("慢線範圍 (天)", 5, 120, (10, 30))
+        include_universe = st.checkbox(
+            "同時納入自選股全部個股", value=False,
+            disabled=not universe or len(universe) < 2
+        )
+        submitted = st.form_submit_button("🚀 執行 Walk-Forward")
+
+    if submitted:
+        st.session_state['walk_forward_params'] = {
+            "train_bars": int(train_bars),
+            "test_bars": int(test_bars),
+            "step": int(step),
+            "fast_range": tuple(range(fast_min, fast_max + 1)),
+            "slow_range": tuple(range(slow_min, slow_max + 1)),
+            "include_universe": include_universe,
+        }
+    params = st.session_state.get('walk_forward_params')
+    if params is None:
+        st.info("設定訓練/測試視窗與參數範圍後，按下「執行 Walk-Forward」開始尋優。")
+        return
+
+    params = dict(params)
+    frames = dict(universe) if params.pop("include_universe") and universe else {symbol: df}
+    symbols = tuple(sorted(frames))
+    closes = {sym: frames[sym]['Close'] for sym in symbols}
+    try:
+        result = cached_walk_forward(
+            symbols, tuple(data_version(frames[sym]) for sym in symbols),
+            tuple(sorted(params.items())), closes
+        )
+    except ValueError as e:
+        st.warning(f"⚠️ {e}")
+        return
+
+    summary = result.summary
+    k1, k2, k3 = st.columns(3)
+    k1.metric("視窗數", summary["window_count"])
+    k2.metric("平均樣本內報酬", f"{summary['mean_train_return'] * 100:.2f}%")
+    k3.metric("平均樣本外報酬", f"{summary['mean_test_return'] * 100:.2f}%")
+
+    # 使用 Plotly 繪製熱力圖 (樣本外)
     fig = go.Figure(data=go.Heatmap(
-        z=total_returns * 100, # 轉為百分比
-        x=fast_ma_range,
-        y=slow_ma_range,
+        z=result.oos_returns * 100, # 轉為百分比
+        x=list(result.fast_range),
+        y=list(result.slow_range),
         colorscale='Viridis',
         colorbar=dict(title='報酬率 (%)'),
-        hovertemplate='快線: %{x}天<br>慢線: %{y}天<br>報酬率: %{z:.2f}%<extra></extra>'
+        hovertemplate='快線: %{x}天<br>慢線: %{y}天<br>平均樣本外報酬: %{z:.2f}%<extra></extra>'
     ))
 
     fig.update_layout(
-        title='不同均線組合的總報酬率分佈',
+        title='各均線組合的平均樣本外 (測試期) 報酬率',
         xaxis_title='快速均線天數',
         yaxis_title='慢速均線天數',
         template="plotly_dark",
@@ -219,12 +338,230 @@ def run_parameter_optimization(df):
     )
 
     st.plotly_chart(fig, use_container_width=True)
-    
-    # 找出最優參數
-    best_idx = np.unravel_index(np.argmax(total_returns), total_returns.shape)
-    best_fast = fast_ma_range[best_idx[1]]
-    best_slow = slow_ma_range[best_idx[0]]
-    best_return = total_returns[best_idx]
-    
-    st.success(f"✅ 最佳組合找到囉！ 快線: **{best_fast}** 天, 慢線: **{best_slow}** 天")
-    st.write(f"在該組合下，預期總報酬率為: **{best_return*100:.2f}%**")
\ No newline at end of file
+
+    st.write("#### 各視窗選出的參數")
+    windows_df = result.windows.rename(columns={
+        "symbol": "代碼", "train_start": "訓練起", "train_end": "訓練迄",
+        "test_start": "測試起", "test_end": "測試迄", "best_fast": "快線",
+        "best_slow": "慢線", "train_return": "樣本內報酬%", "test_return": "樣本外報酬%"
+    })
+    windows_df["樣本內報酬%"] = (windows_df["樣本內報酬%"] * 100).round(2)
+    windows_df["樣本外報酬%"] = (windows_df["樣本外報酬%"] * 100).round(2)
+    st.dataframe(windows_df, use_container_width=True)
+
+    compounded = summary["compounded_test_return"]
+    st.success("✅ 串接每段樣本外報酬的複利結果：" + "、".join(
+        f"{sym} **{ret * 100:.2f}%**" for sym, ret in compounded.items()
+    ))
+    st.caption("💡 樣本內報酬遠高於樣本外時，代表參數多半是對歷史過度配適，實戰請保守看待。")
+
+# --- 組合回測：整份自選股共用一個資金池 ---
+
+@dataclass
+class PortfolioBacktestResult:
+    """
+    Watchlist-level backtest output; picklable like BacktestResult.
+    """
+    allocation: str
+    max_positions: int
+    strategy: dict
+    cost_model: dict
+    equity: pd.Series
+    cumulative_returns: pd.Series
+    drawdown: pd.Series
+    weights: pd.DataFrame
+    positions: pd.Series
+    contribution: pd.Series
+    trades: pd.DataFrame
+    stats: pd.Series
+    metrics: dict = field(default_factory=dict)
+
+def _select_holdings(desired, priority, max_positions):
+    """
+    Cap concurrent holdings at max_positions. Names already held keep their slot;
+    free slots go to the new signals with the highest priority.
+    """
+    n_bars, n_symbols = desired.shape
+    holdings = np.zeros_like(desired)
+    held = np.zeros(n_symbols, dtype=bool)
+    for t in range(n_bars):
+        held &= desired[t]
+        free = max_positions - held.sum()
+        candidates = desired[t] & ~held
+        if free > 0 and candidates.any():
+            order = np.argsort(np.where(candidates, -priority[t], np.inf), kind='stable')
+            picked = order[:min(free, candidates.sum())]
+            held[picked] = True
+        holdings[t] = held
+    return holdings
+
+def compute_portfolio_backtest(closes, strategy=None, cost_model=None,
+                               allocation="equal", max_positions=None, vol_window=20):
+    """
+    Run the right-side strategy on every symbol against one shared cash pool.
+
+    All signals are computed on a (date x symbol) panel and simulated in a single
+    grouped vectorbt portfolio. Each position is sized once at entry:
+      equal       1 / max_positions of the portfolio per position
+      volatility  the equal slot scaled by (cross-sectional median vol / own vol),
+                  clipped to 0.25x-2x, so calmer stocks get bigger positions
+    """
+    strategy = {**DEFAULT_STRATEGY, **(strategy or {})}
+    cost_model = {**TW_COST_MODEL, **(cost_model or {})}
+    if allocation not in ALLOCATION_RULES:
+        raise ValueError(f"Unknown allocation rule: {allocation}")
+
+    close = pd.DataFrame(closes).sort_index()
+    n_symbols = close.shape[1]
+    max_positions = int(max_positions or n_symbols)
+
+    # 1. 面板化的進出場訊號 (與單檔策略相同)
+    ma_fast = close.rolling(strategy["fast"]).mean()
+    ma_slow = close.rolling(strategy["slow"]).mean()
+    entries = (close > ma_fast) & (close > ma_slow)
+    exits = close < ma_slow
+    desired = pd.DataFrame(np.nan, index=close.index, columns=close.columns)
+    desired[entries] = 1.0
+    desired[exits] = 0.0
+    desired = desired.ffill().fillna(0.0).astype(bool)
+
+    # 2. 持股上限：優先保留既有部位，新部位依站上慢線的強度排序
+    priority = (close / ma_slow - 1).fillna(-np.inf).to_numpy()
+    holdings = _select_holdings(desired.to_numpy(), priority, max_positions)
+    holdings = pd.DataFrame(holdings, index=close.index, columns=close.columns)
+
+    # 3. 進場時決定目標權重，持有期間不再調整
+    slot = 1.0 / max_positions
+    if allocation == "volatility":
+        vol = close.pct_change().rolling(vol_window).std()
+        scale = vol.median(axis=1).to_numpy()[:, None] / vol
+        target = (slot * scale.clip(0.25, 2.0)).fillna(slot)
+    else:
+        target = pd.DataFrame(slot, index=close.index, columns=close.columns)
+
+    previous = holdings.shift(1, fill_value=False)
+    buys = holdings & ~previous
+    sells = ~holdings & previous
+    size = pd.DataFrame(np.nan, index=close.index, columns=close.columns)
+    size[buys] = target[buys]
+    size[sells] = 0.0
+
+    # 4. 單一 vectorbt 組合：共用現金、先賣後買，賣出加收證交稅
+    pf = vbt.Portfolio.from_orders(
+        close.ffill().bfill(),
+        size,
+        size_type='targetpercent',
+        init_cash=cost_model["init_cash"],
+        fees=_order_fees(sells, cost_model),
+        slippage=cost_model["slippage"],
+        cash_sharing=True,
+        group_by=True,
+        call_seq='auto',
+        freq='1D'
+    )
+
+    stats, metrics, trades = _summarize_portfolio(pf)
+    equity = pf.value()
+    running_max = equity.cummax()
+    asset_value = pf.asset_value(group_by=False)
+    weights = asset_value.div(equity, axis=0).fillna(0.0) * 100
+    try:
+        contribution = trades.groupby('Column')['PnL'].sum().reindex(close.columns, fill_value=0.0)
+    except Exception:
+        contribution = pd.Series(0.0, index=close.columns)
+
+    return PortfolioBacktestResult(
+        allocation=allocation,
+        max_positions=max_positions,
+        strategy=strategy,
+        cost_model=cost_model,
+        equity=equity,
+        cumulative_returns=(equity / equity.iloc[0] - 1) * 100,
+        drawdown=(equity - running_max) / running_max * 100,
+        weights=weights,
+        positions=(asset_value > 0).sum(axis=1),
+        contribution=contribution,
+        trades=trades,
+        stats=stats,
+        metrics=metrics,
+    )
+
+@st.cache_data(show_spinner="📦 正在執行組合回測...")
+def cached_portfolio_backtest(symbols, versions, allocation, max_positions, strategy_items, cost_items, _closes):
+    """
+    compute_portfolio_backtest cached by (symbols, data versions, allocation, strategy, cost model).
+    """
+    return compute_portfolio_backtest(
+        _closes, dict(strategy_items), dict(cost_items),
+        allocation=allocation, max_positions=max_positions
+    )
+
+def run_portfolio_backtest(data_dict, names=None):
+    import plotly.graph_objects as go
+    from plotly.subplots import make_subplots
+
+    names = names or {}
+    symbols = tuple(sorted(sym for sym, df in data_dict.items() if df is not None and not df.empty))
+    if len(symbols) < 2:
+        st.info("組合回測至少需要兩檔自選股。")
+        return None
+
+    st.subheader("📦 自選股組合回測 (共用資金池)")
+    c1, c2, c3 = st.columns(3)
+    allocation = c1.selectbox("資金分配", list(ALLOCATION_RULES), format_func=ALLOCATION_RULES.get)
+    max_positions = c2.slider("同時持股上限", 1, len(symbols), min(5, len(symbols)))
+    init_cash = c3.number_input("初始資金", min_value=100000, value=TW_COST_MODEL["init_cash"], step=100000)
+
+    cost_model = {**TW_COST_MODEL, "init_cash": int(init_cash)}
+    result = cached_portfolio_backtest(
+        symbols, tuple(data_version(data_dict[sym]) for sym in symbols),
+        allocation, int(max_positions),
+        tuple(sorted(DEFAULT_STRATEGY.items())), tuple(sorted(cost_model.items())),
+        {sym: data_dict[sym]['Close'] for sym in symbols}
+    )
+
+    metrics = result.metrics
+    m1, m2, m3, m4 = st.columns(4)
+    m1.metric("組合累積報酬率", f"{metrics['total_return']:.2f}%")
+    m2.metric("勝率 (Win Rate)", f"{metrics['win_rate']:.2f}%")
+    m3.metric("最大回撤 (MDD)", f"{metrics['max_drawdown']:.2f}%")
+    m4.metric("交易次數", metrics['trade_count'])
+    st.caption(f"成本：手續費 {cost_model['fees'] * 100:.4f}% (買賣皆收)、證交稅 {cost_model['tax'] * 100:.1f}% (僅賣出)、滑價 {cost_model['slippage'] * 100:.1f}%")
+
+    fig_perf = make_subplots(rows=2, cols=1, shared_xaxes=True,
+                             row_heights=[0.65, 0.35], vertical_spacing=0.06,
+                             subplot_titles=("組合累積報酬率 (%)", "水下圖 Drawdown (%)"))
+    fig_perf.add_trace(go.Scatter(
+        x=result.cumulative_returns.index, y=result.cumulative_returns,
+        name="累積報酬", fill='tozeroy', line=dict(color='#00d4aa', width=2)
+    ), row=1, col=1)
+    fig_perf.add_trace(go.Scatter(
+        x=result.drawdown.index, y=result.drawdown,
+        name="回撤", fill='tozeroy', line=dict(color='#ff4b4b', width=1.5)
+    ), row=2, col=1)
+    fig_perf.update_layout(height=500, template="plotly_dark", margin=dict(t=30), showlegend=False)
+    st.plotly_chart(fig_perf, use_container_width=True)
+
+    # 各檔持股權重堆疊圖
+    fig_weights = go.Figure()
+    for sym in result.weights.columns:
+        fig_weights.add_trace(go.Scatter(
+            x=result.weights.index, y=result.weights[sym], stackgroup='weights',
+            name=names.get(sym, sym), mode='lines', line=dict(width=0.5)
+        ))
+    fig_weights.update_layout(height=350, template="plotly_dark", title="持股權重 (%)",
+                              yaxis=dict(range=[0, 100]))
+    st.plotly_chart(fig_weights, use_container_width=True)
+
+    st.write("#### 各檔損益貢獻")
+    contribution_df = pd.DataFrame({
+        "代碼": result.contribution.index,
+        "名稱": [names.get(sym, sym) for sym in result.contribution.index],
+        "已實現損益": result.contribution.round(0).values,
+    }).sort_values("已實現損益", ascending=False)
+    st.dataframe(contribution_df, use_container_width=True, hide_index=True)
+
+    with st.expander("📄 交易明細"):
+        st.dataframe(result.trades, use_container_width=True)
+
+    return result
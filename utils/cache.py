@@ -0,0 +1,148 @@
+import threading
+from collections import defaultdict
+
+# 依「股票 × 資料種類」分開的快取：新增或更新一檔股票只會重算那一檔，其他快取維持有效
+# 每個項目記錄 (版本, epoch)：版本在手動失效時遞增，epoch 來自交易日曆 (新資料可能出現時改變)
+KINDS = ("indicators", "health", "flows")
+
+# 其他 K 線週期的衍生資料以 "indicators@1w" 這類種類存放，失效時隨基礎種類一起處理
+TIMEFRAME_SEP = "@"
+
+# 上游資料失效時一併失效的衍生資料
+DEPENDENTS = {
+    "indicators": ("health",),
+}
+
+
+class SymbolCache:
+    """
+    Thread-safe cache of per-symbol values, one slot per (kind, symbol).
+
+    An entry is valid while its version matches the current version of its
+    slot and its epoch matches the caller's epoch. invalidate() bumps versions,
+    so only the named symbols (and their dependent kinds) are recomputed.
+    A value is stored under the version read before it was computed, and
+    dropped if the slot was invalidated meanwhile.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._entries = {}
+        self._versions = defaultdict(int)
+        # 正在計算中的格子 (同一格可能同時被多個工作階段計算)
+        self._computing = defaultdict(int)
+        self.hits = 0
+        self.misses = 0
+
+    def version(self, kind, symbol):
+        return self._versions[(kind, symbol)]
+
+    def _lookup(self, kind, symbol, epoch):
+        entry = self._entries.get((kind, symbol))
+        if entry is None:
+            return False, None
+        version, entry_epoch, value = entry
+        if version != self._versions[(kind, symbol)] or entry_epoch != epoch:
+            return False, None
+        return True, value
+
+    def put(self, kind, symbol, epoch, value, version=None):
+        """
+        Store a value; with `version` (read before computing it), only if the slot
+        has not been invalidated since. Returns True if the value was stored.
+        """
+        with self._lock:
+            current = self._versions[(kind, symbol)]
+            if version is not None and version != current:
+                return False
+            self._entries[(kind, symbol)] = (current, epoch, value)
+            return True
+
+    def _begin(self, kind, symbols):
+        # 呼叫端持有鎖：記下計算前的版本，並標記為計算中
+        versions = {}
+        for sym in symbols:
+            self._computing[(kind, sym)] += 1
+            versions[sym] = self._versions[(kind, sym)]
+        return versions
+
+    def _finish(self, kind, versions):
+        with self._lock:
+            for sym in versions:
+                key = (kind, sym)
+                self._computing[key] -= 1
+                if not self._computing[key]:
+                    del self._computing[key]
+
+    def get(self, kind, symbol, epoch, compute):
+        """
+        The cached value of one slot, calling compute() on a miss.
+        """
+        with self._lock:
+            found, value = self._lookup(kind, symbol, epoch)
+            if found:
+                self.hits += 1
+                return value
+            self.misses += 1
+            versions = self._begin(kind, [symbol])
+        try:
+            value = compute()
+            # 計算期間被 invalidate() 的結果可能是舊資料，不放進快取
+            self.put(kind, symbol, epoch, value, versions[symbol])
+        finally:
+            self._finish(kind, versions)
+        return value
+
+    def get_many(self, kind, symbols, epoch, compute_many):
+        """
+        Values for several symbols; compute_many(missing_symbols) is called once
+        with only the symbols that are not cached and must return {symbol: value}.
+        Symbols it leaves out are simply absent from the result.
+        """
+        result = {}
+        missing = []
+        with self._lock:
+            for sym in symbols:
+                found, value = self._lookup(kind, sym, epoch)
+                if found:
+                    result[sym] = value
+                else:
+                    missing.append(sym)
+            self.hits += len(result)
+            self.misses += len(missing)
+            versions = self._begin(kind, missing)
+        if missing:
+            try:
+                computed = compute_many(missing)
+                for sym, value in computed.items():
+                    if sym in versions:
+                        self.put(kind, sym, epoch, value, versions[sym])
+                    result[sym] = value
+            finally:
+                self._finish(kind, versions)
+        return {sym: result[sym] for sym in symbols if sym in result}
+
+    def invalidate(self, symbols=None, kinds=None):
+        """
+        Drop the given kinds (all by default) for the given symbols (all by default),
+        together with the kinds derived from them.
+        """
+        kinds = set(kinds or KINDS)
+        for kind in list(kinds):
+            kinds.update(DEPENDENTS.get(kind, ()))
+        with self._lock:
+            # 計算中的格子也要遞增版本，計算完成時才不會把舊資料當成新的存進來
+            targets = [key for key in [*self._entries, *self._computing] if key[0].split(TIMEFRAME_SEP)[0] in kinds
+                       and (symbols is None or key[1] in symbols)]
+            if symbols is not None:
+                targets += [(kind, sym) for kind in kinds for sym in symbols]
+            for key in set(targets):
+                self._versions[key] += 1
+                self._entries.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            per_kind = defaultdict(int)
+            for kind, _ in self._entries:
+                per_kind[kind] += 1
+            return {"entries": dict(per_kind), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,177 @@
+import time
+import argparse
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+
+# 圖表資料層：送到瀏覽器前先降採樣，長期間 (10 年以上或盤中資料) 的圖表才不會卡頓
+# K 棒以連續區間合併 (保留每段的開高低收)，指標線以 LTTB 保留走勢形狀
+MAX_CANDLES = 600
+MAX_LINE_POINTS = 1500
+
+# 超過這個點數的折線改用 WebGL (Scattergl) 繪製
+WEBGL_THRESHOLD = 1000
+
+# 技術分析頁的顯示範圍 (交易日數)，降採樣只針對可見範圍計算
+VISIBLE_RANGES = {
+    "3 個月": 63,
+    "6 個月": 126,
+    "1 年": 252,
+    "3 年": 756,
+    "全部": None,
+}
+
+
+def visible_slice(data, bars=None):
+    """
+    The last `bars` rows of a DataFrame/Series (all rows when bars is None).
+    """
+    if bars is None or len(data) <= bars:
+        return data
+    return data.iloc[-bars:]
+
+
+def _bucket_starts(n, max_points):
+    size = int(np.ceil(n / max_points))
+    return np.arange(0, n, size)
+
+
+def downsample_ohlc(df, max_bars=MAX_CANDLES):
+    """
+    Merge consecutive bars into at most `max_bars` buckets: first open, highest high,
+    lowest low, last close and summed volume, stamped with the bucket's first date.
+    """
+    n = len(df)
+    if n <= max_bars:
+        return df
+    starts = _bucket_starts(n, max_bars)
+    ends = np.append(starts[1:], n) - 1
+    out = {
+        'Open': df['Open'].to_numpy()[starts],
+        'High': np.fmax.reduceat(df['High'].to_numpy(dtype=float), starts),
+        'Low': np.fmin.reduceat(df['Low'].to_numpy(dtype=float), starts),
+        'Close': df['Close'].to_numpy()[ends],
+    }
+    if 'Volume' in df:
+        out['Volume'] = np.add.reduceat(np.nan_to_num(df['Volume'].to_numpy(dtype=float)), starts)
+    return pd.DataFrame(out, index=df.index[starts])
+
+
+def lttb_indices(y, threshold):
+    """
+    Positions kept by Largest-Triangle-Three-Buckets on an evenly spaced series:
+    the first and last point plus, per bucket, the point forming the largest
+    triangle with the previously kept point and the next bucket's average.
+    """
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.arange(n, dtype=float)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    kept = [0]
+    a = 0
+    for i in range(threshold - 2):
+        lo, hi = edges[i], edges[i + 1]
+        if hi <= lo:
+            continue
+        # 下一個區間的平均點 (最後一個區間以終點代替)
+        nlo, nhi = hi, edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[nlo:nhi].mean() if nhi > nlo else x[-1]
+        avg_y = y[nlo:nhi].mean() if nhi > nlo else y[-1]
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(np.argmax(area))
+        kept.append(a)
+    kept.append(n - 1)
+    return np.asarray(kept)
+
+
+def downsample_line(series, max_points=MAX_LINE_POINTS):
+    """
+    LTTB-downsample an indicator line; leading/trailing NaNs (warm-up periods) are dropped.
+    """
+    series = series.dropna()
+    if len(series) <= max_points:
+        return series
+    return series.iloc[lttb_indices(series.to_numpy(dtype=float), max_points)]
+
+
+def downsample_bars(series, max_points=MAX_CANDLES):
+    """
+    Downsample a histogram (e.g. MACD bars) by keeping the largest-magnitude value of each bucket.
+    """
+    n = len(series)
+    if n <= max_points:
+        return series
+    values = np.nan_to_num(series.to_numpy(dtype=float))
+    starts = _bucket_starts(n, max_points)
+    ends = np.append(starts[1:], n)
+    picks = [s + int(np.argmax(np.abs(values[s:e]))) for s, e in zip(starts, ends)]
+    return series.iloc[picks]
+
+
+def line_trace(series, max_points=MAX_LINE_POINTS, **kwargs):
+    """
+    A downsampled line trace; Scattergl once the point count passes WEBGL_THRESHOLD.
+    """
+    series = downsample_line(series, max_points)
+    trace_type = go.Scattergl if len(series) > WEBGL_THRESHOLD else go.Scatter
+    return trace_type(x=series.index, y=series.to_numpy(), **kwargs)
+
+
+def candlestick_trace(df, max_bars=MAX_CANDLES, **kwargs):
+    bars = downsample_ohlc(df, max_bars)
+    return go.Candlestick(x=bars.index, open=bars['Open'], high=bars['High'],
+                          low=bars['Low'], close=bars['Close'], **kwargs)
+
+
+def figure_stats(fig):
+    """
+    Points, JSON payload size and serialization time of a figure as sent to the browser.
+    """
+    started = time.perf_counter()
+    payload = fig.to_json()
+    elapsed = time.perf_counter() - started
+    points = sum(len(trace.x) for trace in fig.data if trace.x is not None)
+    return {"points": points, "bytes": len(payload.encode("utf-8")), "seconds": elapsed}
+
+
+def _random_walk(bars, seed=0):
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.015, bars)))
+    open_ = close * (1 + rng.normal(0, 0.005, bars))
+    spread = np.abs(rng.normal(0, 0.01, bars)) * close
+    index = pd.bdate_range(end=pd.Timestamp.today().normalize(), periods=bars)
+    return pd.DataFrame({
+        'Open': open_, 'High': np.maximum(open_, close) + spread, 'Low': np.minimum(open_, close) - spread,
+        'Close': close, 'Volume': rng.integers(1_000, 100_000, bars) * 1000.0,
+    }, index=index)
+
+
+def _build_figure(df, downsample):
+    ma = df['Close'].rolling(20).mean()
+    fig = go.Figure()
+    if downsample:
+        fig.add_trace(candlestick_trace(df))
+        fig.add_trace(line_trace(ma))
+    else:
+        fig.add_trace(go.Candlestick(x=df.index, open=df['Open'], high=df['High'], low=df['Low'], close=df['Close']))
+        fig.add_trace(go.Scatter(x=df.index, y=ma))
+    return fig
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="比較降採樣前後的圖表資料量")
+    parser.add_argument("--bars", type=int, nargs="+", default=[250, 2500, 12500, 60000])
+    args = parser.parse_args(argv)
+
+    for bars in args.bars:
+        df = _random_walk(bars)
+        full = figure_stats(_build_figure(df, downsample=False))
+        small = figure_stats(_build_figure(df, downsample=True))
+        print(f"{bars:>6} bars  full: {full['points']:>6} pts {full['bytes'] / 1024:>8.0f} KB {full['seconds'] * 1000:>7.1f} ms"
+              f"  downsampled: {small['points']:>5} pts {small['bytes'] / 1024:>6.0f} KB {small['seconds'] * 1000:>6.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,21 @@
 import yfinance as yf
 import pandas as pd
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
 import streamlit as st
 import requests
 import twstock
 
-@st.cache_data(ttl=86400)
+from utils import store, institutional, symbols, trading_calendar
+
+# 法人資料查詢涵蓋的日曆天數 (約 30 個交易日)
+INSTITUTIONAL_WINDOW_DAYS = 45
+
 def get_stock_name(symbol):
     """
     Get the friendly name of the stock in Traditional Chinese if possible.
+    Names come from the local symbol master, so no network call is made.
     """
     # Manual mapping for high-quality stocks to ensure Traditional Chinese
     tw_names = {
@@ -38,12 +45,9 @@ def get_stock_name(symbol):
         return tw_names[clean_sym]
 
     try:
-        ticker = yf.Ticker(symbol)
-        info = ticker.info
-        name = info.get('shortName') or info.get('longName') or symbol
-        # If it's a known placeholder or still looks too English, return symbol
-        return name
-    except:
+        return symbols.get_name(clean_sym) or symbol
+    except Exception as e:
+        print(f"Error looking up name for {symbol}: {e}")
         return symbol
 
 @st.cache_data(ttl=604800) # Update weekly
@@ -83,33 +87,233 @@ def get_tw_stock_candidates():
 def fetch_stock_data(symbol, period="1y"):
     """
     Fetch historical stock data for a given symbol.
+    Bars are served from the local store; only the missing date range is requested
+    from yfinance and appended.
     """
+    start = store.period_start(period)
+    stored = store.read_bars(symbol)
     try:
+        request = _plan_request(symbol, period, start, stored)
+        if request is None:
+            return store.slice_period(stored, start)
         ticker = yf.Ticker(symbol)
-        df = ticker.history(period=period)
-        if df.empty:
-            return None
+        new = ticker.history(**request)
+        df = _apply_update(symbol, period, start, stored, new, request)
+        if df is None and "start" in request:
+            # 除權息調整後歷史價格已變動，整段重抓
+            new = ticker.history(start=stored.index[0].strftime("%Y-%m-%d"))
+            df = _apply_update(symbol, period, start, stored, new, {"period": period})
+        if df is not None:
+            store.mark_checked([symbol])
         return df
     except Exception as e:
         print(f"Error fetching {symbol}: {e}")
+        # 網路失敗時退回本地資料
+        stored = store.slice_period(stored, start)
+        return stored if stored is not None and not stored.empty else None
+
+def _plan_request(symbol, period, start, stored, manifest=None):
+    """
+    Decide which range to ask the provider for: a delta from the stored bars,
+    or the full period when the store does not cover it yet.
+    Returns None when the stored bars are final and no request is needed.
+    """
+    manifest = manifest if manifest is not None else store.load_manifest()
+    if stored is not None and store.is_covered(symbol, start, manifest):
+        if trading_calendar.bars_final(store.last_checked(symbol, manifest)):
+            # 上次抓取之後沒有新的交易時段 (含假日、颱風假)，本地資料不會再變
+            return None
+        # 從倒數第二根 K 棒開始補抓：最後一根可能是盤中暫時 K 棒需覆寫，
+        # 倒數第二根則用來確認歷史價格沒有被還原調整過
+        anchor = stored.index[-2] if len(stored) > 1 else stored.index[-1]
+        return {"start": anchor.strftime("%Y-%m-%d")}
+    return {"period": period}
+
+def _apply_update(symbol, period, start, stored, new, request):
+    """
+    Merge newly fetched bars into the store and return the requested window.
+    Returns None when a delta no longer lines up with the stored history.
+    """
+    if "start" in request:
+        if not _is_consistent(stored, new, pd.Timestamp(request["start"])):
+            return None
+    df = store.merge_bars(stored, new)
+    if df is None or df.empty:
         return None
+    if df is not stored:
+        store.write_bars(symbol, df, covered_from=start if start is not None else store.FULL_HISTORY)
+    df = store.slice_period(df, start)
+    return df if not df.empty else None
+
+def _is_consistent(stored, new, anchor, tolerance=1e-4):
+    """
+    Check that the anchor bar of a delta fetch still matches the stored one.
+    A mismatch means yfinance re-adjusted the history (ex-dividend, split).
+    """
+    if new is None or new.empty or len(stored) < 2:
+        return True
+    if stored.index.tz is not None and new.index.tz is not None:
+        new = new.tz_convert(stored.index.tz)
+        anchor = anchor.tz_localize(stored.index.tz)
+    if anchor not in new.index:
+        return True
+    old_close = stored.loc[anchor, 'Close']
+    new_close = new.loc[anchor, 'Close']
+    return abs(new_close - old_close) <= tolerance * max(abs(old_close), 1.0)
 
 def fetch_multiple_stocks(symbols, period="1y"):
     """
     Fetch historical data for multiple stocks.
     """
+    data_dict, _ = fetch_stocks_bulk(symbols, period)
+    return data_dict
+
+def fetch_stocks_bulk(symbols, period="1y", max_workers=8, batch_size=50, retries=2):
+    """
+    Fetch many symbols at once.
+
+    Symbols that need the same date range are grouped into multi-symbol
+    yf.download batches, which run on a bounded thread pool. Anything a batch
+    could not deliver falls back to a per-symbol fetch with retries.
+
+    Returns (data_dict, failed) where failed maps symbol -> error message.
+    The store's manifest is written once for the whole call.
+    """
+    with store.batch():
+        return _fetch_stocks_bulk(symbols, period, max_workers, batch_size, retries)
+
+def _fetch_stocks_bulk(symbols, period, max_workers, batch_size, retries):
+    start = store.period_start(period)
+    manifest = store.load_manifest()
+    stored_bars = {sym: store.read_bars(sym) for sym in symbols}
+
+    # 依請求區間分組，同區間的股票一次批次下載
+    groups = {}
     data_dict = {}
-    for symbol in symbols:
+    for sym in symbols:
+        request = _plan_request(sym, period, start, stored_bars[sym], manifest)
+        if request is None:
+            data_dict[sym] = store.slice_period(stored_bars[sym], start)
+            continue
+        groups.setdefault(tuple(sorted(request.items())), []).append(sym)
+    final_symbols = set(data_dict)
+
+    failed = {}
+    retry_symbols = []
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {}
+        for key, group_symbols in groups.items():
+            request = dict(key)
+            for i in range(0, len(group_symbols), batch_size):
+                batch = group_symbols[i:i + batch_size]
+                futures[pool.submit(_download_batch, batch, request)] = (batch, request)
+
+        for future in as_completed(futures):
+            batch, request = futures[future]
+            try:
+                frames = future.result()
+            except Exception as e:
+                print(f"Batch download failed ({len(batch)} symbols): {e}")
+                retry_symbols.extend(batch)
+                continue
+            for sym in batch:
+                new = frames.get(sym)
+                if new is None or new.empty:
+                    if "start" in request:
+                        # 區間內沒有新 K 棒，直接使用本地資料
+                        data_dict[sym] = store.slice_period(stored_bars[sym], start)
+                    else:
+                        retry_symbols.append(sym)
+                    continue
+                try:
+                    df = _apply_update(sym, period, start, stored_bars[sym], new, request)
+                except Exception as e:
+                    print(f"Error storing {sym}: {e}")
+                    df = None
+                if df is None:
+                    retry_symbols.append(sym)
+                else:
+                    data_dict[sym] = df
+
+        # 批次沒拿到的股票改為單檔重試
+        retry_futures = {pool.submit(_fetch_with_retry, sym, period, retries): sym for sym in retry_symbols}
+        for future in as_completed(retry_futures):
+            sym = retry_futures[future]
+            df, error = future.result()
+            if df is not None:
+                data_dict[sym] = df
+            else:
+                failed[sym] = error
+
+    checked = [sym for sym in data_dict if sym not in final_symbols]
+    if checked:
+        store.mark_checked(checked)
+
+    # 保持輸入順序
+    data_dict = {sym: data_dict[sym] for sym in symbols if sym in data_dict}
+    return data_dict, failed
+
+def _download_batch(symbols, request):
+    """
+    Download one multi-symbol batch and split it into per-symbol frames
+    shaped like Ticker.history() output.
+    """
+    raw = yf.download(
+        symbols, group_by="ticker", auto_adjust=True, actions=True,
+        ignore_tz=False, threads=False, progress=False, **request
+    )
+    if raw is None or raw.empty:
+        return {}
+    if raw.index.tz is None:
+        raw.index = raw.index.tz_localize("Asia/Taipei")
+    else:
+        raw.index = raw.index.tz_convert("Asia/Taipei")
+
+    frames = {}
+    for sym in symbols:
+        if isinstance(raw.columns, pd.MultiIndex):
+            if sym not in raw.columns.get_level_values(0):
+                continue
+            df = raw[sym]
+        else:
+            df = raw
+        df = df.dropna(how="all")
+        if 'Close' in df.columns:
+            df = df.dropna(subset=['Close'])
+        if not df.empty:
+            frames[sym] = df.copy()
+    return frames
+
+def _fetch_with_retry(symbol, period, retries, backoff=1.0):
+    """
+    Per-symbol fallback with exponential backoff. Returns (df, error message).
+    """
+    for attempt in range(retries + 1):
         df = fetch_stock_data(symbol, period)
         if df is not None:
-            data_dict[symbol] = df
-    return data_dict
+            return df, None
+        if attempt < retries:
+            time.sleep(backoff * (2 ** attempt))
+    return None, f"no data after {retries + 1} attempts"
 
-@st.cache_data(ttl=3600)
 def get_institutional_data(stock_id):
     """
     抓取三大法人買賣超資料 (最近 30 日)
-    使用 FinMind API
+    上市股票直接查詢本地 T86 資料庫 (全市場每天只需一次請求)；
+    上櫃股票或本地資料尚未補齊時改用 FinMind API
+    T86 資料庫由盤後流程或 python -m utils.institutional backfill --days 60 補齊，不在畫面更新時抓取
+    """
+    if not stock_id.upper().endswith('.TWO'):
+        if institutional.covers(INSTITUTIONAL_WINDOW_DAYS):
+            df = institutional.get_stock_flows(stock_id, count=30)
+            if not df.empty:
+                return df
+    return _fetch_institutional_finmind(stock_id)
+
+@st.cache_data(ttl=3600)
+def _fetch_institutional_finmind(stock_id):
+    """
+    逐檔向 FinMind API 抓取三大法人買賣超資料 (最近 30 日)
     
     Args:
         stock_id: 股票代號 (如 "2330.TW" 或 "2330")
@@ -121,8 +325,8 @@ def get_institutional_data(stock_id):
     try:
         from FinMind.data import DataLoader
         
-        # 移除 .TW 後綴，取得純股票代號
-        clean_id = stock_id.replace('.TW', '').replace('.tw', '')
+        # 移除 .TW / .TWO 後綴，取得純股票代號
+        clean_id = stock_id.split('.')[0]
         
         # 計算日期範圍
         end_date = datetime.now()
@@ -147,46 +351,11 @@ def get_institutional_data(stock_id):
         
         # FinMind 資料結構：每個法人是分開的行，用 name 欄位區分
         # 欄位：date, stock_id, buy, sell, name
-        # name 值：Foreign_Investor (外資), Investment_Trust (投信), Dealer_self (自營商自營)
-        
-        # 按日期分組處理
-        result_data = []
-        for date, group in df.groupby('date'):
-            trade_date = pd.to_datetime(date)
-            
-            # 初始化各法人買賣超
-            foreign = 0
-            trust = 0
-            dealer = 0
-            
-            # 找出各法人的買賣超 (buy - sell，單位：千股)
-            for _, row in group.iterrows():
-                investor_type = row['name']
-                buy_sell_diff = (float(row.get('buy', 0)) - float(row.get('sell', 0))) / 1000  # 轉張數
-                
-                if investor_type == 'Foreign_Investor':
-                    foreign = buy_sell_diff
-                elif investor_type == 'Investment_Trust':
-                    trust = buy_sell_diff
-                elif investor_type == 'Dealer_self':
-                    dealer = buy_sell_diff
-            
-            result_data.append({
-                '日期': trade_date,
-                '外資買賣超': foreign,
-                '投信買賣超': trust,
-                '自營商買賣超': dealer
-            })
-        
-        if not result_data:
+        # 以樞紐轉換一次完成，與 T86 本地資料庫相同格式
+        flows = institutional.reshape_institutional(df)
+        if flows.empty:
             return pd.DataFrame()
-        
-        # 轉換為 DataFrame
-        result_df = pd.DataFrame(result_data)
-        result_df = result_df.sort_values('日期', ascending=False).head(30)
-        result_df = result_df.sort_values('日期')
-        
-        return result_df
+        return institutional.to_display(flows.droplevel("stock_id"), count=30)
         
     except Exception as e:
         print(f"抓取 {stock_id} 法人資料時發生錯誤: {e}")
@@ -0,0 +1,244 @@
+import math
+from collections import deque
+
+import pandas as pd
+
+from utils.technical import DEFAULT_INDICATORS, indicator_columns, unit_columns
+
+NAN = float('nan')
+
+
+class _RollingWindow:
+    """
+    Fixed-size window keeping a running sum (and sum of squares) of its values.
+    """
+    # 每累積這麼多次更新就從視窗重新加總一次，避免浮點誤差累積
+    RESYNC_EVERY = 1000
+
+    def __init__(self, size, offset=0.0):
+        self.size = size
+        self.offset = offset
+        self.values = deque(maxlen=size)
+        self.total = 0.0
+        self.total_sq = 0.0
+        self._updates = 0
+        self._undo = None
+
+    def push(self, value):
+        value -= self.offset
+        # 記下被擠出的值與加總，undo() 可在 O(1) 內還原這一次 push
+        old = self.values[0] if len(self.values) == self.size else None
+        self._undo = (old, self.total, self.total_sq, self._updates)
+        if old is not None:
+            self.total -= old
+            self.total_sq -= old * old
+        self.values.append(value)
+        self.total += value
+        self.total_sq += value * value
+        self._updates += 1
+        if self._updates >= self.RESYNC_EVERY:
+            self.total = math.fsum(self.values)
+            self.total_sq = math.fsum(v * v for v in self.values)
+            self._updates = 0
+
+    @property
+    def full(self):
+        return len(self.values) == self.size
+
+    def mean(self):
+        return self.total / self.size + self.offset if self.full else NAN
+
+    def std(self):
+        """Sample standard deviation (ddof=1), as pandas rolling().std()."""
+        if not self.full:
+            return NAN
+        var = (self.total_sq - self.total * self.total / self.size) / (self.size - 1)
+        return math.sqrt(max(var, 0.0))
+
+    def undo(self):
+        """Revert the most recent push."""
+        old, self.total, self.total_sq, self._updates = self._undo
+        self.values.pop()
+        if old is not None:
+            self.values.appendleft(old)
+        self._undo = None
+
+
+class IncrementalIndicators:
+    """
+    Streaming counterpart of calculate_indicators for one symbol.
+
+    Holds the rolling sums, EMA states and RSI gain/loss windows of an indicator
+    spec (DEFAULT_INDICATORS by default), so each new bar costs O(1) instead of
+    recomputing the whole history. The values match calculate_indicators(df, spec)
+    on the same bars to floating-point tolerance.
+
+    append() only records what replace_last() needs to revert it (the values
+    pushed out of each window and the scalar states), so revising a bar is O(1) too.
+
+    Usage:
+        state = IncrementalIndicators.from_frame(df, spec)   # replay stored history once
+        row = state.append({'Close': 612.0, 'Volume': 25_000_000})
+        row = state.replace_last({...})                      # revise a provisional bar
+    """
+
+    def __init__(self, spec=None):
+        self.spec = spec or DEFAULT_INDICATORS
+        self.columns = indicator_columns(self.spec)
+        self._offset = None
+        self._prev_close = None
+        self._ema_fast = self._ema_slow = self._signal = None
+        self.count = 0
+        self._previous = None
+        self.latest = {col: NAN for col in self.columns}
+
+    def _init_windows(self, first_close):
+        spec = self.spec
+        # 均線、布林通道與標準差共用收盤價視窗
+        close_windows = set(spec.get("sma", ()))
+        if "bbands" in spec:
+            close_windows.add(spec["bbands"][0])
+        if "std" in spec:
+            close_windows.add(spec["std"])
+        # 以第一根收盤價為基準平移，讓平方和不至於失去精度
+        self._offset = first_close
+        self._close = {w: _RollingWindow(w, first_close) for w in sorted(close_windows)}
+        self._volume = {w: _RollingWindow(w) for w in spec.get("vol_sma", ())}
+        rsi_period = spec.get("rsi", DEFAULT_INDICATORS["rsi"])
+        self._gain = _RollingWindow(rsi_period)
+        self._loss = _RollingWindow(rsi_period)
+        self._ema_fast = None
+        self._ema_slow = None
+        self._signal = None
+
+    @classmethod
+    def from_frame(cls, df, spec=None):
+        """
+        Build the state by replaying an existing bar history.
+        """
+        state = cls(spec)
+        closes = df['Close'].to_numpy(dtype=float)
+        volumes = df['Volume'].to_numpy(dtype=float)
+        for close, volume in zip(closes[:-1], volumes[:-1]):
+            state._advance(close, volume)
+        if len(closes):
+            # 最後一根用 append()，之後才能以 replace_last() 修正盤中暫時 K 棒
+            state.append({'Close': closes[-1], 'Volume': volumes[-1]})
+        return state
+
+    # append() 前需要保存的純量狀態 (視窗由 _RollingWindow.undo() 還原)
+    _SCALARS = ('_offset', '_prev_close', '_ema_fast', '_ema_slow', '_signal', 'count')
+
+    def _windows(self):
+        return [*self._close.values(), *self._volume.values(), self._gain, self._loss]
+
+    @staticmethod
+    def _ema(state, value, span):
+        if state is None:
+            return value
+        alpha = 2.0 / (span + 1.0)
+        return state + alpha * (value - state)
+
+    def _advance(self, close, volume):
+        if self._offset is None:
+            self._init_windows(close)
+        spec = self.spec
+
+        for win in self._close.values():
+            win.push(close)
+        for win in self._volume.values():
+            win.push(volume)
+
+        # RSI: 第一根沒有前一日收盤，漲跌幅視為 0
+        delta = 0.0 if self._prev_close is None else close - self._prev_close
+        self._gain.push(delta if delta > 0 else 0.0)
+        self._loss.push(-delta if delta < 0 else 0.0)
+        self._prev_close = close
+
+        fast, slow, signal = spec.get("macd", DEFAULT_INDICATORS["macd"])
+        self._ema_fast = self._ema(self._ema_fast, close, fast)
+        self._ema_slow = self._ema(self._ema_slow, close, slow)
+        macd = self._ema_fast - self._ema_slow
+        self._signal = self._ema(self._signal, macd, signal)
+        self.count += 1
+
+        row = self.latest
+        for window in spec.get("sma", ()):
+            row[f'SMA{window}'] = self._close[window].mean()
+
+        if "rsi" in spec:
+            avg_gain = self._gain.mean()
+            avg_loss = self._loss.mean()
+            if math.isnan(avg_gain) or math.isnan(avg_loss) or avg_loss == 0:
+                row['RSI'] = 50.0
+            else:
+                row['RSI'] = 100 - (100 / (1 + avg_gain / avg_loss))
+
+        if "macd" in spec:
+            macd_col, signal_col, hist_col = unit_columns("macd", spec["macd"])
+            row[macd_col] = macd
+            row[signal_col] = self._signal
+            row[hist_col] = macd - self._signal
+
+        if "bbands" in spec:
+            window, k = spec["bbands"]
+            middle_col, upper_col, lower_col = unit_columns("bbands", spec["bbands"])
+            middle = self._close[window].mean()
+            std = self._close[window].std()
+            row[middle_col] = middle
+            row[upper_col] = middle + k * std
+            row[lower_col] = middle - k * std
+
+        for window in spec.get("vol_sma", ()):
+            row[f'VOL_SMA{window}'] = self._volume[window].mean()
+
+        if "std" in spec:
+            row[unit_columns("std", spec["std"])[0]] = self._close[spec["std"]].std()
+        return dict(row)
+
+    def append(self, bar):
+        """
+        Add a new bar (a mapping with at least 'Close' and 'Volume') and
+        return the indicator values for it.
+        """
+        previous = {name: getattr(self, name) for name in self._SCALARS}
+        previous['latest'] = dict(self.latest)
+        row = self._advance(float(bar['Close']), float(bar['Volume']))
+        self._previous = previous
+        return row
+
+    def replace_last(self, bar):
+        """
+        Replace the most recent bar, e.g. when an intraday provisional bar is updated.
+        """
+        if self._previous is None:
+            raise ValueError("replace_last() needs a bar added with append()")
+        previous, self._previous = self._previous, None
+        if previous['_offset'] is not None:
+            # 第一根 K 棒的視窗會在 _advance 重新建立，不必還原
+            for win in self._windows():
+                win.undo()
+        self.__dict__.update(previous)
+        return self.append(bar)
+
+
+def append_bar(df, timestamp, bar, state):
+    """
+    Append one bar to an indicator frame using an IncrementalIndicators state,
+    replacing the last row when the timestamp is the same bar being revised.
+
+    A revision is written into `df` in place (O(1) per tick, so the caller must
+    own the frame); only a new bar copies the frame, once per bar.
+    """
+    timestamp = pd.Timestamp(timestamp)
+    if df.index.tz is not None and timestamp.tz is None:
+        timestamp = timestamp.tz_localize(df.index.tz)
+    revise = len(df) and df.index[-1] == timestamp
+    values = state.replace_last(bar) if revise else state.append(bar)
+    row = {col: bar.get(col, NAN) for col in df.columns if col not in state.columns}
+    row.update(values)
+    if revise:
+        columns = [col for col in df.columns if col in row]
+        df.iloc[-1, df.columns.get_indexer(columns)] = [row[col] for col in columns]
+        return df
+    return pd.concat([df, pd.DataFrame([row], index=[timestamp])[df.columns]])
@@ -0,0 +1,306 @@
+import os
+import json
+import time
+import argparse
+import threading
+from datetime import datetime, timedelta
+
+import pandas as pd
+import requests
+
+from utils import trading_calendar
+
+# 三大法人買賣超本地資料庫：每個交易日一個 Parquet 檔 (全市場)，manifest.json 記錄已處理的日期
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FLOW_DIR = os.path.join(BASE_DIR, "data", "institutional")
+MANIFEST_FILE = os.path.join(FLOW_DIR, "manifest.json")
+
+# 可用環境變數指向本地回放伺服器 (見 utils/replay.py)
+TWSE_BASE_URL = os.environ.get("TWSE_BASE_URL", "https://www.twse.com.tw")
+T86_PATH = "/rwd/zh/fund/T86"
+
+# 證交所憑證鏈在較嚴格的 OpenSSL 設定下 (如 Python 3.13 的 VERIFY_X509_STRICT) 可能驗證失敗：
+# TWSE_CA_BUNDLE 指定可信任的 CA 檔；TWSE_INSECURE_SSL=1 明確選擇不驗證憑證 (不建議)
+TWSE_CA_BUNDLE = os.environ.get("TWSE_CA_BUNDLE")
+TWSE_INSECURE_SSL = os.environ.get("TWSE_INSECURE_SSL") == "1"
+
+# 證交所對同一 IP 的請求頻率有限制，連續抓取時每次間隔秒數
+REQUEST_INTERVAL = 3.0
+
+# T86 欄位名稱 -> 內部欄位；依表頭名稱對應，表頭不符時退回已知欄位位置
+FLOW_FIELDS = {
+    "foreign": ("外陸資買賣超股數(不含外資自營商)", 4),
+    "trust": ("投信買賣超股數", 10),
+    "dealer": ("自營商買賣超股數(自行買賣)", 14),
+}
+FLOW_COLUMNS = ["stock_id", "foreign", "trust", "dealer"]
+
+# FinMind name 欄位 -> 內部欄位 (自營商只取自行買賣，與 T86 一致)
+FINMIND_NAMES = {
+    "Foreign_Investor": "foreign",
+    "Investment_Trust": "trust",
+    "Dealer_self": "dealer",
+}
+
+# 對外輸出沿用 get_institutional_data 的中文欄位 (單位：張)
+DISPLAY_COLUMNS = {"foreign": "外資買賣超", "trust": "投信買賣超", "dealer": "自營商買賣超"}
+
+_lock = threading.Lock()
+_frame_cache = {}
+# load_flows 最近一次的結果，依讀取的日期組合判斷是否仍有效
+_flows_memo = {}
+
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+}
+
+
+def _day_path(day):
+    return os.path.join(FLOW_DIR, f"T86_{day}.parquet")
+
+
+def load_manifest():
+    """
+    Processed trading days ({YYYYMMDD: {"status": "ok" | "closed", "rows": n}}).
+    """
+    if not os.path.exists(MANIFEST_FILE):
+        return {}
+    try:
+        with open(MANIFEST_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_manifest(manifest):
+    os.makedirs(FLOW_DIR, exist_ok=True)
+    tmp_file = MANIFEST_FILE + ".tmp"
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1, sort_keys=True)
+    os.replace(tmp_file, MANIFEST_FILE)
+
+
+def _to_number(value):
+    try:
+        return float(str(value).replace(",", "").strip() or 0)
+    except ValueError:
+        return 0.0
+
+
+def parse_t86(payload):
+    """
+    Turn a T86 JSON payload into a DataFrame (stock_id, foreign, trust, dealer) in lots (張).
+    Returns None when the payload holds no data (a non-trading day or a report not yet published).
+    """
+    if not payload or payload.get("stat") != "OK" or not payload.get("data"):
+        return None
+    fields = [name.strip() for name in payload.get("fields", [])]
+    positions = {}
+    for key, (name, fallback) in FLOW_FIELDS.items():
+        positions[key] = fields.index(name) if name in fields else fallback
+
+    rows = []
+    for row in payload["data"]:
+        record = {"stock_id": str(row[0]).strip()}
+        for key, pos in positions.items():
+            record[key] = _to_number(row[pos]) / 1000  # 股數轉張數
+        rows.append(record)
+    return pd.DataFrame(rows, columns=FLOW_COLUMNS)
+
+
+def _empty_flows():
+    index = pd.MultiIndex.from_arrays([[], []], names=["date", "stock_id"])
+    return pd.DataFrame(columns=FLOW_COLUMNS[1:], index=index, dtype=float)
+
+
+def reshape_institutional(df):
+    """
+    Pivot FinMind's long-format institutional rows (date, stock_id, buy, sell, name)
+    into the store layout: indexed by (date, stock_id), one net-flow column per
+    investor type (foreign, trust, dealer) in lots, missing types filled with 0.
+    """
+    if df is None or df.empty:
+        return _empty_flows()
+    long = pd.DataFrame({
+        "date": pd.to_datetime(df["date"]),
+        "stock_id": df["stock_id"].astype(str) if "stock_id" in df else "",
+        "name": df["name"].map(FINMIND_NAMES),
+        "net": (pd.to_numeric(df["buy"], errors="coerce").fillna(0)
+                - pd.to_numeric(df["sell"], errors="coerce").fillna(0)) / 1000,  # 股數轉張數
+    }).dropna(subset=["name"])
+    wide = long.pivot_table(index=["date", "stock_id"], columns="name", values="net", aggfunc="last")
+    wide = wide.reindex(columns=FLOW_COLUMNS[1:]).fillna(0.0)
+    wide.columns.name = None
+    return wide.sort_index()
+
+
+def to_display(flows, count=30):
+    """
+    One stock's flows (indexed by date) in the get_institutional_data layout,
+    keeping the last `count` trading days.
+    """
+    if flows is None or flows.empty:
+        return pd.DataFrame()
+    return flows.tail(count).rename(columns=DISPLAY_COLUMNS).rename_axis("日期").reset_index()
+
+
+def fetch_t86(day, base_url=None, session=None, record_dir=None):
+    """
+    Download the whole-market T86 report of one day (YYYYMMDD).
+    Returns the raw JSON payload; record_dir keeps a copy for the replay server.
+    """
+    base_url = (base_url or TWSE_BASE_URL).rstrip("/")
+    params = {"date": day, "selectType": "ALLBUT0999", "response": "json"}
+    http = session or requests
+    verify = False if TWSE_INSECURE_SSL else (TWSE_CA_BUNDLE or True)
+    try:
+        response = http.get(base_url + T86_PATH, params=params, headers=HEADERS, timeout=15, verify=verify)
+    except requests.exceptions.SSLError as e:
+        # 不自動退回不驗證的連線，由使用者決定要信任的 CA 或明確關閉驗證
+        print(f"TWSE certificate verification failed: {e}. "
+              "Set TWSE_CA_BUNDLE to a trusted CA bundle, or TWSE_INSECURE_SSL=1 to skip verification.")
+        raise
+    response.raise_for_status()
+    payload = response.json()
+    if record_dir:
+        os.makedirs(record_dir, exist_ok=True)
+        with open(os.path.join(record_dir, f"T86_{day}.json"), "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False)
+    return payload
+
+
+def ingest_day(day, base_url=None, session=None, record_dir=None, today=None):
+    """
+    Fetch one day's T86 table into the store. Returns "ok", "closed" or None (not available yet).
+    """
+    payload = fetch_t86(day, base_url=base_url, session=session, record_dir=record_dir)
+    df = parse_t86(payload)
+    today = (today or datetime.now()).strftime("%Y%m%d")
+
+    with _lock:
+        manifest = load_manifest()
+        if df is None:
+            # 當天報表要收盤後才公布，今天沒資料不代表休市
+            if day >= today:
+                return None
+            manifest[day] = {"status": "closed", "rows": 0}
+        else:
+            os.makedirs(FLOW_DIR, exist_ok=True)
+            tmp_path = _day_path(day) + ".tmp"
+            df.to_parquet(tmp_path, index=False)
+            os.replace(tmp_path, _day_path(day))
+            manifest[day] = {"status": "ok", "rows": int(len(df))}
+        _save_manifest(manifest)
+    return manifest[day]["status"]
+
+
+def missing_days(start, end, manifest=None):
+    """
+    Trading days in [start, end] that have not been ingested yet (newest first).
+    """
+    manifest = manifest if manifest is not None else load_manifest()
+    days = trading_calendar.trading_days(start, end)
+    return [d.strftime("%Y%m%d") for d in reversed(days) if d.strftime("%Y%m%d") not in manifest]
+
+
+def covers(days, end=None):
+    """
+    True if every trading day of the last `days` calendar days up to `end`
+    (the latest day whose report is out by default) has been processed.
+    """
+    end = pd.Timestamp(end or trading_calendar.flows_ready_day())
+    return not missing_days(end - timedelta(days=days), end)
+
+
+def backfill(days=60, end=None, max_requests=None, base_url=None, record_dir=None, interval=REQUEST_INTERVAL):
+    """
+    Ingest every missing trading day of the last `days` calendar days, newest first,
+    pausing between requests. Returns {YYYYMMDD: status}.
+    """
+    end = pd.Timestamp(end or trading_calendar.flows_ready_day()).normalize()
+    todo = missing_days(end - timedelta(days=days), end)
+    if max_requests is not None:
+        todo = todo[:max_requests]
+
+    results = {}
+    with requests.Session() as session:
+        for i, day in enumerate(todo):
+            if i and interval:
+                time.sleep(interval)
+            try:
+                results[day] = ingest_day(day, base_url=base_url, session=session,
+                                          record_dir=record_dir)
+            except Exception as e:
+                print(f"Error ingesting T86 for {day}: {e}")
+                results[day] = None
+    return results
+
+
+def load_flows(start=None, end=None):
+    """
+    Stored flows as one DataFrame indexed by (date, stock_id). The result is
+    memoized until the set of stored days in the range changes.
+    """
+    manifest = load_manifest()
+    days = sorted(day for day, entry in manifest.items() if entry.get("status") == "ok")
+    if start is not None:
+        days = [d for d in days if d >= pd.Timestamp(start).strftime("%Y%m%d")]
+    if end is not None:
+        days = [d for d in days if d <= pd.Timestamp(end).strftime("%Y%m%d")]
+    key = tuple(days)
+    with _lock:
+        if _flows_memo.get("key") == key:
+            return _flows_memo["flows"]
+
+    frames = []
+    for day in days:
+        # 各日檔案寫入後就不會再變動，讀過一次即保留在記憶體
+        if day not in _frame_cache:
+            try:
+                _frame_cache[day] = pd.read_parquet(_day_path(day))
+            except Exception as e:
+                print(f"Error reading T86 for {day}: {e}")
+                continue
+        frames.append(_frame_cache[day].assign(date=pd.Timestamp(day)))
+    if not frames:
+        return _empty_flows()
+    flows = pd.concat(frames, ignore_index=True).set_index(["date", "stock_id"]).sort_index()
+    if len(frames) == len(days):
+        with _lock:
+            _flows_memo.update(key=key, flows=flows)
+    return flows
+
+
+def get_stock_flows(stock_id, count=30):
+    """
+    The last `count` trading days of one stock from the local store,
+    in the get_institutional_data layout (日期、外資買賣超、投信買賣超、自營商買賣超).
+    """
+    clean_id = stock_id.split(".")[0]
+    flows = load_flows()
+    try:
+        stock = flows.xs(clean_id, level="stock_id")
+    except KeyError:
+        return pd.DataFrame()
+    return to_display(stock, count)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="TWSE T86 三大法人買賣超每日匯入")
+    sub = parser.add_subparsers(dest="command", required=True)
+    fill = sub.add_parser("backfill", help="補齊最近 N 天缺少的交易日")
+    fill.add_argument("--days", type=int, default=60)
+    fill.add_argument("--base-url", default=None, help="預設為 TWSE_BASE_URL")
+    fill.add_argument("--record", default=None, help="同時將原始 JSON 存到此目錄 (供回放伺服器使用)")
+    fill.add_argument("--interval", type=float, default=REQUEST_INTERVAL)
+    args = parser.parse_args(argv)
+
+    if args.command == "backfill":
+        results = backfill(days=args.days, base_url=args.base_url,
+                           record_dir=args.record, interval=args.interval)
+        for day, status in sorted(results.items()):
+            print(day, status or "unavailable")
+
+
+if __name__ == "__main__":
+    main()
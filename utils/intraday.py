@@ -0,0 +1,218 @@
+import os
+import json
+import time
+import argparse
+from datetime import datetime
+
+import pandas as pd
+
+from utils import trading_calendar
+from utils.incremental import IncrementalIndicators, append_bar
+from utils.scorer import calculate_health_score
+
+# 盤中即時模式：以 twstock.realtime 批次輪詢報價，更新當日的暫時 K 棒並增量計算指標與健康分
+# 測試時可設定 INTRADAY_REPLAY=<錄製檔> 改用回放報價，不受交易時段限制
+REPLAY_ENV = "INTRADAY_REPLAY"
+
+# 證交所即時報價 API 單次查詢的股票數上限
+BATCH_SIZE = 20
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_realtime(data):
+    """
+    Normalize one twstock.realtime result into {Open, High, Low, Close, Volume, time};
+    None when the quote has no usable price.
+    """
+    if not data or not data.get("success", True):
+        return None
+    rt = data.get("realtime", {})
+    close = _to_float(rt.get("latest_trade_price"))
+    if close is None:
+        # 尚未成交 (或揭示中) 時以最佳買賣價的中間價暫代
+        bid = _to_float((rt.get("best_bid_price") or [None])[0])
+        ask = _to_float((rt.get("best_ask_price") or [None])[0])
+        prices = [p for p in (bid, ask) if p]
+        close = sum(prices) / len(prices) if prices else None
+    if close is None:
+        return None
+    volume = _to_float(rt.get("accumulate_trade_volume")) or 0.0
+    return {
+        "Open": _to_float(rt.get("open")) or close,
+        "High": _to_float(rt.get("high")) or close,
+        "Low": _to_float(rt.get("low")) or close,
+        "Close": close,
+        "Volume": volume * 1000,  # 張轉股，與 yfinance 日 K 一致
+        "time": data.get("info", {}).get("time"),
+    }
+
+
+class TwstockQuoteFeed:
+    """
+    Polls twstock.realtime for many symbols, BATCH_SIZE codes per request.
+    """
+    replay = False
+
+    def __init__(self, batch_size=BATCH_SIZE):
+        self.batch_size = batch_size
+
+    def poll(self, symbols):
+        import twstock
+
+        quotes = {}
+        by_code = {sym.split(".")[0]: sym for sym in symbols}
+        codes = list(by_code)
+        for i in range(0, len(codes), self.batch_size):
+            batch = codes[i:i + self.batch_size]
+            try:
+                result = twstock.realtime.get(batch)
+            except Exception as e:
+                print(f"Error polling realtime quotes: {e}")
+                continue
+            if not result.get("success"):
+                print(f"Realtime quote request failed: {result.get('rtmessage')}")
+                continue
+            for code in batch:
+                quote = parse_realtime(result.get(code))
+                if quote is not None:
+                    quotes[by_code[code]] = quote
+        return quotes
+
+
+class RecordingQuoteFeed:
+    """
+    Wraps another feed and appends every poll result to a JSONL file for later replay.
+    """
+
+    def __init__(self, feed, path):
+        self.feed = feed
+        self.path = path
+        self.replay = feed.replay
+
+    def poll(self, symbols):
+        quotes = self.feed.poll(symbols)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"t": datetime.now().isoformat(timespec="seconds"), "quotes": quotes},
+                               ensure_ascii=False) + "\n")
+        return quotes
+
+
+class ReplayQuoteFeed:
+    """
+    Stand-in feed replaying recorded polls (one JSON object per line:
+    {"t": ..., "quotes": {symbol: quote}}). Each poll returns the next frame
+    and the last one repeats once the recording is exhausted.
+    """
+    replay = True
+
+    def __init__(self, path=None, frames=None):
+        if frames is None:
+            with open(path, "r", encoding="utf-8") as f:
+                frames = [json.loads(line) for line in f if line.strip()]
+        self.frames = frames
+        self.position = 0
+
+    def poll(self, symbols):
+        if not self.frames:
+            return {}
+        frame = self.frames[min(self.position, len(self.frames) - 1)]
+        self.position += 1
+        return {sym: quote for sym, quote in frame["quotes"].items() if sym in symbols}
+
+
+def default_feed():
+    path = os.environ.get(REPLAY_ENV)
+    return ReplayQuoteFeed(path) if path else TwstockQuoteFeed()
+
+
+class IntradaySession:
+    """
+    Provisional intraday state for a set of daily-bar frames. Each quote replaces
+    today's bar and updates indicators in O(1) through IncrementalIndicators.
+
+    The frames are copied once here, since append_bar revises today's bar in place.
+    """
+
+    def __init__(self, data_dict, spec=None):
+        self.spec = spec
+        # 快取裡的 DataFrame 可能與其他頁面共用，複製後才能原地覆寫當日 K 棒
+        self.frames = {sym: df.copy() for sym, df in data_dict.items() if df is not None and not df.empty}
+        self.states = {sym: IncrementalIndicators.from_frame(df, spec) for sym, df in self.frames.items()}
+        self.quotes = {}
+        self.updated = None
+
+    def _today(self, df, now):
+        day = trading_calendar.now_taipei(now).normalize()
+        if df.index.tz is None:
+            return day.tz_localize(None)
+        return day.tz_convert(df.index.tz)
+
+    def apply(self, quotes, now=None):
+        """
+        Fold a poll result into the provisional bars. Returns the symbols that changed.
+        """
+        changed = []
+        for sym, quote in quotes.items():
+            if sym not in self.frames:
+                continue
+            bar = {k: quote[k] for k in ("Open", "High", "Low", "Close", "Volume")}
+            df = self.frames[sym]
+            self.frames[sym] = append_bar(df, self._today(df, now), bar, self.states[sym])
+            self.quotes[sym] = quote
+            changed.append(sym)
+        if changed:
+            self.updated = trading_calendar.now_taipei(now)
+        return changed
+
+    def poll(self, feed, now=None):
+        return self.apply(feed.poll(list(self.frames)), now)
+
+    def rows(self):
+        """
+        One summary row per symbol with a live quote: price, change, volume, RSI and health.
+        """
+        rows = []
+        for sym, quote in self.quotes.items():
+            df = self.frames[sym]
+            last = df.iloc[-1]
+            prev_close = df['Close'].iloc[-2] if len(df) > 1 else last['Close']
+            score, rating, reasons = calculate_health_score(df, self.spec)
+            rows.append({
+                "代號": sym,
+                "成交價": last['Close'],
+                "漲跌%": round((last['Close'] / prev_close - 1) * 100, 2),
+                "成交量(張)": int(last['Volume'] / 1000),
+                "RSI": round(last['RSI'], 2),
+                "健康分": score,
+                "評級": rating,
+                "原因": ", ".join(reasons),
+                "報價時間": quote.get("time"),
+            })
+        return pd.DataFrame(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="錄製盤中即時報價供回放測試")
+    parser.add_argument("symbols", nargs="+")
+    parser.add_argument("--out", required=True)
+    parser.add_argument("--interval", type=float, default=5.0)
+    parser.add_argument("--count", type=int, default=60)
+    args = parser.parse_args(argv)
+
+    feed = RecordingQuoteFeed(TwstockQuoteFeed(), args.out)
+    for i in range(args.count):
+        quotes = feed.poll(args.symbols)
+        print(f"{datetime.now():%H:%M:%S} {len(quotes)} quotes")
+        if i < args.count - 1:
+            time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+
+# 均線交叉策略的預設參數網格
+DEFAULT_FAST_RANGE = tuple(range(3, 16))   # 快線：3 到 15 天
+DEFAULT_SLOW_RANGE = tuple(range(10, 31))  # 慢線：10 到 30 天
+
+# 每次送進 vectorbt 的參數組合上限，控制單一批次的記憶體用量
+GRID_CHUNK = 64
+
+
+@dataclass
+class WalkForwardResult:
+    """
+    Walk-forward optimization output.
+
+    windows: one row per (symbol, window) with the parameters chosen on the
+             training slice and their in-sample / out-of-sample total returns.
+    oos_returns / is_returns: mean total return of every (slow, fast) pair
+             across all test / train windows, shaped (len(slow_range), len(fast_range)).
+    """
+    fast_range: tuple
+    slow_range: tuple
+    windows: pd.DataFrame
+    oos_returns: np.ndarray
+    is_returns: np.ndarray
+    summary: dict = field(default_factory=dict)
+
+
+def walk_forward_windows(n_bars, train_bars, test_bars, step=None):
+    """
+    Rolling (train_start, train_end, test_end) bar offsets; each test slice
+    directly follows its training slice.
+    """
+    step = step or test_bars
+    windows = []
+    start = 0
+    while start + train_bars + test_bars <= n_bars:
+        windows.append((start, start + train_bars, start + train_bars + test_bars))
+        start += step
+    return windows
+
+
+def _moving_averages(close, windows):
+    csum = np.concatenate([[0.0], np.cumsum(close)])
+    mas = {}
+    for w in windows:
+        ma = np.full(len(close), np.nan)
+        if len(close) >= w:
+            ma[w - 1:] = (csum[w:] - csum[:-w]) / w
+        mas[w] = ma
+    return mas
+
+
+def _slice_returns(close, start, end, pairs, fees, slippage):
+    """
+    Total return of every (fast, slow) pair traded only within close[start:end].
+    Bars before `start` are used to warm up the moving averages.
+    """
+    import vectorbt as vbt
+
+    warmup = max(slow for _, slow in pairs)
+    seg_start = max(0, start - warmup)
+    segment = close[seg_start:end]
+    offset = start - seg_start
+    mas = _moving_averages(segment, {w for pair in pairs for w in pair})
+
+    returns = np.full(len(pairs), np.nan)
+    for i in range(0, len(pairs), GRID_CHUNK):
+        chunk = pairs[i:i + GRID_CHUNK]
+        fast = np.column_stack([mas[f] for f, _ in chunk])
+        slow = np.column_stack([mas[s] for _, s in chunk])
+        prev_fast = np.vstack([np.full((1, len(chunk)), np.nan), fast[:-1]])
+        prev_slow = np.vstack([np.full((1, len(chunk)), np.nan), slow[:-1]])
+
+        # 快線上穿慢線進場、下穿出場
+        entries = (fast > slow) & (prev_fast <= prev_slow)
+        exits = (fast < slow) & (prev_fast >= prev_slow)
+
+        price = pd.DataFrame(np.repeat(segment[offset:, None], len(chunk), axis=1))
+        pf = vbt.Portfolio.from_signals(
+            price, entries[offset:], exits[offset:],
+            fees=fees, slippage=slippage, freq='1D'
+        )
+        returns[i:i + len(chunk)] = np.asarray(pf.total_return())
+    return returns
+
+
+def _evaluate_window(task):
+    """
+    Worker: optimize on the training slice and score every pair on the test slice.
+    Runs in a separate process, so it only receives the bars it needs.
+    """
+    symbol, close, (train_start, train_end, test_end), dates, pairs, fees, slippage = task
+    train_returns = _slice_returns(close, train_start, train_end, pairs, fees, slippage)
+    test_returns = _slice_returns(close, train_end, test_end, pairs, fees, slippage)
+
+    best = int(np.nanargmax(train_returns)) if np.isfinite(train_returns).any() else 0
+    row = {
+        "symbol": symbol,
+        "train_start": dates[train_start],
+        "train_end": dates[train_end - 1],
+        "test_start": dates[train_end],
+        "test_end": dates[test_end - 1],
+        "best_fast": pairs[best][0],
+        "best_slow": pairs[best][1],
+        "train_return": train_returns[best],
+        "test_return": test_returns[best],
+    }
+    return row, train_returns, test_returns
+
+
+def run_walk_forward(closes, train_bars=120, test_bars=20, step=None,
+                     fast_range=DEFAULT_FAST_RANGE, slow_range=DEFAULT_SLOW_RANGE,
+                     fees=0.0004, slippage=0.0, max_workers=None):
+    """
+    Walk-forward optimization of the MA crossover strategy.
+
+    closes maps symbol -> close price Series. Every (symbol, window) pair is an
+    independent task spread over a process pool; set max_workers=1 to stay in-process.
+    """
+    fast_range = tuple(int(f) for f in fast_range)
+    slow_range = tuple(int(s) for s in slow_range)
+    # 快線必須短於慢線才有意義
+    pairs = [(f, s) for s in slow_range for f in fast_range if f < s]
+    if not pairs:
+        raise ValueError("參數網格中沒有快線 < 慢線的組合")
+
+    tasks = []
+    for symbol, close in closes.items():
+        values = close.to_numpy(dtype=float)
+        dates = [d.strftime("%Y-%m-%d") for d in close.index]
+        for window in walk_forward_windows(len(values), train_bars, test_bars, step):
+            # 只傳送這個視窗 (含均線暖身) 需要的 K 棒
+            cut = max(0, window[0] - max(slow_range))
+            shifted = tuple(i - cut for i in window)
+            tasks.append((symbol, values[cut:window[2]], shifted, dates[cut:window[2]], pairs, fees, slippage))
+    if not tasks:
+        raise ValueError("歷史資料長度不足以切出任何訓練/測試視窗")
+
+    max_workers = max_workers or min(len(tasks), os.cpu_count() or 1)
+    if max_workers > 1:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            outputs = list(pool.map(_evaluate_window, tasks, chunksize=max(1, len(tasks) // (max_workers * 4))))
+    else:
+        outputs = [_evaluate_window(task) for task in tasks]
+
+    rows = [row for row, _, _ in outputs]
+    train_matrix = np.vstack([train for _, train, _ in outputs])
+    test_matrix = np.vstack([test for _, _, test in outputs])
+
+    def to_grid(values):
+        grid = np.full((len(slow_range), len(fast_range)), np.nan)
+        for (f, s), value in zip(pairs, values):
+            grid[slow_range.index(s), fast_range.index(f)] = value
+        return grid
+
+    with np.errstate(invalid="ignore"):
+        is_mean = np.nanmean(train_matrix, axis=0)
+        oos_mean = np.nanmean(test_matrix, axis=0)
+
+    windows = pd.DataFrame(rows)
+    # 各檔股票把每段樣本外報酬串接起來的複利結果
+    compounded = windows.groupby("symbol")["test_return"].apply(lambda r: float(np.prod(1 + r.fillna(0)) - 1))
+    summary = {
+        "window_count": len(windows),
+        "mean_train_return": float(windows["train_return"].mean()),
+        "mean_test_return": float(windows["test_return"].mean()),
+        "compounded_test_return": compounded.to_dict(),
+    }
+    return WalkForwardResult(
+        fast_range=fast_range,
+        slow_range=slow_range,
+        windows=windows,
+        oos_returns=to_grid(oos_mean),
+        is_returns=to_grid(is_mean),
+        summary=summary,
+    )
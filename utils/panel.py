@@ -0,0 +1,129 @@
+from collections.abc import Mapping
+
+import numpy as np
+import pandas as pd
+
+from utils.technical import indicator_columns, stack_panel, panel_indicators
+
+# 精簡的多股票日 K 面板：全市場 × 長期間時，逐檔 DataFrame (float64、時區索引、股利/分割欄位、
+# 再加上 14 個指標欄位) 會佔用數 GB 記憶體。這裡改成：
+#   - 價量以右對齊的 (K 棒 x 股票) float32 陣列保存 (與 stack_panel 相同格式)，只留 OHLCV
+#   - 日期為共用的 int32 日序 (1970-01-01 起的天數)，日期不是共用日曆尾段的股票 (如停牌) 才另存
+#   - 指標在第一次讀取時才計算，結果同樣以 float32 保存
+PRICE_FIELDS = ['Open', 'High', 'Low', 'Close', 'Volume']
+DTYPE = np.float32
+
+
+def _day_numbers(index):
+    if index.tz is not None:
+        index = index.tz_localize(None)
+    return index.normalize().to_numpy().astype("datetime64[D]").astype(np.int32)
+
+
+class CompactPanel(Mapping):
+    """
+    Read-only {symbol: DataFrame} mapping over compact right-aligned arrays.
+
+    Frames are only built when a symbol is accessed; scanners can work on
+    the arrays directly through stack(). Meant for daily bars: intraday
+    timestamps are reduced to their date.
+    """
+
+    def __init__(self, symbols, lengths, prices, calendar, own_dates=None, tz=None, spec=None):
+        self.symbols = list(symbols)
+        self.lengths = np.asarray(lengths, dtype=np.int32)
+        self.calendar = calendar
+        self.tz = tz
+        self.spec = spec
+        self._column = {sym: j for j, sym in enumerate(self.symbols)}
+        self._arrays = dict(prices)
+        self._own_dates = own_dates or {}
+
+    @classmethod
+    def from_frames(cls, data_dict, spec=None):
+        """
+        Build a panel from per-symbol OHLCV frames; other columns (dividends,
+        splits, precomputed indicators) are dropped. Indicators follow `spec`
+        (technical.DEFAULT_INDICATORS by default).
+        """
+        symbols, lengths, panel = stack_panel(data_dict, fields=PRICE_FIELDS)
+        prices = {field: array.astype(DTYPE) for field, array in panel.items()}
+
+        days = {sym: _day_numbers(data_dict[sym].index) for sym in symbols}
+        calendar = np.unique(np.concatenate(list(days.values()))) if days else np.empty(0, dtype=np.int32)
+        calendar = calendar.astype(np.int32)
+        own_dates = {}
+        for sym, sym_days in days.items():
+            # 與共用日曆的尾段相同時不必另存日期
+            if len(sym_days) > len(calendar) or not np.array_equal(calendar[len(calendar) - len(sym_days):], sym_days):
+                own_dates[sym] = sym_days
+        tz = next((str(data_dict[sym].index.tz) for sym in symbols if data_dict[sym].index.tz is not None), None)
+        return cls(symbols, lengths, prices, calendar, own_dates, tz, spec)
+
+    def __getitem__(self, sym):
+        if sym not in self._column:
+            raise KeyError(sym)
+        return self.frame(sym)
+
+    def __iter__(self):
+        return iter(self.symbols)
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def __contains__(self, sym):
+        return sym in self._column
+
+    @property
+    def columns(self):
+        return PRICE_FIELDS + indicator_columns(self.spec)
+
+    def field(self, name):
+        """
+        The right-aligned (bar x symbol) array of a price field or indicator column.
+        Indicators are computed on first access (in float64, stored as float32).
+        """
+        if name not in self._arrays:
+            if name not in self.columns:
+                raise KeyError(name)
+            computed = panel_indicators(self._arrays['Close'].astype(float),
+                                        self._arrays['Volume'].astype(float), [name], self.spec)
+            for column, array in computed.items():
+                self._arrays.setdefault(column, array.astype(DTYPE))
+        return self._arrays[name]
+
+    def dates(self, sym):
+        n = int(self.lengths[self._column[sym]])
+        days = self._own_dates.get(sym, self.calendar[len(self.calendar) - n:])
+        index = pd.DatetimeIndex(days.astype("datetime64[D]").astype("datetime64[ns]"))
+        return index.tz_localize(self.tz) if self.tz else index
+
+    def frame(self, sym, columns=None):
+        """
+        One symbol's DataFrame with the requested columns (price fields plus every indicator by default).
+        """
+        j = self._column[sym]
+        n_bars = self._arrays['Close'].shape[0]
+        rows = slice(n_bars - int(self.lengths[j]), n_bars)
+        columns = columns or self.columns
+        return pd.DataFrame({col: self.field(col)[rows, j] for col in columns}, index=self.dates(sym))
+
+    def stack(self, fields, min_bars=0):
+        """
+        (symbols, lengths, {field: array}) like technical.stack_panel, restricted to
+        symbols with at least `min_bars` bars; arrays are returned in float64.
+        """
+        keep = np.flatnonzero(self.lengths >= min_bars)
+        symbols = [self.symbols[j] for j in keep]
+        lengths = self.lengths[keep]
+        if not len(keep):
+            return symbols, lengths, {field: np.empty((0, 0)) for field in fields}
+        n_bars = self._arrays['Close'].shape[0]
+        top = n_bars - int(lengths.max())
+        panel = {field: self.field(field)[top:, keep].astype(float) for field in fields}
+        return symbols, lengths, panel
+
+    @property
+    def nbytes(self):
+        own = sum(days.nbytes for days in self._own_dates.values())
+        return sum(a.nbytes for a in self._arrays.values()) + self.calendar.nbytes + self.lengths.nbytes + own
@@ -0,0 +1,356 @@
+import os
+import json
+import time
+import shutil
+import logging
+import argparse
+from contextlib import contextmanager
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from utils import trading_calendar
+from utils.timeframes import TIMEFRAMES, DEFAULT_TIMEFRAME
+from utils.technical import INDICATOR_COLUMNS, stack_panel, calculate_indicators_panel
+
+# 盤後預先運算：抓資料 → 指標 → 健康分 → 掃描 → 法人資料，結果寫成版本化的快照目錄
+#   python -m utils.pipeline run --universe all
+# 每個欄位是一個 (K 棒 x 股票) 的 .npy 陣列 (與 stack_panel 相同的右對齊格式)，App 以 mmap 直接讀取
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SNAPSHOT_DIR = os.path.join(BASE_DIR, "data", "snapshots")
+LATEST_FILE = os.path.join(SNAPSHOT_DIR, "LATEST")
+LOG_FILE = os.path.join(SNAPSHOT_DIR, "pipeline.log")
+WATCHLIST_FILE = os.path.join(BASE_DIR, "data", "stock_list.json")
+
+SNAPSHOT_FORMAT = 1
+KEEP_SNAPSHOTS = 3
+PRICE_FIELDS = ["Open", "High", "Low", "Close", "Volume"]
+HEALTH_FIELDS = ["health_score", "health_rules"]
+
+# 與 App 檢視日線時抓取的期間相同，快照才能直接取代現場抓取；掃描階段再從中切出與現場掃描相同的期間
+DEFAULT_PERIOD = TIMEFRAMES[DEFAULT_TIMEFRAME]["period"]
+SCAN_PERIOD = TIMEFRAMES[DEFAULT_TIMEFRAME]["scan_period"]
+
+logger = logging.getLogger("stockdashboard.pipeline")
+
+
+def _configure_logging():
+    if logger.handlers:
+        return
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    formatter = logging.Formatter("%(asctime)s %(levelname)s %(message)s")
+    for handler in (logging.StreamHandler(), logging.FileHandler(LOG_FILE, encoding="utf-8")):
+        handler.setFormatter(formatter)
+        logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+
+
+@contextmanager
+def _stage(name, timings):
+    start = time.perf_counter()
+    logger.info("stage %s started", name)
+    yield
+    timings[name] = round(time.perf_counter() - start, 3)
+    logger.info("stage %s finished in %.2fs", name, timings[name])
+
+
+def resolve_universe(name):
+    """
+    Symbols of a pipeline universe: a named universe from utils.universe,
+    "watchlist" (data/stock_list.json) or "core" (the curated scanner list).
+    """
+    if name == "watchlist":
+        with open(WATCHLIST_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    if name == "core":
+        from utils.fetcher import get_tw_stock_candidates
+        return get_tw_stock_candidates()
+
+    from utils import universe
+    stats = universe.load_stats()
+    if not universe.stats_fresh(stats):
+        stats, _ = universe.refresh_stats()
+    return universe.get_universe(name, stats)
+
+
+def refresh_calendar(period, today=None, interval=None):
+    """
+    Fetch the TWSE holiday schedule of every year that the period, or any period
+    the app loads (up to the monthly view's history), touches and the trading
+    calendar does not know yet. Returns {year: closed weekdays or None}.
+    """
+    from utils.store import period_start
+    from utils.institutional import REQUEST_INTERVAL
+
+    interval = REQUEST_INTERVAL if interval is None else interval
+    today = pd.Timestamp(today or datetime.now())
+    starts = [period_start(p, today) for p in [period] + [tf["period"] for tf in TIMEFRAMES.values()]]
+    first = min((start.year for start in starts if start is not None), default=today.year)
+    results = {}
+    for year in range(first, today.year + 1):
+        if year in trading_calendar.known_years():
+            continue
+        if results and interval:
+            time.sleep(interval)
+        try:
+            results[year] = trading_calendar.refresh(year)
+            logger.info("holiday schedule %d: %d closed weekdays", year, results[year])
+        except Exception as e:
+            results[year] = None
+            logger.warning("holiday schedule %d could not be fetched: %s", year, e)
+    return results
+
+
+def _write_array(folder, name, array):
+    np.save(os.path.join(folder, f"{name}.npy"), np.ascontiguousarray(array))
+
+
+def scan_snapshot_data(data_dict, period=SCAN_PERIOD):
+    """
+    The built-in scanner result for every symbol, on the same period the app's live scan fetches.
+    """
+    from utils.store import period_start, slice_period
+    from utils.scanner import scan_potential_stocks
+
+    start = period_start(period)
+    return scan_potential_stocks({sym: slice_period(df, start) for sym, df in data_dict.items()})
+
+
+def write_snapshot(data_dict, meta, scanner_df=None, health=None):
+    """
+    Write one snapshot directory and point LATEST at it once every file is in place.
+    Returns the version string.
+    """
+    version = datetime.now().strftime("%Y%m%d-%H%M%S")
+    folder = os.path.join(SNAPSHOT_DIR, version)
+    tmp_folder = folder + ".tmp"
+    os.makedirs(tmp_folder, exist_ok=True)
+
+    symbols, lengths, panel = stack_panel(data_dict, fields=PRICE_FIELDS + INDICATOR_COLUMNS)
+    n_bars = panel['Close'].shape[0]
+    dates = np.full((n_bars, len(symbols)), np.iinfo(np.int64).min, dtype=np.int64)
+    tz = None
+    for j, sym in enumerate(symbols):
+        index = data_dict[sym].index
+        tz = tz or (str(index.tz) if index.tz is not None else None)
+        # 統一存成 UTC 奈秒時間戳
+        utc = index.tz_convert("UTC").tz_localize(None) if index.tz is not None else index
+        dates[n_bars - lengths[j]:, j] = utc.asi8
+
+    for field, array in panel.items():
+        _write_array(tmp_folder, field, array)
+    _write_array(tmp_folder, "dates", dates)
+    if health is not None:
+        _write_array(tmp_folder, "health_score", health[0])
+        _write_array(tmp_folder, "health_rules", health[1].astype(np.int64))
+    if scanner_df is not None:
+        scanner_df.to_parquet(os.path.join(tmp_folder, "scanner.parquet"), index=False)
+
+    meta = {
+        **meta,
+        "format": SNAPSHOT_FORMAT,
+        "version": version,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "symbols": symbols,
+        "lengths": [int(n) for n in lengths],
+        "tz": tz,
+        "fields": PRICE_FIELDS + INDICATOR_COLUMNS,
+    }
+    with open(os.path.join(tmp_folder, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_folder, folder)
+
+    tmp_latest = LATEST_FILE + ".tmp"
+    with open(tmp_latest, "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(tmp_latest, LATEST_FILE)
+    _prune()
+    return version
+
+
+def _prune(keep=KEEP_SNAPSHOTS):
+    versions = sorted(v for v in os.listdir(SNAPSHOT_DIR)
+                      if os.path.isdir(os.path.join(SNAPSHOT_DIR, v)) and not v.endswith(".tmp"))
+    for version in versions[:-keep]:
+        shutil.rmtree(os.path.join(SNAPSHOT_DIR, version), ignore_errors=True)
+
+
+def latest_version():
+    if not os.path.exists(LATEST_FILE):
+        return None
+    with open(LATEST_FILE, "r", encoding="utf-8") as f:
+        version = f.read().strip()
+    return version if os.path.isdir(os.path.join(SNAPSHOT_DIR, version)) else None
+
+
+class Snapshot:
+    """
+    A pipeline snapshot opened with memory-mapped arrays; frames are only
+    materialized for the symbols that are asked for.
+    """
+
+    def __init__(self, version):
+        self.version = version
+        self.path = os.path.join(SNAPSHOT_DIR, version)
+        with open(os.path.join(self.path, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.symbols = self.meta["symbols"]
+        self._column = {sym: j for j, sym in enumerate(self.symbols)}
+        self._lengths = self.meta["lengths"]
+        self._arrays = {}
+        self._scanner = None
+
+    def _array(self, name):
+        if name not in self._arrays:
+            self._arrays[name] = np.load(os.path.join(self.path, f"{name}.npy"), mmap_mode="r")
+        return self._arrays[name]
+
+    @property
+    def created(self):
+        return pd.Timestamp(self.meta["created"])
+
+    def is_fresh(self, now=None):
+        # 在最近一次收盤定稿之後建立的快照才包含最新行情
+        return trading_calendar.now_taipei(self.created) >= trading_calendar.last_final_close(now)
+
+    def covers(self, symbols):
+        return all(sym in self._column for sym in symbols)
+
+    def _rows(self, sym):
+        j = self._column[sym]
+        n_bars = self._array("dates").shape[0]
+        return slice(n_bars - self._lengths[j], n_bars), j
+
+    def _index(self, sym):
+        rows, j = self._rows(sym)
+        index = pd.DatetimeIndex(np.asarray(self._array("dates")[rows, j]).view("datetime64[ns]"))
+        if self.meta.get("tz"):
+            index = index.tz_localize("UTC").tz_convert(self.meta["tz"])
+        return index
+
+    def frame(self, sym):
+        """
+        The processed DataFrame of one symbol (price columns plus indicators).
+        """
+        rows, j = self._rows(sym)
+        data = {field: np.asarray(self._array(field)[rows, j]) for field in self.meta["fields"]}
+        return pd.DataFrame(data, index=self._index(sym))
+
+    def data_dict(self, symbols=None):
+        return {sym: self.frame(sym) for sym in (symbols or self.symbols) if sym in self._column}
+
+    def health(self, sym):
+        """
+        The calculate_health_score_series frame of one symbol.
+        """
+        rows, j = self._rows(sym)
+        return pd.DataFrame({
+            "score": np.asarray(self._array("health_score")[rows, j]),
+            "rules": np.asarray(self._array("health_rules")[rows, j]),
+        }, index=self._index(sym))
+
+
+    def scanner(self, symbols=None):
+        """
+        The precomputed built-in scan (default indicator spec) limited to the given
+        symbols, or None if the snapshot has no scan result.
+        """
+        if self._scanner is None:
+            path = os.path.join(self.path, "scanner.parquet")
+            if not os.path.exists(path):
+                return None
+            self._scanner = pd.read_parquet(path)
+        df = self._scanner
+        if symbols is not None:
+            df = df[df["代碼"].isin(list(symbols))] if not df.empty else df
+        return df.reset_index(drop=True)
+
+
+def load_snapshot(version=None):
+    """
+    Open a snapshot (the latest by default), or None if there is none.
+    """
+    version = version or latest_version()
+    if not version:
+        return None
+    try:
+        return Snapshot(version)
+    except Exception as e:
+        print(f"Error opening snapshot {version}: {e}")
+        return None
+
+
+def run(universe_name="all", period=DEFAULT_PERIOD, flow_days=60):
+    """
+    Run every stage for one universe and write a snapshot. Returns the version.
+    """
+    from utils.fetcher import fetch_stocks_bulk
+    from utils.scorer import calculate_health_score_panel
+    from utils import institutional
+
+    _configure_logging()
+    timings = {}
+    started = time.perf_counter()
+    logger.info("pipeline run: universe=%s period=%s", universe_name, period)
+
+    with _stage("calendar", timings):
+        refresh_calendar(period)
+    with _stage("universe", timings):
+        symbols = resolve_universe(universe_name)
+        logger.info("%d symbols", len(symbols))
+    with _stage("fetch", timings):
+        raw, failed = fetch_stocks_bulk(symbols, period=period)
+        if failed:
+            logger.warning("%d symbols failed: %s", len(failed), ", ".join(sorted(failed)))
+    with _stage("indicators", timings):
+        processed = calculate_indicators_panel(raw)
+    with _stage("health", timings):
+        _, lengths, panel = stack_panel(processed, fields=['Close', 'Volume'] + INDICATOR_COLUMNS)
+        health = calculate_health_score_panel(panel, lengths)
+    with _stage("scanner", timings):
+        scanner_df = scan_snapshot_data(processed)
+        logger.info("%d scanner hits", len(scanner_df))
+    with _stage("institutional", timings):
+        try:
+            institutional.backfill(days=flow_days)
+        except Exception as e:
+            logger.error("institutional backfill failed: %s", e)
+    with _stage("snapshot", timings):
+        version = write_snapshot(processed, {
+            "universe": universe_name,
+            "period": period,
+            "failed": sorted(failed),
+            "timings": timings,
+        }, scanner_df=scanner_df, health=health)
+
+    logger.info("snapshot %s written in %.2fs (%s)", version, time.perf_counter() - started,
+                ", ".join(f"{k}={v}s" for k, v in timings.items()))
+    return version
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="盤後預先運算與快照")
+    sub = parser.add_subparsers(dest="command", required=True)
+    run_cmd = sub.add_parser("run", help="執行完整流程並寫出快照")
+    run_cmd.add_argument("--universe", default="all",
+                         help="liquid300 / tradable / all / core / watchlist")
+    run_cmd.add_argument("--period", default=DEFAULT_PERIOD)
+    run_cmd.add_argument("--flow-days", type=int, default=60)
+    sub.add_parser("info", help="顯示最新快照資訊")
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        print(run(args.universe, period=args.period, flow_days=args.flow_days))
+    elif args.command == "info":
+        snapshot = load_snapshot()
+        if snapshot is None:
+            print("no snapshot")
+        else:
+            meta = snapshot.meta
+            print(f"{meta['version']} universe={meta['universe']} symbols={len(meta['symbols'])} "
+                  f"fresh={snapshot.is_fresh()} timings={meta['timings']}")
+
+
+if __name__ == "__main__":
+    main()
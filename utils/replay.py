@@ -0,0 +1,75 @@
+import os
+import json
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+# 本地回放伺服器：把錄製下來的證交所 JSON 依原路徑提供，讓匯入流程可以離線驗證
+#   python -m utils.institutional backfill --days 10 --record fixtures/twse
+#   python -m utils.replay fixtures/twse --port 8086
+#   TWSE_BASE_URL=http://127.0.0.1:8086 python -m utils.institutional backfill --days 10
+
+# 查無資料時證交所的回應格式
+NO_DATA = {"stat": "很抱歉，沒有符合條件的資料!"}
+
+
+def _fixture_name(path, query):
+    """
+    Map a request to a recorded file, e.g. /rwd/zh/fund/T86?date=20260212 -> T86_20260212.json
+    """
+    report = path.rstrip("/").rsplit("/", 1)[-1]
+    date = query.get("date", [""])[0]
+    return f"{report}_{date}.json" if date else f"{report}.json"
+
+
+def make_handler(fixture_dir):
+    class ReplayHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            path = os.path.join(fixture_dir, _fixture_name(url.path, parse_qs(url.query)))
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    body = f.read()
+            else:
+                body = json.dumps(NO_DATA, ensure_ascii=False).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return ReplayHandler
+
+
+def start_server(fixture_dir, host="127.0.0.1", port=0):
+    """
+    Serve recorded fixtures in a background thread. Returns (server, base_url);
+    call server.shutdown() when done.
+    """
+    server = ThreadingHTTPServer((host, port), make_handler(fixture_dir))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="回放錄製的證交所 JSON")
+    parser.add_argument("fixture_dir")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8086)
+    args = parser.parse_args(argv)
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(args.fixture_dir))
+    print(f"Replaying {args.fixture_dir} on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,306 @@
+import os
+import re
+import json
+import operator
+from functools import lru_cache
+
+import numpy as np
+
+# 篩選規則語法 (不分大小寫的關鍵字)：
+#   SMA20/SMA60 within 5% AND Volume < 0.7*VOL_SMA20 AND NOT rank(STD20) > 0.3
+#
+#   比較      <  <=  >  >=  ==  !=
+#   邏輯      AND  OR  NOT  以及括號
+#   運算      +  -  *  /
+#   x within N%         abs(x - 1) < N/100   (適合比值，例如 SMA20/SMA60)
+#   x within N% of y    abs(x - y) / abs(y) < N/100
+#   函式      abs(x)、prev(x) / prev(x, n) 前 n 根 K 棒 (n 為非負整數)、min(x, y)、max(x, y)、
+#             rank(x) 目前值在自身歷史中的百分位 (0~1)
+#   欄位      calculate_indicators 產生的任何欄位，例如 Close、SMA20、BBM_20_2.0
+#   規則整體與 AND / OR / NOT 的運算元必須是條件，型別不符在解析時就回報 RuleSyntaxError
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCREENS_FILE = os.path.join(BASE_DIR, "data", "screens.json")
+
+_TOKEN_RE = re.compile(r"""
+    \s*(?:
+        (?P<number>\d+(?:\.\d+)?)
+      | (?P<name>[A-Za-z_][A-Za-z0-9_.]*)
+      | (?P<op><=|>=|==|!=|<|>|[-+*/(),%])
+    )""", re.VERBOSE)
+
+_KEYWORDS = {"AND", "OR", "NOT", "WITHIN", "OF"}
+
+_COMPARISONS = {
+    "<": operator.lt, "<=": operator.le, ">": operator.gt,
+    ">=": operator.ge, "==": operator.eq, "!=": operator.ne,
+}
+_ARITHMETIC = {"+": operator.add, "-": operator.sub, "*": operator.mul, "/": operator.truediv}
+
+
+class RuleSyntaxError(ValueError):
+    pass
+
+
+def _tokenize(text):
+    tokens = []
+    pos = 0
+    text = text.rstrip()
+    while pos < len(text):
+        match = _TOKEN_RE.match(text, pos)
+        if not match or match.end() == pos:
+            raise RuleSyntaxError(f"無法解析的字元: {text[pos:pos + 10]!r}")
+        pos = match.end()
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == "name" and value.upper() in _KEYWORDS:
+            tokens.append(("keyword", value.upper()))
+        else:
+            tokens.append((kind, value))
+    return tokens
+
+
+def _rank(x):
+    """
+    Percentile of each value within its own column's history (share of valid values below it).
+    """
+    out = np.full(x.shape, np.nan)
+    for j in range(x.shape[1]):
+        column = x[:, j]
+        valid = ~np.isnan(column)
+        if not valid.any():
+            continue
+        history = np.sort(column[valid])
+        out[valid, j] = np.searchsorted(history, column[valid], side="left") / len(history)
+    return out
+
+
+def _prev(x, n=1):
+    out = np.full(x.shape, np.nan)
+    if n < x.shape[0]:
+        out[n:] = x[:-n] if n > 0 else x
+    return out
+
+
+_FUNCTIONS = {
+    "abs": (np.abs, 1),
+    "rank": (_rank, 1),
+    "prev": (_prev, 2),
+    "min": (np.fmin, 2),
+    "max": (np.fmax, 2),
+}
+
+# 運算元型別：條件 (布林陣列) 或數值；AND / OR / NOT 只接受條件，比較、運算與函式只接受數值
+BOOL = "條件"
+NUMBER = "數值"
+
+
+class _Parser:
+    """
+    Recursive-descent parser turning rule tokens into a tree of closures over a
+    dict of (bar x symbol) arrays. Every parse step returns (node, type) so
+    operands are type-checked while parsing instead of failing on evaluation.
+    """
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+        self.columns = set()
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def take(self, kind=None, value=None):
+        token = self.peek()
+        if token[0] is None or (kind and token[0] != kind) or (value and token[1] != value):
+            expected = value or kind or "更多內容"
+            raise RuleSyntaxError(f"預期 {expected}，但遇到 {token[1] or '結尾'}")
+        self.pos += 1
+        return token
+
+    @staticmethod
+    def expect(typed, expected, where):
+        node, kind = typed
+        if kind != expected:
+            raise RuleSyntaxError(f"{where} 需要{expected}，但遇到{kind}")
+        return node
+
+    def parse(self):
+        node = self.expect(self.parse_or(), BOOL, "規則")
+        if self.peek()[0] is not None:
+            raise RuleSyntaxError(f"多餘的內容: {self.peek()[1]}")
+        return node
+
+    def parse_or(self):
+        typed = self.parse_and()
+        while self.peek() == ("keyword", "OR"):
+            self.take()
+            left = self.expect(typed, BOOL, "OR")
+            right = self.expect(self.parse_and(), BOOL, "OR")
+            typed = (lambda env, l=left, r=right: l(env) | r(env)), BOOL
+        return typed
+
+    def parse_and(self):
+        typed = self.parse_not()
+        while self.peek() == ("keyword", "AND"):
+            self.take()
+            left = self.expect(typed, BOOL, "AND")
+            right = self.expect(self.parse_not(), BOOL, "AND")
+            typed = (lambda env, l=left, r=right: l(env) & r(env)), BOOL
+        return typed
+
+    def parse_not(self):
+        if self.peek() == ("keyword", "NOT"):
+            self.take()
+            inner = self.expect(self.parse_not(), BOOL, "NOT")
+            return (lambda env: ~inner(env)), BOOL
+        return self.parse_comparison()
+
+    def parse_comparison(self):
+        typed = self.parse_sum()
+        kind, value = self.peek()
+        if kind == "op" and value in _COMPARISONS:
+            self.take()
+            left = self.expect(typed, NUMBER, value)
+            right = self.expect(self.parse_sum(), NUMBER, value)
+            compare = _COMPARISONS[value]
+            return (lambda env: compare(left(env), right(env))), BOOL
+        if (kind, value) == ("keyword", "WITHIN"):
+            self.take()
+            left = self.expect(typed, NUMBER, "within")
+            tolerance = float(self.take("number")[1]) / 100
+            self.take("op", "%")
+            if self.peek() == ("keyword", "OF"):
+                self.take()
+                base = self.expect(self.parse_sum(), NUMBER, "within ... of")
+                return (lambda env: np.abs(left(env) - base(env)) / np.abs(base(env)) < tolerance), BOOL
+            return (lambda env: np.abs(left(env) - 1) < tolerance), BOOL
+        return typed
+
+    def parse_sum(self):
+        typed = self.parse_term()
+        while self.peek()[0] == "op" and self.peek()[1] in "+-":
+            symbol = self.take()[1]
+            func = _ARITHMETIC[symbol]
+            left = self.expect(typed, NUMBER, symbol)
+            right = self.expect(self.parse_term(), NUMBER, symbol)
+            typed = (lambda env, l=left, r=right, f=func: f(l(env), r(env))), NUMBER
+        return typed
+
+    def parse_term(self):
+        typed = self.parse_unary()
+        while self.peek()[0] == "op" and self.peek()[1] in "*/":
+            symbol = self.take()[1]
+            func = _ARITHMETIC[symbol]
+            left = self.expect(typed, NUMBER, symbol)
+            right = self.expect(self.parse_unary(), NUMBER, symbol)
+            typed = (lambda env, l=left, r=right, f=func: f(l(env), r(env))), NUMBER
+        return typed
+
+    def parse_unary(self):
+        if self.peek() == ("op", "-"):
+            self.take()
+            inner = self.expect(self.parse_unary(), NUMBER, "-")
+            return (lambda env: -inner(env)), NUMBER
+        return self.parse_atom()
+
+    def parse_atom(self):
+        kind, value = self.take()
+        if kind == "number":
+            number = float(value)
+            if self.peek() == ("op", "%"):
+                self.take()
+                number /= 100
+            return (lambda env: number), NUMBER
+        if kind == "op" and value == "(":
+            typed = self.parse_or()
+            self.take("op", ")")
+            return typed
+        if kind == "name":
+            if self.peek() == ("op", "("):
+                return self.parse_call(value)
+            self.columns.add(value)
+            return (lambda env: env[value]), NUMBER
+        raise RuleSyntaxError(f"非預期的符號: {value}")
+
+    def parse_call(self, name):
+        if name.lower() not in _FUNCTIONS:
+            raise RuleSyntaxError(f"未知的函式: {name}")
+        func, max_args = _FUNCTIONS[name.lower()]
+        self.take("op", "(")
+        args = [self.expect(self.parse_sum(), NUMBER, f"{name}()")]
+        if func is _prev:
+            # prev 的 K 棒數必須是非負整數常數
+            n = 1
+            if self.peek() == ("op", ","):
+                self.take()
+                kind, value = self.peek()
+                if kind != "number" or "." in value:
+                    raise RuleSyntaxError(f"{name}() 的 K 棒數必須是非負整數，但遇到 {value or '結尾'}")
+                self.take()
+                n = int(value)
+            self.take("op", ")")
+            x = args[0]
+            return (lambda env: _prev(x(env), n)), NUMBER
+        while self.peek() == ("op", ","):
+            self.take()
+            args.append(self.expect(self.parse_sum(), NUMBER, f"{name}()"))
+        self.take("op", ")")
+        if len(args) > max_args or (func in (np.fmin, np.fmax) and len(args) != 2):
+            raise RuleSyntaxError(f"{name}() 參數數量錯誤")
+        return (lambda env: func(*[arg(env) for arg in args])), NUMBER
+
+
+class CompiledRule:
+    """
+    A parsed screening rule. Call it with a dict of (bar x symbol) arrays to get
+    a boolean array of the same shape.
+    """
+
+    def __init__(self, text, func, columns):
+        self.text = text
+        self.columns = frozenset(columns)
+        self._func = func
+
+    def __call__(self, panel):
+        missing = self.columns - set(panel)
+        if missing:
+            raise RuleSyntaxError(f"找不到欄位: {', '.join(sorted(missing))}")
+        with np.errstate(divide="ignore", invalid="ignore"):
+            result = self._func(panel)
+        shape = next(iter(panel.values())).shape
+        return np.broadcast_to(np.asarray(result, dtype=bool), shape)
+
+
+@lru_cache(maxsize=256)
+def compile_rule(text):
+    """
+    Parse a rule once; the compiled rule is cached by its text.
+    """
+    if not text or not text.strip():
+        raise RuleSyntaxError("規則不可為空白")
+    parser = _Parser(_tokenize(text))
+    func = parser.parse()
+    return CompiledRule(text, func, parser.columns)
+
+
+def load_screens():
+    """
+    Saved screens ({name: rule text}).
+    """
+    if not os.path.exists(SCREENS_FILE):
+        return {}
+    try:
+        with open(SCREENS_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_screen(name, text):
+    compile_rule(text)  # 確認語法正確才存檔
+    screens = load_screens()
+    screens[name] = text
+    os.makedirs(os.path.dirname(SCREENS_FILE), exist_ok=True)
+    with open(SCREENS_FILE, "w", encoding="utf-8") as f:
+        json.dump(screens, f, ensure_ascii=False, indent=1)
@@ -1,50 +1,125 @@
+import numpy as np
 import pandas as pd
 
-def scan_potential_stocks(data_dict):
+from utils.rules import RuleSyntaxError, compile_rule
+from utils.technical import stack_panel, min_bars, sma_columns, vol_sma_columns, std_column
+
+def scan_fields(spec=None):
+    """
+    Fields the built-in conditions read: volume, the month and quarter moving
+    averages, the long average volume and the standard deviation
+    (Volume, SMA20, SMA60, VOL_SMA20, STD20 with the default spec).
+    """
+    _, _, sma_month, sma_quarter = sma_columns(spec)
+    return ('Volume', sma_month, sma_quarter, vol_sma_columns(spec)[1], std_column(spec))
+
+# 內建條件的規則寫法 (語法見 utils/rules.py)
+DEFAULT_SCREEN = "SMA20/SMA60 within 5% OR Volume < 0.7*VOL_SMA20 OR rank(STD20) < 0.3"
+
+def scan_potential_stocks(data_dict, spec=None):
     """
     Scan for potential stocks based on squeeze and dry-up logic.
+    `spec` is the indicator spec the data was computed with (a CompactPanel's own spec by default).
+    """
+    if hasattr(data_dict, "stack"):
+        spec = spec or data_dict.spec
+        # 精簡面板 (CompactPanel)直接取陣列，只計算掃描用到的指標
+        symbols, lengths, panel = data_dict.stack(scan_fields(spec), min_bars=min_bars(spec))
+        if not symbols:
+            return pd.DataFrame()
+        return scan_panel(symbols, panel, spec=spec)
+
+    eligible = {
+        symbol: df for symbol, df in data_dict.items()
+        if df is not None and not df.empty and len(df) >= min_bars(spec)
+    }
+    if not eligible:
+        return pd.DataFrame()
+
+    symbols, lengths, panel = stack_panel(eligible, fields=scan_fields(spec))
+    return scan_panel(symbols, panel, spec=spec)
+
+def scan_with_rule(data_dict, rule_text, spec=None):
+    """
+    Scan with a screening rule instead of the built-in conditions.
+    The result has the same columns as scan_potential_stocks.
+    """
+    rule = compile_rule(rule_text)
+    if hasattr(data_dict, "stack"):
+        spec = spec or data_dict.spec
+        missing = rule.columns - set(data_dict.columns)
+        if missing:
+            raise RuleSyntaxError(f"找不到欄位: {', '.join(sorted(missing))}")
+        symbols, lengths, panel = data_dict.stack(sorted(set(scan_fields(spec)) | rule.columns), min_bars=min_bars(spec))
+        if not symbols:
+            return pd.DataFrame()
+        return scan_panel(symbols, panel, mask=rule(panel)[-1], spec=spec)
+
+    eligible = {
+        symbol: df for symbol, df in data_dict.items()
+        if df is not None and not df.empty and len(df) >= min_bars(spec)
+    }
+    if not eligible:
+        return pd.DataFrame()
+
+    available = set.intersection(*(set(df.columns) for df in eligible.values()))
+    missing = rule.columns - available
+    if missing:
+        raise RuleSyntaxError(f"找不到欄位: {', '.join(sorted(missing))}")
+
+    fields = sorted(set(scan_fields(spec)) | rule.columns)
+    symbols, lengths, panel = stack_panel(eligible, fields=fields)
+    return scan_panel(symbols, panel, mask=rule(panel)[-1], spec=spec)
+
+def scan_panel(symbols, panel, mask=None, spec=None):
     """
-    results = []
-    
-    for symbol, df in data_dict.items():
-        if df is None or df.empty or len(df) < 60:
-            continue
-            
-        last_row = df.iloc[-1]
-        
+    Evaluate the scanner conditions for the whole universe at once.
+
+    panel maps each field in scan_fields(spec) to a right-aligned (bar x symbol) array
+    (see technical.stack_panel); the last row is every symbol's latest bar and the
+    standard-deviation array doubles as the volatility history matrix. An optional
+    boolean mask (e.g. from a compiled rule) selects the symbols to report instead
+    of the built-in conditions.
+    """
+    symbols = np.asarray(symbols, dtype=object)
+    volume_col, ma20_col, ma60_col, vol_sma20_col, std_col = scan_fields(spec)
+    volume = panel[volume_col][-1]
+    ma20 = panel[ma20_col][-1]
+    ma60 = panel[ma60_col][-1]
+    vol_sma20 = panel[vol_sma20_col][-1]
+    std20_history = panel[std_col]
+    std20_current = std20_history[-1]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
         # 1. 均線糾結 (Squeeze)
-        ma20 = last_row['SMA20']
-        ma60 = last_row['SMA60']
-        squeeze_val = abs(ma20 - ma60) / ma60
+        squeeze_val = np.abs(ma20 - ma60) / ma60
         is_squeeze = squeeze_val < 0.05
-        
+
         # 2. 量能急凍 (Dry-up)
-        # Assuming we calculated VOL_SMA20 in technical.py
-        is_dry_up = last_row['Volume'] < 0.7 * last_row['VOL_SMA20']
-        
+        is_dry_up = volume < 0.7 * vol_sma20
+
         # 3. 低波動 (Low Volatility)
-        # STD20 compared to historical range
-        std20_current = last_row['STD20']
-        std20_history = df['STD20'].dropna()
-        if len(std20_history) > 0:
-            std20_rank = (std20_history < std20_current).mean()
-            is_low_vol = std20_rank < 0.3 # Lower 30% percentile
-        else:
-            is_low_vol = False
-            
-        if is_squeeze or is_dry_up or is_low_vol:
-            conditions = []
-            if is_squeeze: conditions.append("均線糾結")
-            if is_dry_up: conditions.append("量能急凍")
-            if is_low_vol: conditions.append("波動率低")
-            
-            results.append({
-                "代碼": symbol,
-                "均線糾結%": round(squeeze_val * 100, 2),
-                "量能比": round(last_row['Volume'] / last_row['VOL_SMA20'], 2) if last_row['VOL_SMA20'] > 0 else 0,
-                "符合條件": ", ".join(conditions),
-                "原始波動度": round(std20_current, 2),
-                "波動百分位": round(std20_rank * 100, 2) if is_low_vol else 0
-            })
-            
-    return pd.DataFrame(results)
+        # STD20 在自身歷史中的百分位 (NaN 不列入計算)
+        history_count = np.sum(~np.isnan(std20_history), axis=0)
+        below_count = np.sum(std20_history < std20_current, axis=0)
+        std20_rank = below_count / history_count
+        is_low_vol = (history_count > 0) & (std20_rank < 0.3) # Lower 30% percentile
+
+        volume_ratio = np.where(vol_sma20 > 0, volume / vol_sma20, 0.0)
+
+    hit = is_squeeze | is_dry_up | is_low_vol if mask is None else np.asarray(mask, dtype=bool)
+    if not hit.any():
+        return pd.DataFrame()
+
+    labels = np.array(["均線糾結", "量能急凍", "波動率低"])
+    flags = np.stack([is_squeeze, is_dry_up, is_low_vol], axis=1)[hit]
+    conditions = [", ".join(labels[row]) for row in flags]
+
+    return pd.DataFrame({
+        "代碼": symbols[hit],
+        "均線糾結%": np.round(squeeze_val[hit] * 100, 2),
+        "量能比": np.round(volume_ratio[hit], 2),
+        "符合條件": conditions,
+        "原始波動度": np.round(std20_current[hit], 2),
+        "波動百分位": np.where(is_low_vol[hit], np.round(std20_rank[hit] * 100, 2), 0.0)
+    })
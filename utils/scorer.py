@@ -1,65 +1,145 @@
+import numpy as np
 import pandas as pd
 
-def calculate_health_score(df):
-    """
-    Calculate health score for a stock based on processed dataframe.
-    Returns (score, rating, reason_list)
-    """
-    if df is None or df.empty or len(df) < 60:
-        return 0.0, "數據不足", []
+from utils.technical import min_bars, sma_columns, vol_sma_columns, macd_columns, bbands_columns
 
-    last_row = df.iloc[-1]
-    prev_row = df.iloc[-2]
-    
-    score = 0.0
-    reasons = []
-    
+# 評分規則 (說明, 分數)，順序即為位元遮罩的 bit 位置
+HEALTH_RULES = [
     # 趨勢與策略面 (40%) - 融入主人「右側交易」邏輯
-    if last_row['Close'] > last_row['SMA20']:
-        score += 1.0
-        reasons.append("收盤在月線上 (+1)")
-    if last_row['Close'] > last_row['SMA60']:
-        score += 1.0
-        reasons.append("收盤在季線上 (+1)")
-    
+    ("收盤在月線上 (+1)", 1.0),
+    ("收盤在季線上 (+1)", 1.0),
     # 右側交易強度確認 (MA5 > MA10 且 Price > MA10)
-    if last_row['SMA5'] > last_row['SMA10'] and last_row['Close'] > last_row['SMA10']:
-        score += 2.0
-        reasons.append("右側交易訊號：5MA 站上 10MA 且股價站穩 (+2)")
-    elif last_row['Close'] > last_row['SMA10']:
-        score += 1.0
-        reasons.append("股價站上 10MA (+1)")
-        
+    ("右側交易訊號：5MA 站上 10MA 且股價站穩 (+2)", 2.0),
+    ("股價站上 10MA (+1)", 1.0),
     # 動能面 (30%)
-    if last_row['RSI'] > 50:
-        score += 1.5
-        reasons.append("RSI > 50 (+1.5)")
-    if last_row['Volume'] > last_row['VOL_SMA5']:
-        score += 1.5
-        reasons.append("量增 (+1.5)")
-        
+    ("RSI > 50 (+1.5)", 1.5),
+    ("量增 (+1.5)", 1.5),
     # 型態面 (30%)
-    # Using MACDh_12_26_9 for histogram
-    if last_row['MACDh_12_26_9'] > 0:
-        score += 1.5
-        reasons.append("MACD紅柱 (+1.5)")
-    if last_row['Close'] > last_row['BBM_20_2.0']:
-        score += 1.5
-        reasons.append("站上布林中軌 (+1.5)")
-        
+    ("MACD紅柱 (+1.5)", 1.5),
+    ("站上布林中軌 (+1.5)", 1.5),
     # 扣分項
-    daily_return = (last_row['Close'] - prev_row['Close']) / prev_row['Close']
-    if last_row['Close'] < last_row['SMA20'] and daily_return < -0.03:
-        score -= 2.0
-        reasons.append("破月線且重挫 (-2)")
-        
+    ("破月線且重挫 (-2)", -2.0),
+]
+
+RULE_POINTS = np.array([points for _, points in HEALTH_RULES])
+RULE_BITS = 1 << np.arange(len(HEALTH_RULES))
+
+def score_columns(spec=None):
+    """
+    Indicator columns the rules read, in _rule_flags order: four moving averages,
+    RSI, the short average volume, the MACD histogram and the Bollinger middle band.
+    """
+    return [*sma_columns(spec), 'RSI', vol_sma_columns(spec)[0], macd_columns(spec)[2], bbands_columns(spec)[0]]
+
+def _rule_flags(close, prev_close, sma5, sma10, sma20, sma60, rsi, volume, vol_sma5, macdh, bbm):
+    """
+    Evaluate every health rule element-wise on arrays of any shape.
+    Returns a boolean array with one extra trailing axis (one entry per rule).
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        daily_return = (close - prev_close) / prev_close
+    right_side = (sma5 > sma10) & (close > sma10)
+    flags = [
+        close > sma20,
+        close > sma60,
+        right_side,
+        ~right_side & (close > sma10),
+        rsi > 50,
+        volume > vol_sma5,
+        # Using MACDh_12_26_9 for histogram
+        macdh > 0,
+        close > bbm,
+        (close < sma20) & (daily_return < -0.03),
+    ]
+    return np.stack(flags, axis=-1)
+
+def _flags_from(get, close, prev_close, spec=None):
+    # 均線、均量、MACD 柱狀體與布林中軌的欄位名稱都依指標參數決定
+    sma_short, sma_mid, sma_month, sma_quarter, rsi, vol_sma, macdh, bbm = score_columns(spec)
+    return _rule_flags(
+        close, prev_close, get(sma_short), get(sma_mid), get(sma_month), get(sma_quarter),
+        get(rsi), get('Volume'), get(vol_sma), get(macdh), get(bbm)
+    )
+
+def _frame_flags(df, spec=None):
+    close = df['Close'].to_numpy(dtype=float)
+    prev_close = df['Close'].shift(1).to_numpy(dtype=float)
+    return _flags_from(lambda col: df[col].to_numpy(dtype=float), close, prev_close, spec)
+
+def _score_flags(flags):
     # Final clamping
-    score = max(0.0, min(10.0, score))
-    
+    score = np.clip(flags @ RULE_POINTS, 0.0, 10.0)
+    mask = flags @ RULE_BITS
+    return score, mask
+
+def get_rating(score):
     rating = "中立"
     if score >= 7:
         rating = "健康"
     elif score <= 4:
         rating = "危險"
-        
-    return score, rating, reasons
+    return rating
+
+def describe_rules(mask):
+    """
+    Turn a rule bitmask back into the list of reasons.
+    """
+    return [label for (label, _), bit in zip(HEALTH_RULES, RULE_BITS) if int(mask) & int(bit)]
+
+def calculate_health_score(df, spec=None):
+    """
+    Calculate health score for a stock based on processed dataframe.
+    `spec` is the indicator spec df was computed with (technical.DEFAULT_INDICATORS by default).
+    Returns (score, rating, reason_list)
+    """
+    if df is None or df.empty or len(df) < min_bars(spec):
+        return 0.0, "數據不足", []
+
+    flags = _frame_flags(df.iloc[-2:], spec)[-1]
+    score, mask = _score_flags(flags)
+    score = float(score)
+    return score, get_rating(score), describe_rules(mask)
+
+def calculate_health_score_series(df, spec=None):
+    """
+    Score every bar of a processed dataframe in one vectorized pass.
+
+    Returns a DataFrame indexed like df with:
+        score: the health score calculate_health_score would give on df up to that bar
+               (NaN while fewer than min_bars(spec) bars are available)
+        rules: bitmask of the HEALTH_RULES that fired (see describe_rules)
+    """
+    if df is None or df.empty:
+        return pd.DataFrame(columns=['score', 'rules'])
+
+    score, mask = _score_flags(_frame_flags(df, spec))
+    enough = np.arange(len(df)) >= min_bars(spec) - 1
+    return pd.DataFrame({
+        'score': np.where(enough, score, np.nan),
+        'rules': np.where(enough, mask, 0).astype(np.int64)
+    }, index=df.index)
+
+def summarize_health_series(series):
+    """
+    (score, rating, reason_list) of the latest bar of a calculate_health_score_series
+    result, i.e. the same tuple calculate_health_score returns.
+    """
+    if series is None or series.empty or np.isnan(series['score'].iloc[-1]):
+        return 0.0, "數據不足", []
+    score = float(series['score'].iloc[-1])
+    return score, get_rating(score), describe_rules(series['rules'].iloc[-1])
+
+def calculate_health_score_panel(panel, lengths, spec=None):
+    """
+    Score every bar of every symbol on right-aligned (bar x symbol) arrays
+    (see technical.stack_panel). Returns (score, rules) arrays of the same shape;
+    scores are NaN until a symbol has min_bars(spec) bars.
+    """
+    close = panel['Close']
+    prev_close = np.vstack([np.full((1, close.shape[1]), np.nan), close[:-1]])
+    flags = _flags_from(panel.__getitem__, close, prev_close, spec)
+    score, mask = _score_flags(flags)
+    # 每檔股票自身的第幾根 K 棒
+    position = np.arange(close.shape[0])[:, None] - (close.shape[0] - np.asarray(lengths))[None, :]
+    enough = position >= min_bars(spec) - 1
+    return np.where(enough, score, np.nan), np.where(enough, mask, 0)
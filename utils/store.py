@@ -0,0 +1,248 @@
+import os
+import json
+import hashlib
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+# 本地 K 線資料庫：每檔股票一個 Parquet 檔，另以 manifest.json 記錄涵蓋範圍
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STORE_DIR = os.path.join(BASE_DIR, "data", "bars")
+MANIFEST_FILE = os.path.join(STORE_DIR, "manifest.json")
+
+# yfinance period 字串對應的日曆天數
+PERIOD_DAYS = {
+    "1d": 1, "5d": 5, "1mo": 31, "3mo": 92, "6mo": 183,
+    "1y": 366, "2y": 731, "5y": 1827, "10y": 3653,
+}
+
+# period="max" 的涵蓋起點
+FULL_HISTORY = "1900-01-01"
+
+_lock = threading.Lock()
+
+# batch() 期間的 manifest：逐檔更新只改記憶體，結束時才寫檔一次
+_pending = None
+
+
+def period_start(period, today=None):
+    """
+    Translate a yfinance period string into the first calendar date it covers.
+    Returns None for "max" (i.e. the full history).
+    """
+    if period == "max":
+        return None
+    if period == "ytd":
+        today = pd.Timestamp(today or datetime.now()).normalize()
+        return today.replace(month=1, day=1)
+    if period not in PERIOD_DAYS:
+        raise ValueError(f"Unsupported period: {period}")
+    today = pd.Timestamp(today or datetime.now()).normalize()
+    return today - pd.Timedelta(days=PERIOD_DAYS[period])
+
+
+def _bar_path(symbol):
+    return os.path.join(STORE_DIR, f"{symbol.upper()}.parquet")
+
+
+def load_manifest():
+    """
+    Read the manifest of stored symbols ({symbol: {first, last, rows, covered_from, updated, checked}}).
+    """
+    if _pending is not None:
+        return _pending
+    if not os.path.exists(MANIFEST_FILE):
+        return {}
+    try:
+        with open(MANIFEST_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_manifest(manifest):
+    if _pending is not None:
+        return
+    _write_manifest(manifest)
+
+
+def _write_manifest(manifest):
+    os.makedirs(STORE_DIR, exist_ok=True)
+    tmp_file = MANIFEST_FILE + ".tmp"
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_file, MANIFEST_FILE)
+
+
+@contextmanager
+def batch():
+    """
+    Buffer manifest updates (write_bars, mark_checked, mark_stale) and write
+    manifest.json once on exit, instead of once per symbol. Nested calls join
+    the outer batch.
+    """
+    global _pending
+    with _lock:
+        owner = _pending is None
+        if owner:
+            _pending = load_manifest()
+    try:
+        yield
+    finally:
+        if owner:
+            with _lock:
+                manifest, _pending = _pending, None
+                _write_manifest(manifest)
+
+
+def read_bars(symbol):
+    """
+    Load the stored bars of a symbol, or None if nothing is stored yet.
+    """
+    path = _bar_path(symbol)
+    if not os.path.exists(path):
+        return None
+    try:
+        df = pd.read_parquet(path)
+    except Exception as e:
+        print(f"Error reading stored bars for {symbol}: {e}")
+        return None
+    return df if not df.empty else None
+
+
+def write_bars(symbol, df, covered_from=None):
+    """
+    Persist the full bar history of a symbol and update its manifest entry.
+
+    covered_from is the earliest date the provider was asked for; a stock listed
+    after that date still counts as fully covered from there.
+    """
+    if df is None or df.empty:
+        return
+    df = df[~df.index.duplicated(keep="last")].sort_index()
+
+    with _lock:
+        os.makedirs(STORE_DIR, exist_ok=True)
+        path = _bar_path(symbol)
+        tmp_path = path + ".tmp"
+        df.to_parquet(tmp_path)
+        os.replace(tmp_path, path)
+
+        manifest = load_manifest()
+        entry = manifest.get(symbol.upper(), {})
+        first = df.index[0].strftime("%Y-%m-%d")
+        if covered_from is not None:
+            covered = pd.Timestamp(covered_from).strftime("%Y-%m-%d")
+            # 只會往前擴張涵蓋範圍
+            if entry.get("covered_from"):
+                covered = min(covered, entry["covered_from"])
+        else:
+            covered = entry.get("covered_from") or first
+        manifest[symbol.upper()] = {
+            "first": first,
+            "last": df.index[-1].strftime("%Y-%m-%d"),
+            "rows": int(len(df)),
+            "covered_from": min(covered, first),
+            "updated": datetime.now().isoformat(timespec="seconds"),
+            "checked": _now_iso(),
+        }
+        _save_manifest(manifest)
+
+
+def _now_iso():
+    # 帶時區的時間，供交易日曆判斷資料是否已定稿
+    return datetime.now().astimezone().isoformat(timespec="seconds")
+
+
+def mark_checked(symbols):
+    """
+    Record that the provider was asked for these symbols just now, even if it had no new bars.
+    """
+    with _lock:
+        manifest = load_manifest()
+        now = _now_iso()
+        for symbol in symbols:
+            entry = manifest.get(symbol.upper())
+            if entry:
+                entry["checked"] = now
+        _save_manifest(manifest)
+
+
+def mark_stale(symbols):
+    """
+    Forget when these symbols were last checked, so the next fetch asks the provider again.
+    """
+    with _lock:
+        manifest = load_manifest()
+        for symbol in symbols:
+            entry = manifest.get(symbol.upper())
+            if entry:
+                entry.pop("checked", None)
+        _save_manifest(manifest)
+
+
+def last_checked(symbol, manifest=None):
+    """
+    When the provider was last asked for a symbol (an ISO timestamp), or None.
+    """
+    manifest = manifest if manifest is not None else load_manifest()
+    entry = manifest.get(symbol.upper()) or {}
+    return entry.get("checked")
+
+
+def merge_bars(stored, new):
+    """
+    Append freshly fetched bars to the stored ones. Overlapping dates take the new values.
+    """
+    if stored is None or stored.empty:
+        return new
+    if new is None or new.empty:
+        return stored
+    if stored.index.tz is not None and new.index.tz is not None:
+        new = new.tz_convert(stored.index.tz)
+    merged = pd.concat([stored, new])
+    merged = merged[~merged.index.duplicated(keep="last")]
+    return merged.sort_index()
+
+
+def is_covered(symbol, start, manifest=None):
+    """
+    True if the store already holds this symbol's history back to `start`
+    (None means the full history).
+    """
+    manifest = manifest if manifest is not None else load_manifest()
+    entry = manifest.get(symbol.upper())
+    if not entry:
+        return False
+    start = FULL_HISTORY if start is None else pd.Timestamp(start).strftime("%Y-%m-%d")
+    return entry.get("covered_from", entry["first"]) <= start
+
+
+def slice_period(df, start):
+    """
+    Return the bars on or after `start` (a naive date), matching the provider's period window.
+    """
+    if df is None or start is None:
+        return df
+    start = pd.Timestamp(start)
+    if df.index.tz is not None:
+        start = start.tz_localize(df.index.tz)
+    return df[df.index >= start]
+
+
+def data_version(df):
+    """
+    A short identifier of a bar set's content, used to key caches of derived results.
+    Hashes the whole Close/Volume history, so a provider re-adjusting past bars
+    (dividends, splits) yields a new version even if the last bar is unchanged.
+    """
+    if df is None or df.empty:
+        return "empty"
+    columns = [col for col in ('Close', 'Volume') if col in df.columns]
+    digest = hashlib.blake2b(digest_size=8)
+    digest.update(np.ascontiguousarray(df.index.asi8).tobytes())
+    digest.update(np.ascontiguousarray(df[columns].to_numpy(dtype=float)).tobytes())
+    return f"{len(df)}-{df.index[-1].strftime('%Y%m%d')}-{digest.hexdigest()}"
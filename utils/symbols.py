@@ -0,0 +1,161 @@
+import os
+import argparse
+import threading
+from datetime import datetime
+
+import pandas as pd
+
+# 本地股票主檔：代號、中文名稱、市場 (TWSE/TPEx)、產業、上市狀態
+# 啟動時讀入記憶體一次，查詢名稱完全不需要網路
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MASTER_FILE = os.path.join(BASE_DIR, "data", "symbols.csv")
+
+MASTER_COLUMNS = ["symbol", "code", "name", "market", "industry", "type", "listed_date", "status", "updated"]
+
+# 證交所 ISIN 清單的市場別 -> (市場, yfinance 後綴)
+MARKETS = {
+    "上市": ("TWSE", ".TW"),
+    "上市臺灣創新板": ("TWSE", ".TW"),
+    "上櫃": ("TPEx", ".TWO"),
+}
+
+# 權證數量龐大又不會出現在看盤清單，不放進主檔
+EXCLUDED_TYPES = ("上市認購(售)權證", "上櫃認購(售)權證")
+
+_lock = threading.Lock()
+_master = None
+
+
+def _listing_files():
+    """
+    The listing CSVs bundled with twstock (same format as the TWSE ISIN pages).
+    """
+    import twstock
+    folder = os.path.join(os.path.dirname(twstock.__file__), "codes")
+    return [os.path.join(folder, "twse_equities.csv"), os.path.join(folder, "tpex_equities.csv")]
+
+
+def parse_listing(path):
+    """
+    Read a listing CSV (type, code, name, ISIN, start, market, group, CFI) into master rows.
+    """
+    raw = pd.read_csv(path, dtype=str).fillna("")
+    raw = raw[~raw["type"].isin(EXCLUDED_TYPES) & raw["market"].isin(MARKETS)]
+    market = raw["market"].map(lambda m: MARKETS[m][0])
+    suffix = raw["market"].map(lambda m: MARKETS[m][1])
+    return pd.DataFrame({
+        "symbol": raw["code"].str.strip() + suffix,
+        "code": raw["code"].str.strip(),
+        "name": raw["name"].str.strip(),
+        "market": market,
+        "industry": raw["group"].str.strip(),
+        "type": raw["type"].str.strip(),
+        "listed_date": raw["start"].str.strip(),
+        "status": "listed",
+    })
+
+
+def refresh_master(listing_files=None):
+    """
+    Rebuild the master from listing files (twstock's bundled copies by default).
+    Symbols that disappear from the listing are kept and marked as delisted.
+    Returns the number of listed symbols.
+    """
+    frames = [parse_listing(path) for path in (listing_files or _listing_files())]
+    fresh = pd.concat(frames, ignore_index=True).drop_duplicates("symbol", keep="last")
+    fresh["updated"] = datetime.now().strftime("%Y-%m-%d")
+
+    old = _read_master_file()
+    if old is not None:
+        gone = old[~old["symbol"].isin(fresh["symbol"])].assign(status="delisted")
+        fresh = pd.concat([fresh, gone], ignore_index=True)
+
+    os.makedirs(os.path.dirname(MASTER_FILE), exist_ok=True)
+    tmp_file = MASTER_FILE + ".tmp"
+    fresh[MASTER_COLUMNS].to_csv(tmp_file, index=False, encoding="utf-8")
+    os.replace(tmp_file, MASTER_FILE)
+    _set_master(fresh)
+    return int((fresh["status"] == "listed").sum())
+
+
+def _read_master_file():
+    if not os.path.exists(MASTER_FILE):
+        return None
+    try:
+        return pd.read_csv(MASTER_FILE, dtype=str).fillna("")
+    except Exception as e:
+        print(f"Error reading symbol master: {e}")
+        return None
+
+
+def _set_master(df):
+    global _master
+    _master = {row["symbol"]: row for row in df[MASTER_COLUMNS].to_dict("records")}
+
+
+def load_master():
+    """
+    The in-memory master ({symbol: record}); built from the bundled listings on first use.
+    """
+    if _master is None:
+        with _lock:
+            if _master is None:
+                df = _read_master_file()
+                if df is None:
+                    refresh_master()
+                else:
+                    _set_master(df)
+    return _master
+
+
+def get_record(symbol):
+    return load_master().get(symbol.upper())
+
+
+def get_name(symbol):
+    """
+    Traditional Chinese name of a symbol, or None if it is not in the master.
+    """
+    record = get_record(symbol)
+    return record["name"] if record else None
+
+
+def lookup_names(symbols):
+    """
+    Vectorized name lookup: a Series of names aligned with `symbols`,
+    falling back to the symbol itself when unknown.
+    """
+    symbols = pd.Series(symbols)
+    names = {sym: rec["name"] for sym, rec in load_master().items()}
+    return symbols.str.upper().map(names).fillna(symbols)
+
+
+def master_frame(status="listed"):
+    """
+    The master as a DataFrame, optionally filtered by listing status.
+    """
+    df = pd.DataFrame(list(load_master().values()), columns=MASTER_COLUMNS)
+    return df[df["status"] == status] if status else df
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="股票主檔維護")
+    sub = parser.add_subparsers(dest="command", required=True)
+    refresh = sub.add_parser("refresh", help="由上市/上櫃清單重建主檔")
+    refresh.add_argument("--listing", nargs="*", help="清單 CSV (預設使用 twstock 內附清單)")
+    refresh.add_argument("--download", metavar="DIR", help="先從證交所 ISIN 網站下載最新清單到此目錄")
+    args = parser.parse_args(argv)
+
+    if args.command == "refresh":
+        listing = args.listing
+        if args.download:
+            from twstock.codes.fetch import to_csv, TWSE_EQUITIES_URL, TPEX_EQUITIES_URL
+            os.makedirs(args.download, exist_ok=True)
+            listing = [os.path.join(args.download, "twse_equities.csv"), os.path.join(args.download, "tpex_equities.csv")]
+            to_csv(TWSE_EQUITIES_URL, listing[0])
+            to_csv(TPEX_EQUITIES_URL, listing[1])
+        print(f"{refresh_master(listing)} listed symbols")
+
+
+if __name__ == "__main__":
+    main()
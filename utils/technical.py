@@ -1,49 +1,350 @@
+import threading
+from collections import OrderedDict
+
 import pandas as pd
 import numpy as np
 
-def calculate_indicators(df):
+from utils.store import data_version
+
+# 指標參數：calculate_indicators 只計算 spec 列出的指標，欄位名稱由參數決定 (與 pandas_ta 相同命名)，
+# 只有 RSI 固定叫 'RSI'，評分與盤中模式都以這個欄位為準
+DEFAULT_INDICATORS = {
+    "sma": (5, 10, 20, 60),
+    "rsi": 14,
+    "macd": (12, 26, 9),
+    "bbands": (20, 2.0),
+    "vol_sma": (5, 20),
+    "std": 20,
+}
+
+# 分數與掃描需要季線 (預設 60 根 K 棒) 才有意義
+MIN_BARS = 60
+
+# 每個 (股票, 指標, 參數) 只保留最新資料版本的結果
+MAX_CACHED_INDICATORS = 5000
+
+_cache_lock = threading.Lock()
+_indicator_cache = OrderedDict()
+
+
+def indicator_spec(**overrides):
+    """
+    The default spec with some parameters replaced, e.g. indicator_spec(rsi=9).
+    """
+    return {**DEFAULT_INDICATORS, **overrides}
+
+
+def min_bars(spec=None):
+    """
+    Bars a symbol needs before its quarter moving average (and anything built on it) is meaningful.
+    """
+    # 季線視窗加長時，需要的 K 棒數跟著增加
+    return max(MIN_BARS, (spec or DEFAULT_INDICATORS)["sma"][3])
+
+
+def changed_indicators(spec):
+    """
+    The part of `spec` whose parameters differ from DEFAULT_INDICATORS.
+    """
+    return {kind: params for kind, params in spec.items() if DEFAULT_INDICATORS.get(kind) != params}
+
+
+def spec_key(spec):
+    """
+    Short text identifying a spec's non-default parameters ("" for the default spec).
+    """
+    changed = changed_indicators(spec)
+    return ";".join(f"{kind}={params}" for kind, params in sorted(changed.items()))
+
+
+def _units(spec):
+    # 均線類每個視窗是一個獨立的指標
+    for kind, params in spec.items():
+        if kind in ("sma", "vol_sma"):
+            for window in params:
+                yield kind, window
+        else:
+            yield kind, tuple(params) if isinstance(params, list) else params
+
+
+def unit_columns(kind, params):
+    if kind == "sma":
+        return [f'SMA{params}']
+    if kind == "rsi":
+        return ['RSI']
+    if kind == "macd":
+        suffix = "_".join(str(p) for p in params)
+        return [f'MACD_{suffix}', f'MACDs_{suffix}', f'MACDh_{suffix}']
+    if kind == "bbands":
+        suffix = f"{params[0]}_{float(params[1]):.1f}"
+        return [f'BBM_{suffix}', f'BBU_{suffix}', f'BBL_{suffix}']
+    if kind == "vol_sma":
+        return [f'VOL_SMA{params}']
+    if kind == "std":
+        return [f'STD{params}']
+    raise ValueError(f"Unknown indicator: {kind}")
+
+
+def indicator_columns(spec=None):
+    return [col for kind, params in _units(spec or DEFAULT_INDICATORS) for col in unit_columns(kind, params)]
+
+
+def sma_columns(spec=None):
+    """
+    (short, mid, month, quarter) moving-average column names of a spec, SMA5/10/20/60 by default.
+    """
+    return tuple(f'SMA{w}' for w in (spec or DEFAULT_INDICATORS)["sma"])
+
+
+def vol_sma_columns(spec=None):
+    """
+    (short, long) average-volume column names of a spec, VOL_SMA5/20 by default.
+    """
+    return tuple(f'VOL_SMA{w}' for w in (spec or DEFAULT_INDICATORS)["vol_sma"])
+
+
+def std_column(spec=None):
+    return unit_columns("std", (spec or DEFAULT_INDICATORS)["std"])[0]
+
+
+def macd_columns(spec=None):
+    """
+    (MACD, signal, histogram) column names of a spec.
+    """
+    return tuple(unit_columns("macd", (spec or DEFAULT_INDICATORS)["macd"]))
+
+
+def bbands_columns(spec=None):
+    """
+    (middle, upper, lower) Bollinger column names of a spec.
+    """
+    return tuple(unit_columns("bbands", (spec or DEFAULT_INDICATORS)["bbands"]))
+
+
+def _frame_indicator(kind, params, close, volume):
+    """
+    One indicator of calculate_indicators on a single symbol's Series.
+    """
+    columns = unit_columns(kind, params)
+    if kind == "sma":
+        return {columns[0]: close.rolling(window=params).mean()}
+    if kind == "rsi":
+        delta = close.diff()
+        gain = (delta.where(delta > 0, 0)).rolling(window=params).mean()
+        loss = (-delta.where(delta < 0, 0)).rolling(window=params).mean()
+        # Handle division by zero
+        rs = gain / loss.replace(0, np.nan)
+        rsi = 100 - (100 / (1 + rs))
+        return {columns[0]: rsi.fillna(50)} # Default to 50 if calculation fails
+    if kind == "macd":
+        fast, slow, signal = params
+        macd = close.ewm(span=fast, adjust=False).mean() - close.ewm(span=slow, adjust=False).mean()
+        macd_signal = macd.ewm(span=signal, adjust=False).mean()
+        return dict(zip(columns, (macd, macd_signal, macd - macd_signal)))
+    if kind == "bbands":
+        window, k = params
+        middle = close.rolling(window=window).mean()
+        std = close.rolling(window=window).std()
+        return dict(zip(columns, (middle, middle + (k * std), middle - (k * std))))
+    if kind == "vol_sma":
+        return {columns[0]: volume.rolling(window=params).mean()}
+    if kind == "std":
+        return {columns[0]: close.rolling(window=params).std()}
+
+
+def _cached_indicator(symbol, kind, params, version, compute):
+    key = (symbol, kind, params)
+    with _cache_lock:
+        entry = _indicator_cache.get(key)
+        if entry is not None and entry[0] == version:
+            _indicator_cache.move_to_end(key)
+            return entry[1]
+    values = {col: series.to_numpy() for col, series in compute().items()}
+    with _cache_lock:
+        _indicator_cache[key] = (version, values)
+        _indicator_cache.move_to_end(key)
+        while len(_indicator_cache) > MAX_CACHED_INDICATORS:
+            _indicator_cache.popitem(last=False)
+    return values
+
+
+def calculate_indicators(df, spec=None, symbol=None):
     """
     Calculate technical indicators for the given dataframe without pandas_ta.
+
+    `spec` maps indicator kinds to parameters (DEFAULT_INDICATORS by default) and
+    only those indicators are computed. With `symbol`, each indicator is memoized
+    per (symbol, indicator, params, data version), so changing one parameter
+    recomputes only that indicator.
     """
     if df is None or df.empty:
         return df
     
     # Copy to avoid modifying original
     df = df.copy()
-    
-    # Moving Averages
-    df['SMA5'] = df['Close'].rolling(window=5).mean()
-    df['SMA10'] = df['Close'].rolling(window=10).mean()
-    df['SMA20'] = df['Close'].rolling(window=20).mean()
-    df['SMA60'] = df['Close'].rolling(window=60).mean()
-    
-    # RSI (14)
-    delta = df['Close'].diff()
-    gain = (delta.where(delta > 0, 0)).rolling(window=14).mean()
-    loss = (-delta.where(delta < 0, 0)).rolling(window=14).mean()
-    # Handle division by zero
-    rs = gain / loss.replace(0, np.nan)
-    df['RSI'] = 100 - (100 / (1 + rs))
-    df['RSI'] = df['RSI'].fillna(50) # Default to 50 if calculation fails
-    
-    # MACD (12, 26, 9)
-    ema12 = df['Close'].ewm(span=12, adjust=False).mean()
-    ema26 = df['Close'].ewm(span=26, adjust=False).mean()
-    df['MACD_12_26_9'] = ema12 - ema26
-    df['MACDs_12_26_9'] = df['MACD_12_26_9'].ewm(span=9, adjust=False).mean()
-    df['MACDh_12_26_9'] = df['MACD_12_26_9'] - df['MACDs_12_26_9']
-    
-    # Bollinger Bands (20, 2)
-    df['BBM_20_2.0'] = df['Close'].rolling(window=20).mean()
-    std20 = df['Close'].rolling(window=20).std()
-    df['BBU_20_2.0'] = df['BBM_20_2.0'] + (2 * std20)
-    df['BBL_20_2.0'] = df['BBM_20_2.0'] - (2 * std20)
-    
-    # Volume MA
-    df['VOL_SMA5'] = df['Volume'].rolling(window=5).mean()
-    df['VOL_SMA20'] = df['Volume'].rolling(window=20).mean()
-    
-    # Standard Deviation for Volatility (20 days)
-    df['STD20'] = df['Close'].rolling(window=20).std()
+    close = df['Close']
+    volume = df['Volume']
+    version = data_version(df) if symbol is not None else None
+
+    for kind, params in _units(spec or DEFAULT_INDICATORS):
+        compute = lambda kind=kind, params=params: _frame_indicator(kind, params, close, volume)
+        if symbol is None:
+            values = compute()
+        else:
+            values = _cached_indicator(symbol, kind, params, version, compute)
+        for col, value in values.items():
+            df[col] = value
     
     return df
+
+
+# --- Panel mode: whole universe at once ---
+
+INDICATOR_COLUMNS = indicator_columns(DEFAULT_INDICATORS)
+
+
+def stack_panel(data_dict, fields=('Close', 'Volume')):
+    """
+    Stack per-symbol frames into right-aligned (bar x symbol) arrays.
+    The last row holds every symbol's latest bar; shorter histories are
+    NaN-padded on top, so every rolling window sees exactly the bars the
+    single-symbol calculation would.
+    Returns (symbols, lengths, {field: 2D array}).
+    """
+    symbols = [sym for sym, df in data_dict.items() if df is not None and not df.empty]
+    lengths = np.array([len(data_dict[sym]) for sym in symbols], dtype=int)
+    n_bars = int(lengths.max()) if len(lengths) else 0
+
+    panel = {}
+    for field in fields:
+        arr = np.full((n_bars, len(symbols)), np.nan)
+        for j, sym in enumerate(symbols):
+            arr[n_bars - lengths[j]:, j] = data_dict[sym][field].to_numpy(dtype=float)
+        panel[field] = arr
+    return symbols, lengths, panel
+
+def _rolling_sum(x, window):
+    """
+    Rolling sum along axis 0 via cumulative sums. A window containing any NaN is NaN,
+    like pandas' rolling(window) with the default min_periods.
+    """
+    valid = ~np.isnan(x)
+    csum = np.cumsum(np.where(valid, x, 0.0), axis=0)
+    ccount = np.cumsum(valid, axis=0)
+    zero = np.zeros((1, x.shape[1]))
+    csum = np.vstack([zero, csum])
+    ccount = np.vstack([zero, ccount])
+
+    out = np.full(x.shape, np.nan)
+    if x.shape[0] >= window:
+        sums = csum[window:] - csum[:-window]
+        counts = ccount[window:] - ccount[:-window]
+        out[window - 1:] = np.where(counts == window, sums, np.nan)
+    return out
+
+def _rolling_mean(x, window):
+    return _rolling_sum(x, window) / window
+
+def _rolling_std(x, window):
+    """
+    Rolling sample standard deviation (ddof=1) along axis 0.
+    Values are shifted by each column's mean first to keep the sum of squares well conditioned.
+    """
+    with np.errstate(all='ignore'):
+        offset = np.nan_to_num(np.nanmean(x, axis=0))
+    centered = x - offset
+    s1 = _rolling_sum(centered, window)
+    s2 = _rolling_sum(centered ** 2, window)
+    var = (s2 - s1 ** 2 / window) / (window - 1)
+    return np.sqrt(np.clip(var, 0.0, None))
+
+def _ewm_mean(x, span):
+    """
+    EMA along axis 0 matching pandas' ewm(span=span, adjust=False).mean():
+    each column starts at its first valid value.
+    """
+    alpha = 2.0 / (span + 1.0)
+    out = np.empty_like(x)
+    state = np.full(x.shape[1], np.nan)
+    for t in range(x.shape[0]):
+        row = x[t]
+        updated = np.where(np.isnan(state), row, state + alpha * (row - state))
+        state = np.where(np.isnan(row), state, updated)
+        out[t] = state
+    return out
+
+def panel_indicators(close, volume, columns=None, spec=None):
+    """
+    Compute the indicator columns of a spec on (bar x symbol) arrays.
+    With `columns`, only the indicators producing those columns are computed.
+    """
+    wanted = None if columns is None else set(columns)
+    means, stds = {}, {}
+
+    def mean(window):
+        if window not in means:
+            means[window] = _rolling_mean(close, window)
+        return means[window]
+
+    def std(window):
+        if window not in stds:
+            stds[window] = _rolling_std(close, window)
+        return stds[window]
+
+    ind = {}
+    for kind, params in _units(spec or DEFAULT_INDICATORS):
+        names = unit_columns(kind, params)
+        if wanted is not None and not wanted & set(names):
+            continue
+        if kind == "sma":
+            ind[names[0]] = mean(params)
+        elif kind == "rsi":
+            # RSI: 與單檔版相同，第一根的 diff 視為 0 (而非 NaN)
+            delta = np.vstack([np.full((1, close.shape[1]), np.nan), np.diff(close, axis=0)])
+            started = np.cumsum(~np.isnan(close), axis=0) > 0
+            gain = np.where(started, np.where(delta > 0, delta, 0.0), np.nan)
+            loss = np.where(started, np.where(delta < 0, -delta, 0.0), np.nan)
+            avg_gain = _rolling_mean(gain, params)
+            avg_loss = _rolling_mean(loss, params)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                rs = avg_gain / np.where(avg_loss == 0, np.nan, avg_loss)
+                rsi = 100 - (100 / (1 + rs))
+            ind[names[0]] = np.where(np.isnan(rsi), 50.0, rsi)
+        elif kind == "macd":
+            fast, slow, signal = params
+            macd = _ewm_mean(close, fast) - _ewm_mean(close, slow)
+            macd_signal = _ewm_mean(macd, signal)
+            ind.update(zip(names, (macd, macd_signal, macd - macd_signal)))
+        elif kind == "bbands":
+            window, k = params
+            ind.update(zip(names, (mean(window), mean(window) + k * std(window), mean(window) - k * std(window))))
+        elif kind == "vol_sma":
+            ind[names[0]] = _rolling_mean(volume, params)
+        elif kind == "std":
+            ind[names[0]] = std(params)
+    return ind
+
+def calculate_indicators_panel(data_dict, spec=None):
+    """
+    Panel version of calculate_indicators for a whole universe.
+    All symbols are computed together as (bar x symbol) arrays, then split
+    back into one DataFrame per symbol with the same columns as
+    calculate_indicators, so the scorer and scanner work unchanged.
+    """
+    symbols, lengths, panel = stack_panel(data_dict)
+    if not symbols:
+        return {}
+    columns = indicator_columns(spec)
+    ind = panel_indicators(panel['Close'], panel['Volume'], spec=spec)
+
+    # (bar, symbol, indicator) 一次切出每檔股票的區塊
+    cube = np.stack([ind[col] for col in columns], axis=2)
+    n_bars = cube.shape[0]
+    processed = {}
+    for j, sym in enumerate(symbols):
+        df = data_dict[sym]
+        block = pd.DataFrame(cube[n_bars - lengths[j]:, j, :], index=df.index, columns=columns)
+        if df.columns.isin(columns).any():
+            df = df.drop(columns=columns, errors='ignore')
+        processed[sym] = pd.concat([df, block], axis=1)
+    return processed
@@ -0,0 +1,126 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+from utils import trading_calendar
+from utils.store import data_version
+
+# 多週期 K 線：週線、月線 (以及有盤中資料時的 5/15/60 分 K) 都由本地的基礎 K 線重新取樣，
+# 不需再向資料源請求，也不需要第二份快取
+# period 為檢視時抓取的日 K 期間，scan_period 為潛力尋寶掃描的期間 (需至少 60 根)，
+# days 為每根 K 棒約略涵蓋的交易日數 (用來換算顯示範圍)
+TIMEFRAMES = {
+    "1d": {"label": "日線", "period": "1y", "scan_period": "6mo", "days": 1},
+    "1w": {"label": "週線", "period": "5y", "scan_period": "2y", "days": 5},
+    "1mo": {"label": "月線", "period": "10y", "scan_period": "10y", "days": 21},
+}
+
+# 分 K 只能由盤中基礎資料 (例如 1 分 K) 取樣，依 09:00 開盤對齊
+INTRADAY_MINUTES = {"5m": 5, "15m": 15, "60m": 60}
+
+DEFAULT_TIMEFRAME = "1d"
+
+_lock = threading.Lock()
+_cache = {}
+
+
+def _aggregate(df, keys):
+    """
+    OHLCV per group of `keys`, indexed by the group key.
+    """
+    grouped = df.assign(_time=df.index).groupby(keys, sort=True)
+    return pd.DataFrame({
+        'Open': grouped['Open'].first(),
+        'High': grouped['High'].max(),
+        'Low': grouped['Low'].min(),
+        'Close': grouped['Close'].last(),
+        'Volume': grouped['Volume'].sum(),
+        '_time': grouped['_time'].last(),
+    })
+
+
+def _trading_bars(df):
+    # 只保留交易日曆上的交易日 (資料源偶爾會在休市日留下零量 K 棒)
+    return df[trading_calendar.trading_day_mask(df.index)]
+
+
+def resample_daily(df, timeframe):
+    """
+    Weekly or monthly OHLCV from daily bars on the Taiwan trading calendar.
+    """
+    df = _trading_bars(df)
+    if df.empty:
+        return df
+    naive = df.index.tz_localize(None) if df.index.tz is not None else df.index
+    freq = "W-SUN" if timeframe == "1w" else "M"
+    out = _aggregate(df, naive.to_period(freq))
+    # 每根 K 棒以區間內最後一個交易日標示 (未走完的本週/本月即為最新一根)
+    out.index = pd.DatetimeIndex(out.pop('_time'))
+    return out.rename_axis(df.index.name)
+
+
+def resample_intraday(df, minutes):
+    """
+    N-minute OHLCV from finer intraday bars, buckets aligned to the session open
+    and bars outside the regular session dropped.
+    """
+    local = df.index.tz_convert(trading_calendar.TZ) if df.index.tz is not None else df.index
+    open_ = local.normalize() + pd.Timedelta(hours=trading_calendar.SESSION_OPEN.hour,
+                                             minutes=trading_calendar.SESSION_OPEN.minute)
+    elapsed = (local - open_) / pd.Timedelta(minutes=1)
+    session_minutes = (trading_calendar.SESSION_CLOSE.hour * 60 + trading_calendar.SESSION_CLOSE.minute
+                       - trading_calendar.SESSION_OPEN.hour * 60 - trading_calendar.SESSION_OPEN.minute)
+    mask = np.asarray((elapsed >= 0) & (elapsed <= session_minutes))
+    df = df[mask]
+    if df.empty:
+        return df
+    # 以區間起點標示的 K 棒，收盤 13:30 的最後一筆併入前一根
+    bucket = np.minimum(np.asarray(elapsed[mask]) // minutes, (session_minutes - 1) // minutes)
+    starts = open_[mask] + pd.to_timedelta(bucket * minutes, unit="min")
+    out = _aggregate(df, starts)
+    out.index.name = df.index.name
+    return out.drop(columns='_time')
+
+
+def resample(df, timeframe):
+    """
+    OHLCV bars of `timeframe` derived from `df` (daily bars for "1d"/"1w"/"1mo",
+    intraday bars for "5m"/"15m"/"60m"). Indicator columns are not carried over.
+    """
+    if df is None or df.empty or timeframe == DEFAULT_TIMEFRAME:
+        return df
+    if timeframe in INTRADAY_MINUTES:
+        return resample_intraday(df, INTRADAY_MINUTES[timeframe])
+    if timeframe not in TIMEFRAMES:
+        raise ValueError(f"Unknown timeframe: {timeframe}")
+    return resample_daily(df, timeframe)
+
+
+def get_bars(symbol, df, timeframe):
+    """
+    Memoized resample keyed by (symbol, timeframe, data version); a new version
+    replaces the entry of the same symbol and timeframe.
+    """
+    if timeframe == DEFAULT_TIMEFRAME:
+        return df
+    key = (symbol, timeframe)
+    version = data_version(df)
+    with _lock:
+        entry = _cache.get(key)
+        if entry is not None and entry[0] == version:
+            return entry[1]
+    bars = resample(df, timeframe)
+    with _lock:
+        _cache[key] = (version, bars)
+    return bars
+
+
+def resample_many(data_dict, timeframe):
+    return {sym: get_bars(sym, df, timeframe) for sym, df in data_dict.items()}
+
+
+def clear(symbols=None):
+    with _lock:
+        for key in [k for k in _cache if symbols is None or k[0] in symbols]:
+            _cache.pop(key)
@@ -0,0 +1,355 @@
+import os
+import re
+import json
+import argparse
+import warnings
+from datetime import date, datetime, time, timedelta
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+# 台股交易日曆：國定假日、颱風休市、補行交易日與盤中時段 (Asia/Taipei)
+# 用來判斷快取中的資料「還會不會變」，讓快取剛好在新資料出現時失效
+TZ = "Asia/Taipei"
+SESSION_OPEN = time(9, 0)
+SESSION_CLOSE = time(13, 30)
+
+# 收盤後日 K 定稿所需時間 (到 14:30；Yahoo 的日 K 在收盤後一段時間內仍可能修正收盤價與成交量)，
+# 以及證交所公布三大法人 (T86) 的時間
+BAR_SETTLE = timedelta(hours=1)
+FLOWS_READY = time(16, 0)
+
+# 盤中資料持續變動，快取每隔這麼久換一個版本
+INTRADAY_REFRESH = timedelta(minutes=10)
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CALENDAR_FILE = os.path.join(BASE_DIR, "data", "calendar.json")
+
+HOLIDAY_URL = "https://www.twse.com.tw/rwd/zh/holidaySchedule/holidaySchedule"
+
+# 證交所公告的平日休市日 (含春節前後僅辦理結算交割、無交易的日子)
+# 其他年份可用 python -m utils.trading_calendar refresh --year YYYY 取得
+HOLIDAYS = {
+    # 2025
+    "2025-01-01", "2025-01-23", "2025-01-24", "2025-01-27", "2025-01-28",
+    "2025-01-29", "2025-01-30", "2025-01-31", "2025-02-28", "2025-04-03",
+    "2025-04-04", "2025-05-01", "2025-05-30", "2025-09-29", "2025-10-06",
+    "2025-10-10", "2025-10-24", "2025-12-25",
+    # 2026
+    "2026-01-01", "2026-02-12", "2026-02-13", "2026-02-16", "2026-02-17",
+    "2026-02-18", "2026-02-19", "2026-02-20", "2026-02-27", "2026-04-03",
+    "2026-04-06", "2026-05-01", "2026-06-19", "2026-09-25", "2026-09-28",
+    "2026-10-09", "2026-10-26", "2026-12-25",
+}
+HOLIDAY_YEARS = {int(d[:4]) for d in HOLIDAYS}
+
+# 已提醒過缺少休市表的年份 (每個年份只警告一次)
+_warned_years = set()
+
+
+def _to_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return pd.Timestamp(value).date()
+
+
+def load_overrides():
+    """
+    Local calendar additions ({"closed": {date: reason}, "open": {date: reason}, "years": [...]}):
+    typhoon closures, makeup trading days and fetched holiday schedules;
+    "years" lists the years whose full schedule was fetched with refresh().
+    """
+    if not os.path.exists(CALENDAR_FILE):
+        return {"closed": {}, "open": {}, "years": []}
+    try:
+        with open(CALENDAR_FILE, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {"closed": {}, "open": {}, "years": []}
+    return {"closed": data.get("closed", {}), "open": data.get("open", {}), "years": data.get("years", [])}
+
+
+def _save_overrides(overrides):
+    os.makedirs(os.path.dirname(CALENDAR_FILE), exist_ok=True)
+    tmp_file = CALENDAR_FILE + ".tmp"
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump(overrides, f, ensure_ascii=False, indent=1, sort_keys=True)
+    os.replace(tmp_file, CALENDAR_FILE)
+    _calendar_sets.cache_clear()
+
+
+@lru_cache(maxsize=1)
+def _calendar_sets():
+    overrides = load_overrides()
+    closed = {_to_date(d) for d in HOLIDAYS} | {_to_date(d) for d in overrides["closed"]}
+    opened = {_to_date(d) for d in overrides["open"]}
+    years = HOLIDAY_YEARS | {int(y) for y in overrides["years"]}
+    return closed - opened, opened, years
+
+
+def known_years():
+    """
+    Years whose holiday schedule is known (built in or fetched with refresh()).
+    """
+    return _calendar_sets()[2]
+
+
+def _warn_unknown_year(year):
+    if year in _warned_years:
+        return
+    _warned_years.add(year)
+    warnings.warn(f"No TWSE holiday schedule for {year}: every weekday counts as a trading day. "
+                  f"Run python -m utils.trading_calendar refresh --year {year}", RuntimeWarning, stacklevel=3)
+
+
+def add_closure(day, reason="颱風休市"):
+    """
+    Record an unscheduled closure such as a typhoon day.
+    """
+    overrides = load_overrides()
+    overrides["closed"][_to_date(day).isoformat()] = reason
+    overrides["open"].pop(_to_date(day).isoformat(), None)
+    _save_overrides(overrides)
+
+
+def add_trading_day(day, reason="補行交易日"):
+    """
+    Record a makeup trading day (e.g. a Saturday session).
+    """
+    overrides = load_overrides()
+    overrides["open"][_to_date(day).isoformat()] = reason
+    overrides["closed"].pop(_to_date(day).isoformat(), None)
+    _save_overrides(overrides)
+
+
+def is_trading_day(day):
+    day = _to_date(day)
+    closed, opened, years = _calendar_sets()
+    if day.year not in years:
+        _warn_unknown_year(day.year)
+    if day in opened:
+        return True
+    return day.weekday() < 5 and day not in closed
+
+
+def trading_day_mask(index):
+    """
+    Boolean array marking which timestamps of a DatetimeIndex fall on trading days.
+    """
+    closed, opened, years = _calendar_sets()
+    # 日曆只讀一次，整欄比對 (逐日呼叫 is_trading_day 每次都會重讀覆寫檔)
+    days = pd.DatetimeIndex(index)
+    if days.tz is not None:
+        days = days.tz_localize(None)
+    days = days.normalize()
+    for year in sorted(set(days.year) - years):
+        _warn_unknown_year(year)
+    closed = pd.DatetimeIndex(sorted(closed))
+    opened = pd.DatetimeIndex(sorted(opened))
+    return np.asarray(((days.weekday < 5) & ~days.isin(closed)) | days.isin(opened))
+
+
+def previous_trading_day(day):
+    """
+    The last trading day strictly before `day`.
+    """
+    day = _to_date(day) - timedelta(days=1)
+    while not is_trading_day(day):
+        day -= timedelta(days=1)
+    return day
+
+
+def next_trading_day(day):
+    """
+    The first trading day strictly after `day`.
+    """
+    day = _to_date(day) + timedelta(days=1)
+    while not is_trading_day(day):
+        day += timedelta(days=1)
+    return day
+
+
+def trading_days(start, end):
+    """
+    Trading days in [start, end] as a list of dates.
+    """
+    days = pd.date_range(_to_date(start), _to_date(end), freq="D")
+    return [d.date() for d in days[trading_day_mask(days)]]
+
+
+def now_taipei(now=None):
+    """
+    `now` as an Asia/Taipei timestamp; naive values are taken as system local time.
+    """
+    if now is None:
+        return pd.Timestamp.now(tz=TZ)
+    now = pd.Timestamp(now)
+    if now.tzinfo is None:
+        now = now.tz_localize(datetime.now().astimezone().tzinfo)
+    return now.tz_convert(TZ)
+
+
+def _at(day, moment):
+    return pd.Timestamp(datetime.combine(day, moment)).tz_localize(TZ)
+
+
+def session_bounds(day):
+    """
+    (open, close) timestamps of a trading day in Asia/Taipei.
+    """
+    day = _to_date(day)
+    return _at(day, SESSION_OPEN), _at(day, SESSION_CLOSE)
+
+
+def in_session(now=None):
+    """
+    True between the open and the moment the day's bar is final (close + BAR_SETTLE).
+    """
+    now = now_taipei(now)
+    today = now.date()
+    if not is_trading_day(today):
+        return False
+    open_, close = session_bounds(today)
+    return open_ <= now < close + BAR_SETTLE
+
+
+def last_final_close(now=None):
+    """
+    The close (plus settle time) of the latest session whose daily bar is final by `now`.
+    """
+    now = now_taipei(now)
+    day = now.date()
+    if not is_trading_day(day) or now < session_bounds(day)[1] + BAR_SETTLE:
+        day = previous_trading_day(day)
+    return session_bounds(day)[1] + BAR_SETTLE
+
+
+def latest_session(now=None):
+    """
+    The trading day whose bar is the newest that can exist at `now`
+    (today while the session is running).
+    """
+    now = now_taipei(now)
+    if in_session(now):
+        return now.date()
+    return last_final_close(now).date()
+
+
+def bars_epoch(now=None):
+    """
+    Cache key for daily bars: constant from one session's final close until the
+    next open, and stepping every INTRADAY_REFRESH while a session is running.
+    """
+    now = now_taipei(now)
+    if in_session(now):
+        open_ = session_bounds(now.date())[0]
+        step = int((now - open_) / INTRADAY_REFRESH)
+        return f"{now.date():%Y%m%d}-live{step}"
+    return f"{last_final_close(now).date():%Y%m%d}-final"
+
+
+def flows_ready_day(now=None):
+    """
+    The latest trading day whose T86 report is published by `now`.
+    """
+    now = now_taipei(now)
+    day = now.date()
+    if not is_trading_day(day) or now < _at(day, FLOWS_READY):
+        day = previous_trading_day(day)
+    return day
+
+
+def flows_epoch(now=None):
+    """
+    Cache key for institutional flows.
+    """
+    return f"{flows_ready_day(now):%Y%m%d}"
+
+
+def bars_final(checked, now=None):
+    """
+    True if bars last fetched at `checked` can no longer change at `now`,
+    i.e. no session is running and the fetch happened after the last final close.
+    """
+    if checked is None:
+        return False
+    now = now_taipei(now)
+    return not in_session(now) and now_taipei(checked) >= last_final_close(now)
+
+
+def _parse_schedule(payload):
+    """
+    Closed weekdays from a TWSE holidaySchedule payload. Rows announcing the
+    last/first trading day around a holiday are trading days and are skipped.
+    """
+    closed = {}
+    for row in payload.get("data", []):
+        cells = [str(c) for c in row]
+        day = None
+        for cell in cells:
+            match = re.search(r"(\d{2,4})[-/](\d{1,2})[-/](\d{1,2})", cell)
+            if match:
+                year = int(match.group(1))
+                year = year + 1911 if year < 1911 else year  # 民國年
+                day = date(year, int(match.group(2)), int(match.group(3)))
+                break
+        text = " ".join(cells)
+        if day is None or "交易日" in text or day.weekday() >= 5:
+            continue
+        reasons = [c for c in cells if c and not re.search(r"\d[-/]\d", c)]
+        closed[day.isoformat()] = reasons[0] if reasons else "休市"
+    return closed
+
+
+def refresh(year, base_url=None):
+    """
+    Fetch the official TWSE holiday schedule of one year into the local calendar file.
+    Returns the number of closed weekdays found.
+    """
+    import requests
+
+    url = (base_url.rstrip("/") + "/rwd/zh/holidaySchedule/holidaySchedule") if base_url else HOLIDAY_URL
+    response = requests.get(url, params={"response": "json", "queryYear": int(year) - 1911}, timeout=15,
+                            headers={'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'})
+    response.raise_for_status()
+    closed = _parse_schedule(response.json())
+    overrides = load_overrides()
+    overrides["closed"].update(closed)
+    if closed:
+        overrides["years"] = sorted(set(overrides["years"]) | {int(year)})
+    _save_overrides(overrides)
+    _warned_years.discard(int(year))
+    return len(closed)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="台股交易日曆")
+    sub = parser.add_subparsers(dest="command", required=True)
+    fetch = sub.add_parser("refresh", help="從證交所下載某年度休市日")
+    fetch.add_argument("--year", type=int, default=datetime.now().year)
+    close = sub.add_parser("close", help="新增臨時休市日 (如颱風)")
+    close.add_argument("day")
+    close.add_argument("--reason", default="颱風休市")
+    open_ = sub.add_parser("open", help="新增補行交易日")
+    open_.add_argument("day")
+    open_.add_argument("--reason", default="補行交易日")
+    sub.add_parser("status", help="顯示目前市場狀態")
+    args = parser.parse_args(argv)
+
+    if args.command == "refresh":
+        print(f"{refresh(args.year)} closed weekdays recorded for {args.year}")
+    elif args.command == "close":
+        add_closure(args.day, args.reason)
+    elif args.command == "open":
+        add_trading_day(args.day, args.reason)
+    elif args.command == "status":
+        now = now_taipei()
+        print(f"now={now:%Y-%m-%d %H:%M} trading_day={is_trading_day(now)} in_session={in_session(now)} "
+              f"bars_epoch={bars_epoch(now)} flows_epoch={flows_epoch(now)}")
+
+
+if __name__ == "__main__":
+    main()
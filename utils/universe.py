@@ -0,0 +1,188 @@
+import os
+import argparse
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from utils import symbols, trading_calendar
+
+# 股票池：由股票主檔 (上市 + 上櫃) 出發，先用便宜的統計量篩掉冷門股，再交給指標運算
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STATS_FILE = os.path.join(BASE_DIR, "data", "universe_stats.parquet")
+
+# 計算平均成交值的 K 棒數，以及建立統計量時抓取的期間
+STATS_WINDOW = 20
+STATS_PERIOD = "3mo"
+
+# 預設只納入普通股 (含創新板)，ETF、特別股等不列入掃描
+STOCK_TYPES = ("股票", "創新板")
+
+# 具名股票池：標籤與預先篩選條件
+UNIVERSES = {
+    "liquid300": {
+        "label": "流動性前 300 大",
+        "filters": {"min_price": 10, "min_listing_days": 180, "top": 300},
+    },
+    "tradable": {
+        "label": "日均成交值 5000 萬以上",
+        "filters": {"min_avg_value": 5e7, "min_price": 10, "min_listing_days": 180},
+    },
+    "all": {
+        "label": "全市場 (上市 + 上櫃)",
+        "filters": {},
+    },
+}
+
+_universe_cache = {}
+
+
+def listed_symbols(types=STOCK_TYPES):
+    """
+    Every listed TWSE (.TW) and TPEx (.TWO) symbol of the given security types.
+    """
+    master = symbols.master_frame()
+    if types:
+        master = master[master["type"].isin(types)]
+    return master["symbol"].tolist()
+
+
+def compute_stats(data_dict, window=STATS_WINDOW):
+    """
+    Cheap per-symbol statistics from raw bars: average traded value over the
+    last `window` bars, last close and bar count, joined with the listing date.
+    """
+    rows = []
+    for sym, df in data_dict.items():
+        if df is None or df.empty:
+            continue
+        close = df['Close'].to_numpy(dtype=float)[-window:]
+        volume = df['Volume'].to_numpy(dtype=float)[-window:]
+        rows.append({
+            "symbol": sym,
+            "avg_value": float(np.nanmean(close * volume)),
+            "last_close": float(close[-1]),
+            "last_date": df.index[-1].strftime("%Y-%m-%d"),
+            "bars": int(len(df)),
+        })
+    stats = pd.DataFrame(rows, columns=["symbol", "avg_value", "last_close", "last_date", "bars"])
+    master = symbols.master_frame(status=None)[["symbol", "market", "type", "listed_date"]]
+    stats = stats.merge(master, on="symbol", how="left")
+    stats["listed_date"] = pd.to_datetime(stats["listed_date"], format="%Y/%m/%d", errors="coerce")
+    # 記錄建立時間 (不只日期)，收盤前建立的統計量在收盤定稿後就不再算新
+    stats["updated"] = datetime.now().isoformat(timespec="seconds")
+    return stats.set_index("symbol")
+
+
+def refresh_stats(symbol_list=None, period=STATS_PERIOD):
+    """
+    Update the bar store for the whole listing (delta fetches after the first run),
+    recompute the statistics and persist them. Returns (stats, failed symbols).
+    When nothing could be fetched (offline, provider down) the stored statistics
+    are kept and returned instead.
+    """
+    from utils.fetcher import fetch_stocks_bulk
+
+    symbol_list = symbol_list or listed_symbols()
+    data_dict, failed = fetch_stocks_bulk(symbol_list, period=period)
+    stats = compute_stats(data_dict)
+    if stats.empty:
+        # 全部抓取失敗時不要以空表覆蓋先前的統計量
+        print(f"Universe stats refresh got no data ({len(failed)} symbols failed); keeping the stored stats")
+        previous = load_stats()
+        return (previous if previous is not None else stats), failed
+    os.makedirs(os.path.dirname(STATS_FILE), exist_ok=True)
+    tmp_file = STATS_FILE + ".tmp"
+    stats.to_parquet(tmp_file)
+    os.replace(tmp_file, STATS_FILE)
+    _universe_cache.clear()
+    return stats, failed
+
+
+def load_stats():
+    """
+    The persisted statistics, or None if they have not been built yet.
+    """
+    if not os.path.exists(STATS_FILE):
+        return None
+    try:
+        return pd.read_parquet(STATS_FILE)
+    except Exception as e:
+        print(f"Error reading universe stats: {e}")
+        return None
+
+
+def stats_updated(stats):
+    if stats is None or stats.empty:
+        return None
+    return stats["updated"].iloc[0]
+
+
+def stats_fresh(stats, now=None):
+    """
+    True if the statistics were built after the latest final close, as Snapshot.is_fresh.
+    """
+    updated = stats_updated(stats)
+    if updated is None:
+        return False
+    return trading_calendar.now_taipei(pd.Timestamp(updated)) >= trading_calendar.last_final_close(now)
+
+
+def prefilter(stats, min_avg_value=None, min_listing_days=None, min_price=None,
+              types=STOCK_TYPES, top=None, today=None):
+    """
+    Symbols passing the cheap filters, ordered by average traded value (largest first).
+    """
+    mask = pd.Series(True, index=stats.index)
+    if types:
+        mask &= stats["type"].isin(types)
+    if min_avg_value is not None:
+        mask &= stats["avg_value"] >= min_avg_value
+    if min_price is not None:
+        mask &= stats["last_close"] >= min_price
+    if min_listing_days is not None:
+        today = pd.Timestamp(today or datetime.now()).normalize()
+        # 上市日期不明的股票視為已上市夠久
+        age = (today - stats["listed_date"]).dt.days
+        mask &= age.isna() | (age >= min_listing_days)
+    selected = stats[mask].sort_values("avg_value", ascending=False)
+    if top is not None:
+        selected = selected.head(top)
+    return selected.index.tolist()
+
+
+def get_universe(name, stats=None):
+    """
+    Symbols of a named universe, cached until the statistics are rebuilt.
+    """
+    if name not in UNIVERSES:
+        raise ValueError(f"Unknown universe: {name}")
+    stats = stats if stats is not None else load_stats()
+    if stats is None:
+        return []
+    key = (name, stats_updated(stats), len(stats))
+    if key not in _universe_cache:
+        _universe_cache[key] = prefilter(stats, **UNIVERSES[name]["filters"])
+    return _universe_cache[key]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="全市場股票池維護")
+    sub = parser.add_subparsers(dest="command", required=True)
+    refresh = sub.add_parser("refresh", help="更新全市場 K 線與流動性統計")
+    refresh.add_argument("--period", default=STATS_PERIOD)
+    show = sub.add_parser("list", help="列出具名股票池")
+    show.add_argument("name", choices=list(UNIVERSES))
+    args = parser.parse_args(argv)
+
+    if args.command == "refresh":
+        stats, failed = refresh_stats(period=args.period)
+        print(f"{len(stats)} symbols with stats, {len(failed)} failed")
+    elif args.command == "list":
+        members = get_universe(args.name)
+        print(f"{UNIVERSES[args.name]['label']}: {len(members)} symbols")
+        print(" ".join(members))
+
+
+if __name__ == "__main__":
+    main()